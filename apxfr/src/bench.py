@@ -0,0 +1,295 @@
+#!/usr/bin/env python
+
+"""Benchmark the uploaders end to end against local stand-in servers."""
+
+from __future__ import annotations
+import argparse
+import contextlib
+from datetime import datetime, timedelta
+import itertools
+import json
+import logging
+import os
+from pathlib import Path
+import sys
+import tempfile
+import threading
+
+import harness
+import report
+from standins import PutHandler, S3Handler, SshSink, StandInServer, Throttle
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """Build an argument parser for command-line options."""
+
+    def floats(text):
+        return [float(x) for x in text.split(",")]
+
+    def ints(text):
+        return [int(x) for x in text.split(",")]
+
+    parser = argparse.ArgumentParser(
+        description="Benchmark uploaders against local stand-in servers."
+    )
+    parser.add_argument('-T', '--transports', default="http,boto,minio,scp",
+                        help="comma-separated transports to benchmark")
+    parser.add_argument('-m', '--sizes', metavar='MB', type=floats,
+                        default=[16.0],
+                        help="comma-separated image sizes in MB")
+    parser.add_argument('-c', '--ccds', type=ints, default=[1, 4],
+                        help="comma-separated CCD counts")
+    parser.add_argument('-l', '--latency', metavar='SECONDS', type=floats,
+                        default=[0.0],
+                        help="comma-separated latencies added per request")
+    parser.add_argument('-b', '--bandwidth', metavar='MB/s', type=floats,
+                        default=[0.0],
+                        help="comma-separated bandwidth limits (0 for none)")
+    parser.add_argument('--stall', metavar='SECONDS', type=float, default=0.0,
+                        help="delay added to stalled requests")
+    parser.add_argument('--stall-rate', type=float, default=0.0,
+                        help="fraction of requests that stall")
+    parser.add_argument('--timeout', metavar='SECONDS', type=float,
+                        help="harness upload attempt timeout")
+    parser.add_argument('--retries', type=int, default=0,
+                        help="harness upload retries")
+    parser.add_argument('--hedge', metavar='PERCENTILE', type=float,
+                        help="harness hedging percentile")
+    parser.add_argument('--warm', metavar='CONNECTIONS', type=int, default=1,
+                        help="harness connections opened before the start")
+    parser.add_argument('--ping', metavar='SECONDS', type=float,
+                        help="harness interval between connection refreshes")
+    parser.add_argument('--handshake', metavar='SECONDS', type=float,
+                        default=0.0,
+                        help="ssh connection setup delay for scp")
+    parser.add_argument('--sessions', type=int, default=0,
+                        help="harness persistent ssh sessions for scp")
+    parser.add_argument('-n', '--numexp', metavar='EXPOSURES', type=int,
+                        default=3, help="number of exposures per case")
+    parser.add_argument('-i', '--interval', type=int, default=2,
+                        help="interval between exposures in sec")
+    parser.add_argument('-t', '--tempdir', type=Path,
+                        default=Path(tempfile.gettempdir()),
+                        help="temporary directory")
+    parser.add_argument('-S', '--staging', choices=("file", "memory"),
+                        default="memory", help="staging mode for the harness")
+    parser.add_argument('-p', '--parts', metavar='STREAMS', type=int,
+                        default=0, help="parallel part streams per upload")
+    parser.add_argument('--partsize', metavar='MB', type=int, default=8,
+                        help="part size in MB for parallel uploads")
+    parser.add_argument('-z', '--compress', default="none",
+                        help=("comma-separated compression modes: none, or a"
+                              " harness --compressor (fpack, tiled, stream)"))
+    parser.add_argument('-k', '--checksum', default="none",
+                        help=("comma-separated checksums: none, or a harness"
+                              " --checksum (md5, crc32c)"))
+    parser.add_argument('-a', '--layout', default="ccd",
+                        help=("comma-separated upload layouts: ccd for an"
+                              " object per CCD, exposure for a container per"
+                              " exposure"))
+    parser.add_argument('-Q', '--pipeline', metavar='DEPTH', type=int,
+                        default=0, help="exposures staged ahead of upload")
+    parser.add_argument('-j', '--json', action='store_true',
+                        help="write results as JSON")
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help="show harness log messages")
+    return parser
+
+
+def make_image(path: Path, size: int) -> None:
+    """Write a synthetic 16-bit FITS image of roughly ``size`` bytes.
+
+    The pixels are noise with a constant high byte, so that the image
+    compresses about as well as a real sky image.
+    """
+    width = 4096
+    height = max(1, size // (2 * width))
+    cards = [
+        "SIMPLE  =                    T",
+        "BITPIX  =                   16",
+        "NAXIS   =                    2",
+        f"NAXIS1  = {width:>20}",
+        f"NAXIS2  = {height:>20}",
+        "END",
+    ]
+    header = "".join(card.ljust(80) for card in cards).encode()
+    header += b" " * (-len(header) % 2880)
+    data = bytearray(os.urandom(2 * width * height))
+    data[0::2] = b"\x03" * (width * height)
+    data += b"\0" * (-len(data) % 2880)
+    path.write_bytes(header + data)
+
+
+def run_case(destination: str, inputfile: Path, ccds: int, compress: str,
+             checksum: str, layout: str, args: argparse.Namespace,
+             events_path: Path) -> dict:
+    """Run the harness for one benchmark case and summarize its telemetry.
+
+    Parameters
+    ----------
+    destination: `str`
+        Destination URI for the harness.
+    inputfile: `pathlib.Path`
+        Image to transfer.
+    ccds: `int`
+        Number of CCDs to simulate.
+    compress: `str`
+        ``none``, or the harness compressor to use.
+    checksum: `str`
+        ``none``, or the checksum to send with each upload.
+    layout: `str`
+        ``ccd`` to upload each CCD separately, or ``exposure`` to upload a
+        container per exposure.
+    args: `argparse.Namespace`
+        Benchmark options.
+    events_path: `pathlib.Path`
+        File to receive telemetry for this case.
+
+    Returns
+    -------
+    summary: `dict`
+        Output of `report.summarize` for the case.
+    """
+    options = harness.TransferOptions(
+        parts=args.parts,
+        part_size=args.partsize*1024*1024,
+        connections=max(10, ccds * max(1, args.parts)),
+        secure=False,
+        checksum=checksum if checksum != "none" else None,
+        timeout=args.timeout,
+        retries=args.retries,
+        hedge=args.hedge,
+        warm=args.warm,
+        ping=args.ping,
+        sessions=args.sessions,
+    )
+    # Leave time for the uploader to connect before the first exposure.
+    start = datetime.now() + timedelta(seconds=2)
+    harness.events.open(events_path)
+    try:
+        # Keep the harness's diagnostic output out of the results.
+        with contextlib.redirect_stdout(sys.stderr):
+            harness.simulate_threads(
+                [f"bench-{ccd}" for ccd in range(ccds)],
+                destination,
+                options,
+                starttime=start.strftime("%H:%M:%S"),
+                interval=args.interval,
+                tempdir=args.tempdir,
+                numexp=args.numexp,
+                inputfile=inputfile,
+                compress=(compress != "none"),
+                compressor=compress if compress != "none" else "fpack",
+                # fpack can only compress staged files.
+                staging="file" if compress == "fpack" else args.staging,
+                pipeline=args.pipeline,
+                aggregate=(layout == "exposure"),
+            )
+    finally:
+        harness.events.close()
+    return report.summarize(report.read_events([events_path]))
+
+
+def print_results(results: list[dict], out=sys.stdout) -> None:
+    """Print benchmark results as a table."""
+    print(f"{'transport':<9} {'layout':<8} {'zip':<6} {'sum':<6} {'MB':>6}"
+          f" {'ccds':>4}"
+          f" {'lat s':>6} {'MB/s':>6} {'reqs':>5} {'zip p50':>7}"
+          f" {'sum p50':>7} {'p50':>7} {'p95':>7} {'p99':>7}"
+          f" {'tot MB/s':>9} {'late':>5} {'hedged':>7}", file=out)
+    for r in results:
+        upload = r["summary"]["phases"].get("upload", {})
+        compress = r["summary"]["phases"].get("compress", {})
+        checksum = r["summary"]["phases"].get("checksum", {})
+        total = upload.get("total_mbps")
+        hedges = r["summary"]["hedges"]
+        print(f"{r['transport']:<9} {r['layout']:<8} {r['compress']:<6}"
+              f" {r['checksum']:<6}"
+              f" {r['size_mb']:>6.1f} {r['ccds']:>4}"
+              f" {r['latency']:>6.3f} {r['bandwidth'] or '-':>6}"
+              f" {r['requests']:>5}"
+              f" {compress.get('p50', float('nan')):>7.3f}"
+              f" {checksum.get('p50', float('nan')):>7.3f}"
+              f" {upload.get('p50', float('nan')):>7.3f}"
+              f" {upload.get('p95', float('nan')):>7.3f}"
+              f" {upload.get('p99', float('nan')):>7.3f}"
+              f" {'-' if total is None else f'{total:.1f}':>9}"
+              f" {r['summary']['deadlines']['missed']:>5}"
+              f" {hedges['won']:>3}/{hedges['fired']:<3}", file=out)
+
+
+def main():
+    """Main program."""
+    args = build_parser().parse_args()
+    logging.basicConfig(
+        format="{threadName} {asctime} {message}",
+        style="{",
+        level="INFO" if args.verbose else "WARNING"
+    )
+    # Exposure containers are named after the thread running the CCDs.
+    threading.current_thread().name = "bench"
+    # The S3 stand-in does not check credentials, but boto3 needs some.
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "standin")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "standin")
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+
+    results = []
+    with tempfile.TemporaryDirectory(dir=args.tempdir) as work:
+        work = Path(work)
+        throttle = Throttle(stall=args.stall, stall_rate=args.stall_rate)
+        http = StandInServer(PutHandler, work / "http", throttle).start()
+        s3 = StandInServer(S3Handler, work / "s3", throttle).start()
+        ssh = SshSink(work / "ssh", throttle, args.handshake).start()
+        servers = dict(http=http, boto=s3, minio=s3, scp=None)
+        try:
+            cases = itertools.product(args.transports.split(","),
+                                      args.layout.split(","),
+                                      args.compress.split(","),
+                                      args.checksum.split(","), args.sizes,
+                                      args.ccds, args.latency, args.bandwidth)
+            for n, (transport, layout, compress, checksum, size, ccds,
+                    latency, bandwidth) in enumerate(cases):
+                throttle.latency = latency
+                throttle.bandwidth = bandwidth * 1e6
+                ssh.update()
+                prefix = f"case{n}"
+                destination = {
+                    "http": f"http://{http.address}/{prefix}",
+                    "boto": f"boto://{s3.address}/bench/{prefix}",
+                    "minio": f"minio://{s3.address}/bench/{prefix}",
+                    "scp": f"scp://standin/{prefix}",
+                }[transport]
+                inputfile = work / f"image-{size}.fits"
+                if not inputfile.exists():
+                    make_image(inputfile, int(size * 1e6))
+                server = servers[transport]
+                before = server.requests if server else 0
+                summary = run_case(destination, inputfile, ccds, compress,
+                                   checksum, layout, args,
+                                   work / f"events-{n}.jsonl")
+                results.append(dict(
+                    transport=transport,
+                    layout=layout,
+                    compress=compress,
+                    checksum=checksum,
+                    size_mb=size,
+                    ccds=ccds,
+                    latency=latency,
+                    bandwidth=bandwidth,
+                    requests=(server.requests - before) if server else 0,
+                    summary=summary,
+                ))
+        finally:
+            http.shutdown()
+            s3.shutdown()
+            ssh.stop()
+
+    if args.json:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    else:
+        print_results(results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+
+"""Indexed containers holding all the CCD images of an exposure.
+
+A container is the member files concatenated, followed by a JSON index of
+their names, offsets and sizes, followed by a fixed-size footer giving the
+offset and length of the index.  A consumer can therefore fetch a single
+CCD with three range requests (footer, index, member) instead of
+downloading the whole container, and the members need no copying or
+re-encoding to be packed.
+"""
+
+from __future__ import annotations
+import argparse
+import json
+from pathlib import Path
+import struct
+import sys
+from typing import Callable, Iterable
+import urllib.request
+
+
+MAGIC = b"APXFRIDX"
+# Magic, index offset, index length.
+FOOTER = struct.Struct(">8sQQ")
+VERSION = 1
+
+# Called as ``fetch(start, end)`` to return bytes ``start`` to ``end`` of a
+# container; a negative ``start`` with ``end`` of None returns the last
+# ``-start`` bytes, like an HTTP suffix range.
+Fetch = Callable[[int, "int | None"], bytes]
+
+
+def pack(members: Iterable[tuple[str, bytes | memoryview]]) -> list:
+    """Lay out a container.
+
+    Parameters
+    ----------
+    members: iterable of `tuple` [`str`, bytes-like]
+        Names and contents of the member files, in order.
+
+    Returns
+    -------
+    chunks: `list` of bytes-like
+        The member contents followed by the index and footer; their
+        concatenation is the container.
+    """
+    chunks = []
+    index = []
+    offset = 0
+    for name, data in members:
+        size = memoryview(data).nbytes
+        index.append(dict(name=name, offset=offset, size=size))
+        chunks.append(data)
+        offset += size
+    encoded = json.dumps(dict(version=VERSION, members=index)).encode()
+    chunks.append(encoded + FOOTER.pack(MAGIC, offset, len(encoded)))
+    return chunks
+
+
+def read_index(fetch: Fetch) -> dict[str, tuple[int, int]]:
+    """Read the index of a container.
+
+    Parameters
+    ----------
+    fetch: callable
+        Returns byte ranges of the container; see `Fetch`.
+
+    Returns
+    -------
+    index: `dict` [`str`, `tuple` [`int`, `int`]]
+        Offset and size of each member, by name.
+
+    Raises
+    ------
+    RuntimeError
+        Raised if the footer or index is not valid.
+    """
+    footer = fetch(-FOOTER.size, None)
+    if len(footer) != FOOTER.size:
+        raise RuntimeError("Container is too short")
+    magic, offset, length = FOOTER.unpack(footer)
+    if magic != MAGIC:
+        raise RuntimeError(f"Not a container: bad magic {magic!r}")
+    index = json.loads(fetch(offset, offset + length))
+    if index.get("version") != VERSION:
+        raise RuntimeError(f"Unknown container version {index.get('version')}")
+    return {m["name"]: (m["offset"], m["size"]) for m in index["members"]}
+
+
+def read_member(fetch: Fetch, index: dict[str, tuple[int, int]],
+                name: str) -> bytes:
+    """Read one member of a container, given its index."""
+    offset, size = index[name]
+    return fetch(offset, offset + size)
+
+
+def file_fetcher(path: Path) -> Fetch:
+    """Return a `Fetch` for a local container file."""
+
+    def fetch(start: int, end: int | None) -> bytes:
+        with open(path, "rb") as f:
+            if start < 0:
+                f.seek(start, 2)
+                return f.read()
+            f.seek(start)
+            return f.read(end - start)
+
+    return fetch
+
+
+def http_fetcher(url: str) -> Fetch:
+    """Return a `Fetch` issuing HTTP range requests for a container."""
+
+    def fetch(start: int, end: int | None) -> bytes:
+        spec = f"{start}" if start < 0 else f"{start}-{end - 1}"
+        request = urllib.request.Request(url,
+                                         headers={"Range": f"bytes={spec}"})
+        with urllib.request.urlopen(request) as response:
+            return response.read()
+
+    return fetch
+
+
+def s3_fetcher(client, bucket: str, key: str) -> Fetch:
+    """Return a `Fetch` issuing ranged GETs with a boto3 S3 client."""
+
+    def fetch(start: int, end: int | None) -> bytes:
+        spec = f"{start}" if start < 0 else f"{start}-{end - 1}"
+        response = client.get_object(Bucket=bucket, Key=key,
+                                     Range=f"bytes={spec}")
+        return response["Body"].read()
+
+    return fetch
+
+
+def main():
+    """List or extract the members of a container."""
+    parser = argparse.ArgumentParser(
+        description="List or extract the members of an exposure container."
+    )
+    parser.add_argument('container',
+                        help="container file, or http(s) URL")
+    parser.add_argument('-x', '--extract', metavar='NAME', nargs='*',
+                        help="members to extract (all if none are given)")
+    parser.add_argument('-o', '--outdir', type=Path, default=Path("."),
+                        help="directory for extracted members")
+    args = parser.parse_args()
+
+    if args.container.startswith(("http://", "https://")):
+        fetch = http_fetcher(args.container)
+    else:
+        fetch = file_fetcher(Path(args.container))
+    index = read_index(fetch)
+    if args.extract is None:
+        for name, (offset, size) in index.items():
+            print(f"{offset:>12} {size:>12} {name}")
+        return
+    for name in args.extract or index:
+        if name not in index:
+            sys.exit(f"No member {name}")
+        path = args.outdir / Path(name).name
+        path.write_bytes(read_member(fetch, index, name))
+        print(f"Extracted {path}")
+
+
+if __name__ == "__main__":
+    main()
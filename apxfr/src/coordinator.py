@@ -0,0 +1,297 @@
+#!/usr/bin/env python
+
+"""Coordinate a multi-node run of harness.py.
+
+Workers (``harness.py --coordinator HOST:PORT``) connect and register the
+number of CCDs they simulate.  The coordinator measures the offset of each
+worker's clock from its own, assigns each worker a node number and a range
+of CCD numbers, and broadcasts a start time, corrected for each worker's
+clock offset, so that all nodes trigger their exposures together.  When the
+run ends, the workers send their telemetry back, and the coordinator merges
+it into one file, with wall-clock times corrected to its own clock, and
+summarizes it.
+
+Messages are JSON objects, one per line, over a TCP connection held by each
+worker for the whole run:
+
+* worker: ``{"op": "register", "host": ..., "ccds": N}``
+* coordinator: ``{"op": "time"}``, repeated; the worker answers each with
+  ``{"op": "time", "time": <its time.time()>}``
+* coordinator: ``{"op": "assign", "node": ..., "first": ..., "count": ...,
+  "starttime": "HH:MM:SS", "epoch": ..., "offset": ...}``
+* worker: ``{"op": "events", "records": [...]}``, repeated, then
+  ``{"op": "done"}``
+"""
+
+from __future__ import annotations
+import argparse
+from datetime import datetime
+import json
+import logging
+import math
+from pathlib import Path
+import socket
+import sys
+import threading
+import time
+from typing import Iterable
+
+
+# Number of clock samples taken from each worker.
+SAMPLES = 8
+
+# Telemetry records sent per message.
+BATCH = 1000
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """Build an argument parser for command-line options."""
+
+    parser = argparse.ArgumentParser(
+        description="Coordinate a multi-node run of harness.py."
+    )
+    parser.add_argument('-w', '--workers', type=int, required=True,
+                        help="number of harness workers to wait for")
+    parser.add_argument('-H', '--host', default="",
+                        help="address to listen on")
+    parser.add_argument('-p', '--port', type=int, default=7117,
+                        help="port to listen on")
+    parser.add_argument('-l', '--lead', metavar='SECONDS', type=float,
+                        default=10.0,
+                        help=("time from the last registration to the first"
+                              " exposure"))
+    parser.add_argument('-e', '--events', type=Path,
+                        help="write the merged telemetry to this file")
+    parser.add_argument('-j', '--json', action='store_true',
+                        help="write the summary as JSON")
+    return parser
+
+
+def send(stream, message: dict) -> None:
+    """Write one message to a socket stream."""
+    stream.write(json.dumps(message).encode() + b"\n")
+    stream.flush()
+
+
+def receive(stream) -> dict:
+    """Read one message from a socket stream.
+
+    Raises
+    ------
+    RuntimeError
+        Raised if the connection was closed.
+    """
+    line = stream.readline()
+    if not line:
+        raise RuntimeError("Connection closed")
+    return json.loads(line)
+
+
+class Worker:
+    """Harness side of a coordinated run.
+
+    Parameters
+    ----------
+    address: `str`
+        Coordinator address, as ``host:port``.
+    """
+
+    def __init__(self, address: str):
+        host, port = address.rsplit(":", 1)
+        self.sock = socket.create_connection((host, int(port)))
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.stream = self.sock.makefile("rwb")
+
+    def register(self, host: str, ccds: int) -> dict:
+        """Register with the coordinator and wait for the run to start.
+
+        Parameters
+        ----------
+        host: `str`
+            Name of this node.
+        ccds: `int`
+            Number of CCDs this worker simulates.
+
+        Returns
+        -------
+        assignment: `dict`
+            ``node`` number, ``first`` CCD number and ``count``, the
+            ``starttime`` from which sequence numbers are derived, the start
+            ``epoch`` in this node's clock, and the measured clock
+            ``offset``.
+        """
+        send(self.stream, dict(op="register", host=host, ccds=ccds))
+        while (message := receive(self.stream))["op"] == "time":
+            send(self.stream, dict(op="time", time=time.time()))
+        if message["op"] != "assign":
+            raise RuntimeError(f"Unexpected message {message}")
+        return message
+
+    def report(self, records: Iterable[dict]) -> None:
+        """Send telemetry records to the coordinator and disconnect."""
+        batch = []
+        for record in records:
+            batch.append(record)
+            if len(batch) == BATCH:
+                send(self.stream, dict(op="events", records=batch))
+                batch = []
+        if batch:
+            send(self.stream, dict(op="events", records=batch))
+        send(self.stream, dict(op="done"))
+        self.stream.close()
+        self.sock.close()
+
+
+class Registration:
+    """Coordinator side of a worker connection.
+
+    Parameters
+    ----------
+    conn: `socket.socket`
+        Connection from the worker.
+    """
+
+    def __init__(self, conn: socket.socket):
+        self.conn = conn
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.stream = conn.makefile("rwb")
+        message = receive(self.stream)
+        if message["op"] != "register":
+            raise RuntimeError(f"Unexpected message {message}")
+        self.host = message["host"]
+        self.ccds = message["ccds"]
+        self.offset, self.rtt = self.measure()
+        self.node = None
+        self.first = None
+        self.records = []
+
+    def measure(self) -> tuple[float, float]:
+        """Measure the offset of the worker's clock from ours.
+
+        The worker's reading is assumed to have been taken halfway through
+        the round trip, as in NTP; the sample with the shortest round trip
+        has the smallest error.
+
+        Returns
+        -------
+        offset: `float`
+            Worker clock minus coordinator clock, in seconds.
+        rtt: `float`
+            Round-trip time of the sample used; the offset is accurate to
+            half of this.
+        """
+        best = (math.nan, math.inf)
+        for _ in range(SAMPLES):
+            start = time.time()
+            send(self.stream, dict(op="time"))
+            reading = receive(self.stream)["time"]
+            end = time.time()
+            if end - start < best[1]:
+                best = (reading - (start + end) / 2, end - start)
+        return best
+
+    def assign(self, node: int, first: int, epoch: float) -> None:
+        """Send the worker its CCD range and start time."""
+        self.node = node
+        self.first = first
+        send(self.stream, dict(
+            op="assign",
+            node=node,
+            first=first,
+            count=self.ccds,
+            starttime=datetime.fromtimestamp(epoch).strftime("%H:%M:%S"),
+            epoch=epoch + self.offset,
+            offset=self.offset,
+        ))
+
+    def collect(self) -> None:
+        """Receive the worker's telemetry, correcting it to our clock."""
+        while (message := receive(self.stream))["op"] == "events":
+            for record in message["records"]:
+                record["wall"] -= self.offset
+                record["node"] = self.node
+                self.records.append(record)
+        self.conn.close()
+
+
+def coordinate(listener: socket.socket, workers: int,
+               lead: float) -> list[Registration]:
+    """Run a coordinated benchmark.
+
+    Parameters
+    ----------
+    listener: `socket.socket`
+        Listening socket for worker connections.
+    workers: `int`
+        Number of workers to wait for.
+    lead: `float`
+        Seconds from the last registration to the first exposure.
+
+    Returns
+    -------
+    registrations: `list` [`Registration`]
+        The workers, with their collected telemetry.
+    """
+    registrations = []
+    while len(registrations) < workers:
+        conn, address = listener.accept()
+        registration = Registration(conn)
+        logging.info(f"Registered {registration.host} from {address[0]}:"
+                     f" {registration.ccds} CCDs, clock offset"
+                     f" {registration.offset:.6f} +/-"
+                     f" {registration.rtt / 2:.6f}")
+        registrations.append(registration)
+
+    # Whole seconds, so that the start time is exact as HH:MM:SS.
+    epoch = math.ceil(time.time() + lead)
+    first = 0
+    for node, registration in enumerate(registrations):
+        registration.assign(node, first, epoch)
+        first += registration.ccds
+    logging.info(f"Starting {first} CCDs on {workers} workers at"
+                 f" {datetime.fromtimestamp(epoch)}")
+
+    threads = [threading.Thread(target=r.collect, name=r.host)
+               for r in registrations]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return registrations
+
+
+def main():
+    """Main program."""
+    args = build_parser().parse_args()
+    logging.basicConfig(format="{asctime} {message}", style="{",
+                        level="INFO")
+    listener = socket.create_server((args.host, args.port))
+    logging.info(f"Waiting for {args.workers} workers on port {args.port}")
+    registrations = coordinate(listener, args.workers, args.lead)
+    listener.close()
+
+    records = [record for r in registrations for record in r.records]
+    if args.events is not None:
+        with args.events.open("w") as f:
+            for record in records:
+                print(json.dumps(record), file=f)
+
+    import report
+
+    nodes = [dict(node=r.node, host=r.host, first=r.first, ccds=r.ccds,
+                  offset=r.offset, rtt=r.rtt) for r in registrations]
+    summary = report.summarize(records)
+    if args.json:
+        json.dump(dict(nodes=nodes, summary=summary), sys.stdout, indent=2)
+        print()
+        return
+    print(f"{'node':>4} {'host':<20} {'CCDs':>9} {'offset':>10} {'rtt':>9}")
+    for node in nodes:
+        ccds = f"{node['first']}-{node['first'] + node['ccds'] - 1}"
+        print(f"{node['node']:>4} {node['host']:<20} {ccds:>9}"
+              f" {node['offset']:>10.6f} {node['rtt']:>9.6f}")
+    report.print_summary(summary)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,17 +3,44 @@
 from __future__ import annotations
 import abc
 import argparse
+import base64
+from collections import deque
+from concurrent.futures import (FIRST_COMPLETED, Future, ThreadPoolExecutor,
+                                wait)
+import contextlib
+from dataclasses import dataclass
 from datetime import datetime, timedelta
+import fcntl
 import functools
+import hashlib
+import io
+import itertools
+import json
 import logging
+import math
+import mmap
 import os
 from pathlib import Path
+import queue
+import random
 import re
 import socket
 import subprocess
 import tempfile
+import threading
 import time
-from urllib3.connection import HTTPConnection
+from typing import Iterable, Iterator
+import uuid
+from urllib3.connection import HTTPSConnection
+
+
+# Block size for reads that also update a checksum, small enough that each
+# block is still in the CPU cache when it is hashed.
+CHECKSUM_BLOCK = 1024*1024
+
+# Suffix of the temporary names that files written in place on a remote
+# filesystem have until they are complete and renamed.
+PARTIAL_SUFFIX = ".partial"
 
 
 def build_parser() -> argparse.ArgumentParser:
@@ -26,8 +53,9 @@ def build_parser() -> argparse.ArgumentParser:
                         help=("URL with"
                               " gsapi, boto, minio, https, http, bbcp, scp"
                               " scheme"))
-    parser.add_argument('-s', '--starttime', metavar='HH:MM', required=True,
-                        help="local time to start simulation")
+    parser.add_argument('-s', '--starttime', metavar='HH:MM[:SS]',
+                        help=("local time to start simulation (required"
+                              " without --coordinator)"))
     parser.add_argument('-n', '--numexp', metavar='EXPOSURES', type=int,
                         required=True, help="number of exposures to simulate")
     parser.add_argument('-c', '--ccds', metavar='CCDS', type=int,
@@ -40,10 +68,76 @@ def build_parser() -> argparse.ArgumentParser:
                         help="temporary directory")
     parser.add_argument('-z', '--compress', action='store_true',
                         help="compress before transfer")
+    parser.add_argument('-Z', '--compressor',
+                        choices=("fpack", "tiled", "stream"), default="fpack",
+                        help=("compress with an fpack subprocess, with"
+                              " in-process parallel tile compression, or"
+                              " with tile compression streamed to the"
+                              " uploader"))
+    parser.add_argument('-S', '--staging', choices=("file", "memory"),
+                        default="file",
+                        help=("stage images in the temporary directory"
+                              " or in an in-memory buffer"))
+    parser.add_argument('-p', '--parts', metavar='STREAMS', type=int,
+                        default=0,
+                        help=("upload each image in parts over this many"
+                              " concurrent streams (0 for a single stream)"))
+    parser.add_argument('--partsize', metavar='MB', type=int, default=8,
+                        help="part size in MB for parallel uploads")
+    parser.add_argument('-E', '--engine', choices=("fork", "thread"),
+                        default="fork",
+                        help=("run each CCD in a forked process with its own"
+                              " uploader, or in a thread sharing one uploader"))
+    parser.add_argument('-A', '--aggregate', action='store_true',
+                        help=("upload the CCDs of each exposure as one"
+                              " indexed container (requires --engine thread)"))
+    parser.add_argument('-C', '--connections', type=int, default=10,
+                        help="maximum connections in each uploader's pool")
+    parser.add_argument('-Q', '--pipeline', metavar='DEPTH', type=int,
+                        default=0,
+                        help=("stage up to this many exposures ahead of the"
+                              " upload in progress (0 to run serially)"))
+    parser.add_argument('-k', '--checksum', choices=("md5", "crc32c"),
+                        help=("compute this checksum while staging and send"
+                              " it with each upload for verification"))
+    parser.add_argument('-T', '--timeout', metavar='SECONDS', type=float,
+                        help="abandon upload attempts after this long")
+    parser.add_argument('-R', '--retries', type=int, default=0,
+                        help="retry failed or abandoned uploads this often")
+    parser.add_argument('--backoff', metavar='SECONDS', type=float,
+                        default=0.5,
+                        help=("maximum delay before the first retry, doubling"
+                              " for each later one"))
+    parser.add_argument('-H', '--hedge', metavar='PERCENTILE', type=float,
+                        help=("start a duplicate upload once an upload takes"
+                              " longer than this percentile of recent ones"))
+    parser.add_argument('-D', '--deadline', metavar='SECONDS', type=float,
+                        help=("time after each exposure by which its upload"
+                              " should finish (default: interval)"))
+    parser.add_argument('-e', '--events', metavar='FILE', type=Path,
+                        help="append JSON telemetry records to this file")
+    parser.add_argument('--coordinator', metavar='HOST:PORT',
+                        help=("take the start time and CCD numbers from a"
+                              " coordinator and send it the telemetry"))
+    parser.add_argument('-U', '--insecure', action='store_true',
+                        help="use plain HTTP for boto and minio endpoints")
     parser.add_argument('-P', '--private', action='store_true',
                         help="use private Google Cloud interconnect")
     parser.add_argument('-K', '--keepalive', action='store_true',
                         help="use TCP keepalive options")
+    parser.add_argument('-W', '--warm', metavar='CONNECTIONS', type=int,
+                        default=1,
+                        help="connections to open before the first exposure")
+    parser.add_argument('--ping', metavar='SECONDS', type=float,
+                        help=("refresh the warm connections with lightweight"
+                              " requests this often"))
+    parser.add_argument('--sndbuf', metavar='KB', type=int,
+                        help="socket send buffer size")
+    parser.add_argument('--sessions', type=int, default=0,
+                        help=("persistent ssh sessions for scp"
+                              " (0 for one per part stream)"))
+    parser.add_argument('--nodelay', action=argparse.BooleanOptionalAction,
+                        default=True, help="set TCP_NODELAY on connections")
     return parser
 
 
@@ -61,13 +155,26 @@ class Waiter:
         The time to start the first exposure.
     interval: `int`
         Interval between exposures in seconds.
+    second: `int`, optional
+        Seconds past the minute to start the first exposure.
     """
 
-    def __init__(self, hour: int, minute: int, interval: int):
+    def __init__(self, hour: int, minute: int, interval: int,
+                 second: int = 0):
         self.base_time = datetime.now().replace(hour=hour, minute=minute,
-                                                second=0, microsecond=0)
+                                                second=second, microsecond=0)
         self.interval = interval
 
+    def exposure_time(self, num: int) -> datetime:
+        """Return the time at which the given exposure is triggered.
+
+        Parameters
+        ----------
+        num: `int`
+            Number of the exposure.
+        """
+        return self.base_time + timedelta(seconds=num * self.interval)
+
     def wait_exposure(self, num: int):
         """Wait for the given exposure number.
 
@@ -76,35 +183,230 @@ class Waiter:
         num: `int`
             Number of the exposure to wait for.
         """
-        when = self.base_time + timedelta(seconds=num * self.interval)
+        when = self.exposure_time(num)
+        start = time.monotonic()
         delay = (when - datetime.now()).total_seconds()
         delay_str = f"{abs(delay)} seconds for exposure {num} at {when}"
         if delay < 0:
             logging.info("Late " + delay_str)
+        else:
+            logging.info("Sleeping " + delay_str)
+            time.sleep(delay)
+        events.emit("wait", start, time.monotonic(), late=max(0.0, -delay))
+
+
+def schedule(starttime: str, interval: int,
+             epoch: float | None = None) -> tuple[Waiter, int]:
+    """Return the exposure schedule of a run and its first sequence number.
+
+    Parameters
+    ----------
+    starttime: `str`
+        Time in HH:MM or HH:MM:SS of the first exposure.
+    interval: `int`
+        Interval between exposures in seconds.
+    epoch: `float`, optional
+        Precise time of the first exposure, as from `time.time`; overrides
+        ``starttime``, which still determines the sequence numbers.
+
+    Returns
+    -------
+    waiter: `Waiter`
+        Schedule of exposure trigger times.
+    seqnum_start: `int`
+        Sequence number of the first exposure; exposure ``i`` has sequence
+        number ``seqnum_start + i``.
+    """
+    hour, minute, *second = starttime.split(":")
+    # Pick a sequence number that will not overlap with other runs.
+    seqnum_start = int(hour + minute) * 10
+    waiter = Waiter(int(hour), int(minute), interval,
+                    int(second[0]) if second else 0)
+    if epoch is not None:
+        waiter.base_time = datetime.fromtimestamp(epoch)
+    return waiter, seqnum_start
+
+
+class DeadlineTracker:
+    """Track exposures whose upload finishes after their deadline.
+
+    Parameters
+    ----------
+    waiter: `Waiter`
+        Schedule of exposure trigger times.
+    deadline: `float`
+        Seconds after its trigger time by which an exposure's upload should
+        be complete.
+    """
+
+    def __init__(self, waiter: Waiter, deadline: float):
+        self.waiter = waiter
+        self.deadline = deadline
+        self.count = 0
+        self.misses = []
+        self.failures = 0
+
+    def record(self, num: int) -> float:
+        """Record that the upload of an exposure has just finished.
+
+        Parameters
+        ----------
+        num: `int`
+            Number of the exposure.
+
+        Returns
+        -------
+        late: `float`
+            Seconds by which the deadline was missed; negative if it was met.
+        """
+        due = self.waiter.exposure_time(num) + timedelta(seconds=self.deadline)
+        late = (datetime.now() - due).total_seconds()
+        self.count += 1
+        now = time.monotonic()
+        events.emit("deadline", now, now, late=late)
+        if late > 0:
+            self.misses.append(late)
+            logging.info(f"Missed deadline for exposure {num} by {late}"
+                         " seconds")
+        return late
+
+    def fail(self, num: int) -> None:
+        """Record that the upload of an exposure failed, so it never
+        arrived.
+
+        Parameters
+        ----------
+        num: `int`
+            Number of the exposure.
+        """
+        self.count += 1
+        self.failures += 1
+        logging.info(f"Exposure {num} failed to arrive")
+
+    def report(self) -> None:
+        """Log a summary of missed deadlines and failed exposures."""
+        if self.failures:
+            logging.info(f"Failed to upload {self.failures} of"
+                         f" {self.count} exposures")
+        if not self.misses:
+            if not self.failures:
+                logging.info(f"Met deadline for all {self.count} exposures")
+            else:
+                logging.info(f"Met deadline for the other"
+                             f" {self.count - self.failures} exposures")
             return
-        logging.info("Sleeping " + delay_str)
-        time.sleep(delay)
+        logging.info(f"Missed deadline for {len(self.misses)} of"
+                     f" {self.count} exposures:"
+                     f" mean {sum(self.misses) / len(self.misses)},"
+                     f" max {max(self.misses)} seconds late")
+
 
+class EventLog:
+    """Machine-readable telemetry, written as one JSON record per line.
 
-def log_timing(func):
-    """Decorator to log timing information for a function."""
+    Each record describes one timed phase of a transfer, with the exposure,
+    CCD and byte count taken from the enclosing `event_context`.  Times are
+    from `time.monotonic`, with the wall-clock start time included so that
+    records from different nodes can be merged.  Lines are written with a
+    single append so that forked processes can share one file.
+    """
+
+    def __init__(self):
+        self.fd = None
+        self.host = socket.gethostname()
+        self.lock = threading.Lock()
+
+    def open(self, path: Path) -> None:
+        """Start appending records to a file.
+
+        Parameters
+        ----------
+        path: `pathlib.Path`
+            File to append to.
+        """
+        self.fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+
+    def close(self) -> None:
+        """Stop writing records."""
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def emit(self, phase: str, start: float, end: float, **fields) -> None:
+        """Write a record for a phase, if a file has been opened.
+
+        Parameters
+        ----------
+        phase: `str`
+            Name of the phase, such as ``wait``, ``copy`` or ``upload``.
+        start, end: `float`
+            Monotonic start and end times of the phase.
+        **fields
+            Additional values to record, overriding the enclosing context.
+        """
+        if self.fd is None:
+            return
+        record = dict(
+            phase=phase,
+            host=self.host,
+            pid=os.getpid(),
+            **getattr(_event_fields, "fields", {}),
+            start=start,
+            end=end,
+            duration=end - start,
+            wall=time.time() - (time.monotonic() - start),
+        )
+        record.update(fields)
+        line = json.dumps(record) + "\n"
+        with self.lock:
+            os.write(self.fd, line.encode())
+
+
+events = EventLog()
+_event_fields = threading.local()
+
+
+@contextlib.contextmanager
+def event_context(**fields):
+    """Add fields such as ``ccd``, ``exposure`` and ``bytes`` to all
+    telemetry records emitted by the current thread within the context.
+    """
+    saved = getattr(_event_fields, "fields", {})
+    _event_fields.fields = {**saved, **fields}
+    try:
+        yield
+    finally:
+        _event_fields.fields = saved
+
+
+def log_timing(func=None, *, phase: str | None = None):
+    """Decorator to log timing information for a function.
+
+    A telemetry record is also emitted to `events`, named by ``phase`` if
+    given or by the function name otherwise.
+    """
+    if func is None:
+        return functools.partial(log_timing, phase=phase)
+    name = phase or func.__name__
 
     @functools.wraps(func)
     def wrapper(self, *args, **kwargs):
         logging.info(f"Start {func.__name__}")
-        start = time.time()
+        start = time.monotonic()
         try:
             res = func(self, *args, **kwargs)
         finally:
-            delta = time.time() - start
-            logging.info(f"End {func.__name__} = {delta}")
+            end = time.monotonic()
+            logging.info(f"End {func.__name__} = {end - start}")
+            events.emit(name, start, end)
         return res
 
     return wrapper
 
 
 @log_timing
-def copy(source: Path, temp: Path, dest: Path, compress: bool = False) -> Path:
+def copy(source: Path, temp: Path, dest: Path, compress: bool = False,
+         checksum: Checksum | None = None) -> Path:
     """Copy a file to a temporary location, optionally with compression.
 
     Parameters
@@ -118,6 +420,8 @@ def copy(source: Path, temp: Path, dest: Path, compress: bool = False) -> Path:
         Destination location within temporary directory.
     compress: `bool`, optional
         Compress the file with fpack if true.
+    checksum: `Checksum`, optional
+        Checksum to update with the contents of the final file.
 
     Returns
     -------
@@ -126,47 +430,879 @@ def copy(source: Path, temp: Path, dest: Path, compress: bool = False) -> Path:
     """
     (temp / dest).parent.mkdir(parents=True, exist_ok=True)
     logging.info(f"Copying {source} to {temp / dest}")
-    subprocess.run(["cp", f"{source}", f"{temp / dest}"])
+    if checksum is None or compress:
+        subprocess.run(["cp", f"{source}", f"{temp / dest}"])
+    else:
+        # Copy in process so that the checksum is computed in the same pass.
+        with source.open("rb") as s, (temp / dest).open("wb") as d:
+            while chunk := s.read(CHECKSUM_BLOCK):
+                checksum.update(chunk)
+                d.write(chunk)
     if compress:
-        logging.info(f"Compressing {temp / dest}")
-        subprocess.run(["fpack", f"{temp / dest}"])
-        dest = dest.with_suffix(".fits.fz")
+        dest = fpack(temp, dest)
+        if checksum is not None:
+            checksum_file(temp / dest, checksum)
     return dest
 
 
+def checksum_file(path: Path, checksum: Checksum) -> None:
+    """Update a checksum with the contents of a file.
+
+    Only needed for files written by another process, such as fpack; these
+    are normally still in the page cache.
+    """
+    with path.open("rb") as f:
+        while chunk := f.read(CHECKSUM_BLOCK):
+            checksum.update(chunk)
+
+
+@log_timing(phase="compress")
+def fpack(temp: Path, dest: Path) -> Path:
+    """Compress a staged file with fpack.
+
+    Parameters
+    ----------
+    temp: `pathlib.Path`
+        Temporary directory holding the file.
+    dest: `pathlib.Path`
+        Location of the file within the temporary directory.
+
+    Returns
+    -------
+    finaldest: `pathlib.Path`
+        Location of the compressed file within the temporary directory.
+    """
+    logging.info(f"Compressing {temp / dest}")
+    subprocess.run(["fpack", f"{temp / dest}"])
+    return dest.with_suffix(".fits.fz")
+
+
+_tile_compressor = None
+_tile_compressor_lock = threading.Lock()
+
+
+def tile_compressor():
+    """Return the in-process tile compressor shared by this process."""
+    global _tile_compressor
+    with _tile_compressor_lock:
+        if _tile_compressor is None:
+            from tilecompress import TileCompressor
+            _tile_compressor = TileCompressor()
+        return _tile_compressor
+
+
+def compress_tiles(data: memoryview,
+                   checksum: Checksum | None = None) -> memoryview:
+    """Compress a staged image in process with parallel tile compression.
+
+    Logs timing like `log_timing`, along with the compression ratio.
+
+    Parameters
+    ----------
+    data: `memoryview`
+        Contents of an uncompressed FITS file.
+    checksum: `Checksum`, optional
+        Checksum to update with the compressed output as it is produced.
+
+    Returns
+    -------
+    compressed: `memoryview`
+        Contents of the compressed FITS file.
+    """
+    logging.info("Start compress")
+    start = time.monotonic()
+    if checksum is None:
+        compressed = tile_compressor().compress(data)
+    else:
+        pieces = []
+        for piece in tile_compressor().iter_compress(data):
+            checksum.update(piece)
+            pieces.append(piece)
+        compressed = b"".join(pieces)
+    end = time.monotonic()
+    ratio = len(data) / len(compressed)
+    logging.info(f"End compress = {end - start}")
+    logging.info(f"Compressed {len(data)} to {len(compressed)} bytes"
+                 f" (ratio {ratio})")
+    events.emit("compress", start, end, compressed_bytes=len(compressed),
+                ratio=ratio)
+    return memoryview(compressed)
+
+
+def stream_tiles(data: memoryview) -> Iterator[bytes]:
+    """Start compressing a staged image and return its compressed pieces.
+
+    Compression of all tiles starts immediately; pieces are yielded in file
+    order as they become ready, so an uploader can send the start of the
+    file while the rest is still being compressed.  The compression time
+    logged is until the last piece is ready.
+
+    Parameters
+    ----------
+    data: `memoryview`
+        Contents of an uncompressed FITS file.
+
+    Returns
+    -------
+    chunks: iterator of `bytes`
+        Consecutive pieces of the compressed FITS file.
+    """
+    logging.info("Start compress")
+    start = time.monotonic()
+    chunks = tile_compressor().iter_compress(data)
+    fields = dict(getattr(_event_fields, "fields", {}))
+
+    def generate():
+        size = 0
+        for chunk in chunks:
+            size += len(chunk)
+            yield chunk
+        end = time.monotonic()
+        logging.info(f"End compress = {end - start}")
+        logging.info(f"Compressed {len(data)} to {size} bytes"
+                     f" (ratio {len(data) / size})")
+        with event_context(**fields):
+            events.emit("compress", start, end, compressed_bytes=size,
+                        ratio=len(data) / size)
+
+    return generate()
+
+
+class StagingBuffer:
+    """Reusable in-memory buffer for staging images before transfer.
+
+    The buffer is allocated once and refilled for each exposure, avoiding
+    the subprocesses and temporary files used by `copy`.  Memory that an
+    abandoned upload attempt may still be reading is registered with
+    `hold`, and is not refilled until that attempt ends.
+    """
+
+    # Attempts still reading each held buffer, by id of the buffer; the
+    # attempts keep the buffers alive, so the ids are not reused.
+    _held: dict[int, set[Future]] = {}
+    _held_lock = threading.Lock()
+
+    def __init__(self):
+        self._buffer = bytearray()
+
+    @classmethod
+    def hold(cls, data: memoryview, future: Future) -> None:
+        """Keep the memory under a view from being refilled until an
+        attempt that reads it has ended.
+
+        Parameters
+        ----------
+        data: `memoryview`
+            View being read.
+        future: `concurrent.futures.Future`
+            Completed once the reader has ended.
+        """
+        key = id(data.obj)
+        with cls._held_lock:
+            cls._held.setdefault(key, set()).add(future)
+
+        def release(future: Future):
+            with cls._held_lock:
+                futures = cls._held.get(key)
+                if futures is not None:
+                    futures.discard(future)
+                    if not futures:
+                        del cls._held[key]
+
+        future.add_done_callback(release)
+
+    def held(self) -> bool:
+        """Return whether an abandoned attempt may still read the buffer."""
+        with self._held_lock:
+            return id(self._buffer) in self._held
+
+    def fill(self, source: Path,
+             checksum: Checksum | None = None) -> memoryview:
+        """Read a file into the buffer.
+
+        Parameters
+        ----------
+        source: `pathlib.Path`
+            Source file location.
+        checksum: `Checksum`, optional
+            Checksum to update with each block as it is read, while it is
+            still in the CPU cache.
+
+        Returns
+        -------
+        data: `memoryview`
+            View of the buffer holding exactly the contents of the file.
+        """
+        size = source.stat().st_size
+        if len(self._buffer) < size or self.held():
+            # Replace rather than resize, as views of the old buffer may still
+            # be held by a previous transfer; a held buffer is freed once
+            # its last reader ends.
+            self._buffer = bytearray(size)
+        view = memoryview(self._buffer)
+        pos = 0
+        block = size if checksum is None else CHECKSUM_BLOCK
+        with source.open("rb", buffering=0) as f:
+            while pos < size:
+                n = f.readinto(view[pos:min(pos + block, size)])
+                if not n:
+                    break
+                if checksum is not None:
+                    checksum.update(view[pos:pos + n])
+                pos += n
+        return view[:pos]
+
+
+@log_timing
+def stage(source: Path, buffer: StagingBuffer,
+          checksum: Checksum | None = None) -> memoryview:
+    """Stage a file in memory.
+
+    Parameters
+    ----------
+    source: `pathlib.Path`
+        Source file location.
+    buffer: `StagingBuffer`
+        Reusable buffer to fill.
+    checksum: `Checksum`, optional
+        Checksum to update with the contents of the file.
+
+    Returns
+    -------
+    data: `memoryview`
+        Contents of the source file.
+    """
+    logging.info(f"Staging {source} in memory")
+    return buffer.fill(source, checksum)
+
+
+@contextlib.contextmanager
+def map_file(path: Path) -> Iterator[memoryview]:
+    """Map a staged file into memory, to send it without reading a copy.
+
+    Parameters
+    ----------
+    path: `pathlib.Path`
+        File to map.
+
+    Returns
+    -------
+    data: `memoryview`
+        Read-only view of the contents of the file, valid until the context
+        exits.
+    """
+    with path.open("rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            # Empty files cannot be mapped.
+            yield memoryview(b"")
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            view = memoryview(mapped)
+            try:
+                yield view
+            finally:
+                view.release()
+
+
+class BufferReader(io.RawIOBase):
+    """Read-only, seekable file object over an in-memory buffer.
+
+    Allows uploaders that expect a file object to consume a staged buffer
+    without first copying it.
+
+    Parameters
+    ----------
+    data: `memoryview`
+        Buffer to read.
+    """
+
+    def __init__(self, data: memoryview):
+        self._data = data
+        self._pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        n = max(0, min(len(b), len(self._data) - self._pos))
+        b[:n] = self._data[self._pos:self._pos + n]
+        self._pos += n
+        return n
+
+    def read(self, size: int = -1) -> bytes:
+        end = len(self._data)
+        if size is not None and size >= 0:
+            end = min(end, self._pos + size)
+        chunk = bytes(self._data[self._pos:end])
+        self._pos = max(self._pos, end)
+        return chunk
+
+    def readall(self) -> bytes:
+        return self.read()
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            self._pos = offset
+        elif whence == io.SEEK_CUR:
+            self._pos += offset
+        elif whence == io.SEEK_END:
+            self._pos = len(self._data) + offset
+        else:
+            raise ValueError(f"Invalid whence {whence}")
+        if self._pos < 0:
+            raise ValueError("Negative seek position")
+        return self._pos
+
+    def tell(self) -> int:
+        return self._pos
+
+
+class Checksum:
+    """Checksums of a file, updated incrementally as its bytes go by.
+
+    Checksums are computed in whichever pass already reads the data on its
+    way to the uploader, so that integrity checking needs no extra read of
+    the file.  The time spent hashing is accumulated for `report`.
+
+    Parameters
+    ----------
+    algorithms: iterable of `str`
+        Checksums to compute: ``md5`` and/or ``crc32c``.  CRC32C requires
+        the google-crc32c package.
+    """
+
+    def __init__(self, algorithms: Iterable[str]):
+        self._hashers = {}
+        for algorithm in algorithms:
+            if algorithm == "md5":
+                self._hashers[algorithm] = hashlib.md5()
+            elif algorithm == "crc32c":
+                import google_crc32c
+                self._hashers[algorithm] = google_crc32c.Checksum()
+            else:
+                raise RuntimeError(f"Unrecognized checksum {algorithm}")
+        self.size = 0
+        self.elapsed = 0.0
+
+    def __contains__(self, algorithm: str) -> bool:
+        return algorithm in self._hashers
+
+    def update(self, chunk) -> None:
+        """Add the next piece of the file."""
+        start = time.monotonic()
+        for algorithm, hasher in self._hashers.items():
+            if algorithm == "crc32c" and not isinstance(chunk, bytes):
+                # The CRC32C extension only accepts bytes, so copy a block
+                # at a time while it is still in the CPU cache.
+                view = memoryview(chunk)
+                for pos in range(0, len(view), CHECKSUM_BLOCK):
+                    hasher.update(bytes(view[pos:pos + CHECKSUM_BLOCK]))
+            else:
+                hasher.update(chunk)
+        self.size += len(chunk)
+        self.elapsed += time.monotonic() - start
+
+    def digest(self, algorithm: str) -> bytes:
+        """Return the raw digest for an algorithm."""
+        return self._hashers[algorithm].digest()
+
+    def hexdigest(self, algorithm: str) -> str:
+        """Return the digest for an algorithm as hexadecimal."""
+        return self.digest(algorithm).hex()
+
+    def base64(self, algorithm: str) -> str:
+        """Return the digest for an algorithm as base64, as used in
+        ``Content-MD5`` and object store checksum headers.
+        """
+        return base64.b64encode(self.digest(algorithm)).decode()
+
+    def report(self) -> None:
+        """Log and emit the time spent computing the checksums."""
+        end = time.monotonic()
+        names = ",".join(self._hashers)
+        logging.info(f"Checksum {names} of {self.size} bytes"
+                     f" = {self.elapsed}")
+        events.emit("checksum", end - self.elapsed, end, bytes=self.size,
+                    algorithms=names)
+
+
+@dataclass
+class TransferOptions:
+    """Tuning options shared by all uploaders.
+
+    Parameters
+    ----------
+    parts: `int`
+        Number of parts to upload concurrently; 0 uploads each file as a
+        single stream.
+    part_size: `int`
+        Size in bytes of each part when uploading in parallel.
+    connections: `int`
+        Maximum number of connections kept in the uploader's pool.  With
+        the thread engine, all CCDs share this pool.
+    secure: `bool`
+        Use HTTPS rather than plain HTTP for object-store endpoints given by
+        host name.
+    checksum: `str`, optional
+        ``md5`` or ``crc32c`` to send a checksum with each upload for
+        verification by the destination.
+    timeout: `float`, optional
+        Seconds after which an upload attempt is abandoned.
+    retries: `int`
+        Number of times a failed or abandoned upload is retried.
+    backoff: `float`
+        Maximum delay in seconds before the first retry, doubling for each
+        later one; the actual delay is random up to this limit.
+    hedge: `float`, optional
+        Percentile of recent upload latencies after which a duplicate
+        upload is started.
+    warm: `int`
+        Number of pooled connections to open when the uploader is created.
+    ping: `float`, optional
+        Interval in seconds at which the warm connections are refreshed
+        with lightweight requests, so that they are not dropped between
+        exposures.
+    sndbuf: `int`, optional
+        Socket send buffer size in bytes; the system default if not given.
+    tcp_keepalive: `bool`
+        Enable TCP keepalive probes on connections.
+    nodelay: `bool`
+        Set TCP_NODELAY on connections.
+    sessions: `int`
+        Number of persistent ssh sessions for scp; 0 for one per part
+        stream.
+    """
+
+    parts: int = 0
+    part_size: int = 8*1024*1024
+    connections: int = 10
+    secure: bool = True
+    checksum: str | None = None
+    timeout: float | None = None
+    retries: int = 0
+    backoff: float = 0.5
+    hedge: float | None = None
+    warm: int = 1
+    ping: float | None = None
+    sndbuf: int | None = None
+    tcp_keepalive: bool = False
+    nodelay: bool = True
+    sessions: int = 0
+
+    def socket_options(self) -> list[tuple[int, int, int]]:
+        """Return the socket options for new connections."""
+        socket_options = []
+        if self.nodelay:
+            socket_options.append((socket.IPPROTO_TCP, socket.TCP_NODELAY, 1))
+        if self.sndbuf is not None:
+            socket_options.append((socket.SOL_SOCKET, socket.SO_SNDBUF,
+                                   self.sndbuf))
+        if self.tcp_keepalive:
+            socket_options += [
+                (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1),
+                (socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, 1),
+                (socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, 1)
+            ]
+        return socket_options
+
+    @property
+    def resilient(self) -> bool:
+        """Whether uploads need to be wrapped by `ResilientUploader`."""
+        return (self.timeout is not None or self.retries > 0
+                or self.hedge is not None)
+
+    @classmethod
+    def from_args(cls, args: argparse.Namespace) -> TransferOptions:
+        """Build options from parsed command-line arguments."""
+        return cls(
+            parts=args.parts,
+            part_size=args.partsize*1024*1024,
+            connections=args.connections,
+            secure=not args.insecure,
+            checksum=args.checksum,
+            timeout=args.timeout,
+            retries=args.retries,
+            backoff=args.backoff,
+            hedge=args.hedge,
+            warm=args.warm,
+            ping=args.ping,
+            sndbuf=None if args.sndbuf is None else args.sndbuf*1024,
+            tcp_keepalive=args.keepalive,
+            nodelay=args.nodelay,
+            sessions=args.sessions,
+        )
+
+
+class TimedConnection:
+    """Mixin for urllib3 connections that records connection setup.
+
+    DNS resolution, TCP connect, TLS handshake and time to first byte are
+    logged and emitted to `events` as separate phases, so that the latency
+    of a transfer can be attributed.  Time to first byte is measured from
+    the end of the request to the response headers.
+    """
+
+    def _new_conn(self):
+        # Resolve the name here, rather than in create_connection, so that
+        # DNS can be timed separately from the TCP handshake.
+        host = self._dns_host
+        start = time.monotonic()
+        try:
+            address = socket.getaddrinfo(host, self.port,
+                                         type=socket.SOCK_STREAM)[0][4][0]
+        except OSError:
+            # Leave urllib3 to report the error.
+            address = host
+        resolved = time.monotonic()
+        self._dns_host = address
+        try:
+            sock = super()._new_conn()
+        finally:
+            self._dns_host = host
+        self._connected = time.monotonic()
+        logging.info(f"Connected to {host}:"
+                     f" dns {resolved - start}"
+                     f" tcp {self._connected - resolved}")
+        events.emit("dns", start, resolved, remote=host)
+        events.emit("tcp", resolved, self._connected, remote=host)
+        return sock
+
+    def connect(self):
+        super().connect()
+        if isinstance(self, HTTPSConnection):
+            end = time.monotonic()
+            logging.info(f"TLS to {self.host} = {end - self._connected}")
+            events.emit("tls", self._connected, end, remote=self.host)
+
+    def getresponse(self, *args, **kwargs):
+        start = time.monotonic()
+        response = super().getresponse(*args, **kwargs)
+        events.emit("ttfb", start, time.monotonic(), remote=self.host)
+        return response
+
+
+@functools.cache
+def timed_pool(pool_class: type) -> type:
+    """Return a subclass of a urllib3 connection pool class whose
+    connections are `TimedConnection` instances.
+    """
+    connection_class = pool_class.ConnectionCls
+    timed_connection = type(f"Timed{connection_class.__name__}",
+                            (TimedConnection, connection_class), {})
+    return type(f"Timed{pool_class.__name__}", (pool_class,),
+                {"ConnectionCls": timed_connection})
+
+
+def tune_pool_manager(manager, options: TransferOptions) -> None:
+    """Apply socket options and connection timing to a urllib3 PoolManager.
+
+    Only affects pools created afterwards, so this must be called before
+    the first request.
+
+    Parameters
+    ----------
+    manager: `urllib3.PoolManager`
+        Pool manager of an uploader's client.
+    options: `TransferOptions`
+        Options giving the socket tuning.
+    """
+    manager.connection_pool_kw["socket_options"] = options.socket_options()
+    manager.pool_classes_by_scheme = {
+        scheme: timed_pool(pool_class)
+        for scheme, pool_class in manager.pool_classes_by_scheme.items()
+    }
+
+
+def http_adapter(options: TransferOptions):
+    """Return a requests adapter with a bounded, tuned connection pool."""
+    from requests.adapters import HTTPAdapter
+    adapter = HTTPAdapter(pool_maxsize=options.connections, pool_block=True)
+    tune_pool_manager(adapter.poolmanager, options)
+    return adapter
+
+
 class Uploader(abc.ABC):
-    """Abstract base class for classes that upload files from the camera."""
+    """Abstract base class for classes that upload files from the camera.
+
+    Parameters
+    ----------
+    options: `TransferOptions`, optional
+        Tuning options for transfers.
+    """
+
+    def __init__(self, options: TransferOptions | None = None):
+        self.options = options or TransferOptions()
 
     @classmethod
-    def create(cls, dest: str) -> Uploader:
+    @log_timing(phase="connect")
+    def create(cls, dest: str,
+               options: TransferOptions | None = None) -> Uploader:
         """Create an Uploader based on the scheme of its destination URI.
 
         Parameters
         ----------
         dest: `str`
             Destination URI.
+        options: `TransferOptions`, optional
+            Tuning options for transfers.
 
         Returns
         -------
         uploader: `Uploader`
-            Instance of the Uploader class configured for transfers.
+            Instance of the Uploader class configured for transfers,
+            wrapped in a `ResilientUploader` if ``options`` ask for
+            timeouts, retries or hedging, with its connections warmed.
         """
         logging.info(f"Creating uploader for {dest}")
         if dest.startswith("gsapi://"):
-            return GsapiUploader(dest[len("gsapi://"):])
-        if dest.startswith("boto://"):
-            return GsapiUploader(dest[len("boto://"):])
-        if dest.startswith("minio://"):
-            return GsapiUploader(dest[len("minio://"):])
-        if dest.startswith("https://") or dest.startswith("http://"):
-            return HttpUploader(dest)
-        if dest.startswith("bbcp://"):
-            return HttpUploader(dest[len("bbcp://"):])
-        if dest.startswith("scp://"):
-            return ScpUploader(dest[len("scp://"):])
-        raise RuntimeError(f"Unrecognized URL {dest}")
-
-    def transfer(self, temp_dir: Path, source: Path):
+            uploader = GsapiUploader(dest[len("gsapi://"):], options)
+        elif dest.startswith("boto://"):
+            uploader = BotoUploader(dest[len("boto://"):], options)
+        elif dest.startswith("minio://"):
+            uploader = MinioUploader(dest[len("minio://"):], options)
+        elif dest.startswith("https://") or dest.startswith("http://"):
+            uploader = HttpUploader(dest, options)
+        elif dest.startswith("bbcp://"):
+            uploader = BbcpUploader(dest[len("bbcp://"):], options)
+        elif dest.startswith("scp://"):
+            uploader = ScpUploader(dest[len("scp://"):], options)
+        else:
+            raise RuntimeError(f"Unrecognized URL {dest}")
+        if uploader.options.resilient:
+            uploader = ResilientUploader(uploader)
+        uploader.warm(uploader.options.warm)
+        if uploader.options.ping is not None:
+            uploader.start_keepalive(uploader.options.ping,
+                                     max(1, uploader.options.warm))
+        return uploader
+
+    def ping(self) -> None:
+        """Make a lightweight request to the destination, opening a pooled
+        connection or keeping one alive.
+
+        By default there is nothing to do.
+        """
+
+    def warm(self, connections: int, phase: str = "warm") -> None:
+        """Open or refresh pooled connections with concurrent pings.
+
+        Failures are logged and ignored, as they will be retried by the
+        transfers themselves.
+
+        Parameters
+        ----------
+        connections: `int`
+            Number of connections to ping.
+        phase: `str`, optional
+            Name of the phase for logs and telemetry.
+        """
+        if connections <= 0:
+            return
+
+        def ping():
+            try:
+                self.ping()
+            except Exception as exc:
+                logging.info(f"Ignored: {exc}")
+
+        logging.info(f"Start {phase}")
+        start = time.monotonic()
+        with ThreadPoolExecutor(max_workers=connections) as pool:
+            for _ in range(connections):
+                pool.submit(ping)
+        end = time.monotonic()
+        logging.info(f"End {phase} {connections} connections = {end - start}")
+        events.emit(phase, start, end, connections=connections)
+
+    def start_keepalive(self, interval: float, connections: int) -> None:
+        """Refresh pooled connections periodically in a daemon thread, so
+        that they are not dropped as idle between exposures.
+
+        Parameters
+        ----------
+        interval: `float`
+            Seconds between refreshes.
+        connections: `int`
+            Number of connections to refresh.
+        """
+        def run():
+            while True:
+                time.sleep(interval)
+                self.warm(connections, phase="keepalive")
+
+        threading.Thread(
+            target=run,
+            name=f"{threading.current_thread().name}-keepalive",
+            daemon=True
+        ).start()
+
+    def new_checksum(self) -> Checksum | None:
+        """Return an empty `Checksum` for a file to be transferred, or `None`
+        if checksums are not enabled.
+        """
+        if self.options.checksum is None:
+            return None
+        return Checksum([self.options.checksum])
+
+    def verify(self, source: Path, checksum: Checksum,
+               reported: dict[str, str]) -> None:
+        """Compare checksums reported by the destination with our own.
+
+        Parameters
+        ----------
+        source: `pathlib.Path`
+            Destination-relative name of the file.
+        checksum: `Checksum`
+            Checksums computed as the file was staged or sent.
+        reported: `dict` [`str`, `str`]
+            Base64 digests reported by the destination, by algorithm.
+
+        Raises
+        ------
+        RuntimeError
+            Raised if a reported checksum does not match our own.
+        """
+        verified = False
+        for algorithm, value in reported.items():
+            if algorithm not in checksum:
+                continue
+            expected = checksum.base64(algorithm)
+            if value != expected:
+                raise RuntimeError(f"{algorithm} mismatch for {source}:"
+                                   f" sent {expected}, destination has"
+                                   f" {value}")
+            verified = True
+        if verified:
+            logging.info(f"Verified checksum for {source}")
+        else:
+            logging.info(f"No checksum reported for {source}")
+
+    def report(self) -> None:
+        """Log any statistics kept by the uploader."""
+
+    def transfer_stream(self, source: Path, chunks: Iterable[bytes],
+                        checksum: Checksum | None = None):
+        """Transfer a file that is still being produced.
+
+        Subclasses that can send data as it arrives override this; by
+        default the pieces are collected and passed to `transfer`.
+
+        Parameters
+        ----------
+        source: `pathlib.Path`
+            Destination-relative name of the file.
+        chunks: iterable of `bytes`
+            Consecutive pieces of the file.
+        checksum: `Checksum`, optional
+            Checksum updated as the pieces are produced; complete only once
+            ``chunks`` is exhausted.
+        """
+        self.transfer(None, source, memoryview(b"".join(chunks)), checksum)
+
+    def part_size(self, size: int, min_part_size: int = 0,
+                  max_parts: int = 10000) -> int:
+        """Return the part size for uploading a file in parallel parts.
+
+        Parameters
+        ----------
+        size: `int`
+            Size of the file.
+        min_part_size: `int`, optional
+            Smallest part size accepted by the service.
+        max_parts: `int`, optional
+            Largest number of parts accepted by the service; the part size
+            is increased if necessary.
+        """
+        return max(self.options.part_size, min_part_size,
+                   math.ceil(size / max_parts))
+
+    def upload_parts(self, temp_dir: Path, source: Path,
+                     data: memoryview | None, upload_part,
+                     min_part_size: int = 0, max_parts: int = 10000,
+                     checksum: Checksum | None = None,
+                     part_checksums: bool = True) -> list:
+        """Upload a file as parts over concurrent streams.
+
+        Parameters
+        ----------
+        temp_dir: `pathlib.Path`
+            Temporary directory holding staged files.
+        source: `pathlib.Path`
+            Source file to transfer.
+        data: `memoryview` or `None`
+            Contents of the source file staged in memory, if any.
+        upload_part: callable
+            Called as ``upload_part(number, chunk, checksum)`` for each
+            part, with ``number`` counting from 1, ``chunk`` a bytes-like
+            object and ``checksum`` a `Checksum` of the part, or `None` if
+            checksums are not enabled.
+        min_part_size: `int`, optional
+            Smallest part size accepted by the service.
+        max_parts: `int`, optional
+            Largest number of parts accepted by the service; the part size
+            is increased if necessary.
+        checksum: `Checksum`, optional
+            Checksum of the whole file, to which the time spent computing
+            the part checksums is added.
+        part_checksums: `bool`, optional
+            Compute a checksum of each part, if checksums are enabled.
+
+        Returns
+        -------
+        results: `list`
+            Return values of ``upload_part`` in part number order.
+        """
+        if data is None:
+            size = (temp_dir / source).stat().st_size
+        else:
+            size = len(data)
+        part_size = self.part_size(size, min_part_size, max_parts)
+        offsets = range(0, max(size, 1), part_size)
+        logging.info(f"Uploading {source} as {len(offsets)} parts"
+                     f" of {part_size} bytes")
+
+        # Telemetry records from the part threads belong to this transfer.
+        context = dict(getattr(_event_fields, "fields", {}))
+
+        def run(number: int, offset: int):
+            with event_context(**context, part=number):
+                return run_part(number, offset)
+
+        def run_part(number: int, offset: int):
+            if data is None:
+                with (temp_dir / source).open("rb") as f:
+                    f.seek(offset)
+                    chunk = f.read(part_size)
+            else:
+                chunk = data[offset:offset + part_size]
+            # Hash each part in its own thread, just after it was read.
+            part_checksum = self.new_checksum() if part_checksums else None
+            if part_checksum is not None:
+                part_checksum.update(chunk)
+                checksums.append(part_checksum)
+            start = time.time()
+            try:
+                return upload_part(number, chunk, part_checksum)
+            finally:
+                delta = time.time() - start
+                logging.info(f"End part {number} ({len(chunk)} bytes)"
+                             f" = {delta}")
+
+        checksums = []
+        with ThreadPoolExecutor(max_workers=self.options.parts) as pool:
+            futures = [pool.submit(run, number, offset)
+                       for number, offset in enumerate(offsets, 1)]
+            results = [future.result() for future in futures]
+        if checksum is not None:
+            checksum.elapsed += sum(c.elapsed for c in checksums)
+        return results
+
+    def transfer(self, temp_dir: Path, source: Path,
+                 data: memoryview | None = None,
+                 checksum: Checksum | None = None):
         """Main method for transferring files.
 
         Implemented by subclasses.
@@ -179,6 +1315,12 @@ class Uploader(abc.ABC):
             Temporary directory to use during transfer.
         source: `pathlib.Path`
             Source file to transfer.
+        data: `memoryview`, optional
+            Contents of the source file staged in memory by `stage`.
+            If given, ``temp_dir / source`` is not read.
+        checksum: `Checksum`, optional
+            Checksum of the source file from `new_checksum`, computed while
+            it was staged, to be sent for verification by the destination.
         """
         raise NotImplementedError("transfer not implemented")
 
@@ -186,7 +1328,8 @@ class Uploader(abc.ABC):
 class GsapiUploader(Uploader):
     """Uploader using the Google Cloud Storage API."""
 
-    def __init__(self, dest: str):
+    def __init__(self, dest: str, options: TransferOptions | None = None):
+        super().__init__(options)
         from google.cloud import storage
         if "/" in dest:
             bucket, self.prefix = dest.split("/", 1)
@@ -195,17 +1338,21 @@ class GsapiUploader(Uploader):
             self.prefix = ""
         logging.info(f"gsapi: opening bucket {bucket}"
                      f", saving prefix '{self.prefix}'")
-        self.bucket = storage.Client().bucket(bucket)
-        try:
-            # Download something to "prime" the connection.
-            # Might be better to upload something instead.
-            _ = self.bucket.blob(".null").download_as_string()
-        except Exception as exc:
-            logging.info(f"Ignored: {exc}")
+        client = storage.Client()
+        client._http.mount("https://", http_adapter(self.options))
+        self.bucket = client.bucket(bucket)
+
+    def ping(self) -> None:
+        self.bucket.blob(".null").exists()
 
-    @log_timing
-    def transfer(self, temp_dir: Path, source: Path):
+    @log_timing(phase="upload")
+    def transfer(self, temp_dir: Path, source: Path,
+                 data: memoryview | None = None,
+                 checksum: Checksum | None = None):
         logging.info(f"gsapi: uploading to {self.prefix}/{source}")
+        if self.options.parts > 0:
+            self.transfer_composite(temp_dir, source, data, checksum)
+            return
         # Set a large chunk size to ensure that the API doesn't try to break
         # up the file into multiple transfers.
         size = 100*1024*1024
@@ -213,7 +1360,52 @@ class GsapiUploader(Uploader):
             blob = self.bucket.blob(f"{source}", chunk_size=size)
         else:
             blob = self.bucket.blob(f"{self.prefix}/{source}", chunk_size=size)
-        blob.upload_from_filename(temp_dir / source)
+        self.set_checksum(blob, checksum)
+        if data is None:
+            blob.upload_from_filename(temp_dir / source)
+        else:
+            blob.upload_from_file(BufferReader(data), size=len(data))
+
+    def transfer_composite(self, temp_dir: Path, source: Path,
+                           data: memoryview | None,
+                           checksum: Checksum | None = None):
+        """Upload parts as separate objects, then compose them."""
+        name = f"{source}" if self.prefix == "" else f"{self.prefix}/{source}"
+
+        def upload_part(number: int, chunk, part_checksum) -> object:
+            part = self.bucket.blob(f"{name}.part{number:02d}")
+            self.set_checksum(part, part_checksum)
+            part.upload_from_file(BufferReader(memoryview(chunk)),
+                                  size=len(chunk))
+            return part
+
+        # A single compose request accepts at most 32 components.
+        parts = self.upload_parts(temp_dir, source, data, upload_part,
+                                  max_parts=32, checksum=checksum)
+        blob = self.bucket.blob(name)
+        try:
+            blob.compose(parts)
+        finally:
+            for part in parts:
+                part.delete()
+        # Composite objects have a CRC32C, computed by the service, but no
+        # MD5.
+        if checksum is not None:
+            self.verify(source, checksum, {"crc32c": blob.crc32c})
+
+    @staticmethod
+    def set_checksum(blob, checksum: Checksum | None) -> None:
+        """Send checksums with a blob's metadata.
+
+        The service rejects the upload if the data it receives does not
+        match.
+        """
+        if checksum is None:
+            return
+        if "md5" in checksum:
+            blob.md5_hash = checksum.base64("md5")
+        if "crc32c" in checksum:
+            blob.crc32c = checksum.base64("crc32c")
 
 
 class BotoUploader(Uploader):
@@ -221,95 +1413,1046 @@ class BotoUploader(Uploader):
 
     Should work for AWS S3 or Google Cloud Storage or MinIO."""
 
-    def __init__(self, dest: str):
+    def __init__(self, dest: str, options: TransferOptions | None = None):
+        super().__init__(options)
         import boto3
+        from botocore.config import Config
         host, self.bucket, self.prefix = dest.split("/", 2)
         logging.info(f"boto: opening host {host}, saving bucket {self.bucket}"
                      f", prefix '{self.prefix}'")
-        self.client = boto3.client('s3')
-        self.client.put_object(Bucket=self.bucket, Key=".null",
-                               Body=b"", ContentLength=0)
-
-    @log_timing
-    def transfer(self, temp_dir: Path, source: Path):
+        scheme = "https" if self.options.secure else "http"
+        self.client = boto3.client('s3', endpoint_url=f"{scheme}://{host}",
+                                   config=Config(
+            max_pool_connections=self.options.connections))
+        tune_pool_manager(self.client._endpoint.http_session._manager,
+                          self.options)
+
+    def ping(self) -> None:
+        self.client.head_bucket(Bucket=self.bucket)
+
+    @log_timing(phase="upload")
+    def transfer(self, temp_dir: Path, source: Path,
+                 data: memoryview | None = None,
+                 checksum: Checksum | None = None):
         logging.info(f"boto: uploading to {self.prefix}/{source}")
-        self.client.upload_file(temp_dir / source,
-                              self.bucket, f"{self.prefix}/{source}")
+        if self.options.parts > 0:
+            self.transfer_multipart(temp_dir, source, data, checksum)
+        elif checksum is not None:
+            # upload_file may switch to a multipart upload, which cannot
+            # carry a checksum of the whole object, so use a single request.
+            if data is None:
+                body = (temp_dir / source).open("rb")
+            else:
+                body = BufferReader(data)
+            with body:
+                self.client.put_object(Bucket=self.bucket,
+                                       Key=f"{self.prefix}/{source}",
+                                       Body=body,
+                                       **self.checksum_args(checksum))
+        elif data is None:
+            self.client.upload_file(temp_dir / source,
+                                    self.bucket, f"{self.prefix}/{source}")
+        else:
+            self.client.upload_fileobj(BufferReader(data),
+                                       self.bucket, f"{self.prefix}/{source}")
+
+    def transfer_multipart(self, temp_dir: Path, source: Path,
+                           data: memoryview | None,
+                           checksum: Checksum | None = None):
+        """Upload using an S3 multipart upload with concurrent parts."""
+        key = f"{self.prefix}/{source}"
+        create_args = {}
+        if checksum is not None and "crc32c" in checksum:
+            create_args["ChecksumAlgorithm"] = "CRC32C"
+        upload_id = self.client.create_multipart_upload(
+            Bucket=self.bucket, Key=key, **create_args)["UploadId"]
+
+        def upload_part(number: int, chunk, part_checksum) -> dict:
+            args = self.checksum_args(part_checksum)
+            r = self.client.upload_part(
+                Bucket=self.bucket, Key=key, UploadId=upload_id,
+                PartNumber=number, Body=BufferReader(memoryview(chunk)),
+                **args)
+            part = {"ETag": r["ETag"], "PartNumber": number}
+            if "ChecksumCRC32C" in args:
+                part["ChecksumCRC32C"] = args["ChecksumCRC32C"]
+            return part
+
+        try:
+            parts = self.upload_parts(temp_dir, source, data, upload_part,
+                                      min_part_size=5*1024*1024,
+                                      checksum=checksum)
+            self.client.complete_multipart_upload(
+                Bucket=self.bucket, Key=key, UploadId=upload_id,
+                MultipartUpload={"Parts": parts})
+        except Exception:
+            self.client.abort_multipart_upload(
+                Bucket=self.bucket, Key=key, UploadId=upload_id)
+            raise
+
+    @staticmethod
+    def checksum_args(checksum: Checksum | None) -> dict:
+        """Return request arguments that have the service verify a
+        checksum.
+        """
+        args = {}
+        if checksum is not None:
+            if "md5" in checksum:
+                args["ContentMD5"] = checksum.base64("md5")
+            if "crc32c" in checksum:
+                args["ChecksumCRC32C"] = checksum.base64("crc32c")
+        return args
 
 
 class MinioUploader(Uploader):
     """Uploader using the MinIO object store API."""
 
-    def __init__(self, dest: str):
+    def __init__(self, dest: str, options: TransferOptions | None = None):
+        super().__init__(options)
         from minio import Minio
+        import urllib3
         host, self.bucket, self.prefix = dest.split("/", 2)
         logging.info(f"minio: opening host {host}, saving bucket {self.bucket}"
                      f", prefix '{self.prefix}'")
-        self.conn = Minio(host)
-        self.conn.put_object(self.bucket, ".null", BytesIO(b""), 0)
-
-    @log_timing
-    def transfer(self, temp_dir: Path, source: Path):
+        manager = urllib3.PoolManager(maxsize=self.options.connections,
+                                      block=True)
+        tune_pool_manager(manager, self.options)
+        self.conn = Minio(host, secure=self.options.secure,
+                          http_client=manager)
+
+    def ping(self) -> None:
+        self.conn.bucket_exists(self.bucket)
+
+    @log_timing(phase="upload")
+    def transfer(self, temp_dir: Path, source: Path,
+                 data: memoryview | None = None,
+                 checksum: Checksum | None = None):
         logging.info(f"minio: uploading to {self.prefix}/{source}")
-        self.conn.fput_object(
-            self.bucket,
-            f"{self.prefix}/{source}",
-            temp_dir / source
-        )
+        if self.options.parts > 0:
+            self.transfer_multipart(temp_dir, source, data, checksum)
+        elif checksum is not None:
+            # put_object would copy the data into a new buffer and compute
+            # its own MD5 over it; send the staged data with our checksum.
+            # The view can be resent as is if the request is retried.
+            with contextlib.ExitStack() as stack:
+                if data is None:
+                    data = stack.enter_context(
+                        map_file(temp_dir / source))
+                self.conn._put_object(self.bucket, f"{self.prefix}/{source}",
+                                      data, self.checksum_headers(checksum))
+        elif data is None:
+            self.conn.fput_object(
+                self.bucket,
+                f"{self.prefix}/{source}",
+                temp_dir / source
+            )
+        else:
+            self.conn.put_object(
+                self.bucket,
+                f"{self.prefix}/{source}",
+                BufferReader(data),
+                len(data)
+            )
+
+    def transfer_multipart(self, temp_dir: Path, source: Path,
+                           data: memoryview | None,
+                           checksum: Checksum | None = None):
+        """Upload using an S3 multipart upload with concurrent parts."""
+        from minio.datatypes import Part
+        key = f"{self.prefix}/{source}"
+        # The Minio client only exposes multipart uploads with per-part
+        # control through its internal methods.
+        upload_id = self.conn._create_multipart_upload(
+            self.bucket, key, {"Content-Type": "application/octet-stream"})
+
+        def upload_part(number: int, chunk, part_checksum) -> Part:
+            # Completing the upload cannot list part checksums, so only
+            # the MD5 can be checked per part.
+            headers = None
+            if part_checksum is not None and "md5" in part_checksum:
+                headers = {"Content-MD5": part_checksum.base64("md5")}
+            etag = self.conn._upload_part(self.bucket, key, chunk,
+                                          headers, upload_id, number)
+            return Part(number, etag)
+
+        try:
+            parts = self.upload_parts(temp_dir, source, data, upload_part,
+                                      min_part_size=5*1024*1024,
+                                      checksum=checksum)
+            self.conn._complete_multipart_upload(self.bucket, key, upload_id,
+                                                 parts)
+        except Exception:
+            self.conn._abort_multipart_upload(self.bucket, key, upload_id)
+            raise
+
+    @staticmethod
+    def checksum_headers(checksum: Checksum) -> dict:
+        """Return request headers that have the service verify a checksum."""
+        headers = {}
+        if "md5" in checksum:
+            headers["Content-MD5"] = checksum.base64("md5")
+        if "crc32c" in checksum:
+            headers["x-amz-checksum-crc32c"] = checksum.base64("crc32c")
+        return headers
 
 
 class HttpUploader(Uploader):
     """Uploader using HTTP PUT to an ordinary web server."""
 
-    def __init__(self, dest: str):
+    def __init__(self, dest: str, options: TransferOptions | None = None):
+        super().__init__(options)
         import requests
         logging.info(f"http: opening session to {dest}")
         self.url = dest
         self.session = requests.Session()
-
-    @log_timing
-    def transfer(self, temp_dir: Path, source: Path):
+        adapter = http_adapter(self.options)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def ping(self) -> None:
+        # Any response will do.
+        self.session.head(self.url)
+
+    @log_timing(phase="upload")
+    def transfer(self, temp_dir: Path, source: Path,
+                 data: memoryview | None = None,
+                 checksum: Checksum | None = None):
         logging.info(f"http: putting to {self.url}/{source}")
-        with (temp_dir / source).open("rb") as s:
-            r = self.session.put(f"{self.url}/{source}", data=s)
+        headers = self.digest_headers(checksum)
+        if data is None:
+            with (temp_dir / source).open("rb") as s:
+                r = self.session.put(f"{self.url}/{source}", data=s,
+                                     headers=headers)
+        else:
+            r = self.session.put(f"{self.url}/{source}",
+                                 data=BufferReader(data), headers=headers)
         r.raise_for_status()
+        if checksum is not None:
+            self.verify(source, checksum, self.reported_digests(r))
+
+    @log_timing(phase="upload")
+    def transfer_stream(self, source: Path, chunks: Iterable[bytes],
+                        checksum: Checksum | None = None):
+        logging.info(f"http: streaming to {self.url}/{source}")
+        # A generator body is sent with chunked transfer encoding.  The
+        # checksum is only known once it has been sent, so it can only be
+        # compared with one reported by the server.
+        r = self.session.put(f"{self.url}/{source}", data=iter(chunks))
+        r.raise_for_status()
+        if checksum is not None:
+            self.verify(source, checksum, self.reported_digests(r))
+
+    @staticmethod
+    def digest_headers(checksum: Checksum | None) -> dict:
+        """Return request headers carrying checksums of the body, as
+        ``Content-MD5`` and an RFC 9530 ``Content-Digest``.
+        """
+        if checksum is None:
+            return {}
+        headers = {}
+        if "md5" in checksum:
+            headers["Content-MD5"] = checksum.base64("md5")
+        headers["Content-Digest"] = ", ".join(
+            f"{algorithm}=:{checksum.base64(algorithm)}:"
+            for algorithm in ("md5", "crc32c") if algorithm in checksum
+        )
+        return headers
+
+    @staticmethod
+    def reported_digests(response) -> dict[str, str]:
+        """Return the checksums of the stored file reported in an RFC 9530
+        ``Repr-Digest`` response header, by algorithm.
+        """
+        reported = {}
+        for item in response.headers.get("Repr-Digest", "").split(","):
+            algorithm, _, value = item.strip().partition("=")
+            if value.startswith(":") and value.endswith(":"):
+                reported[algorithm.lower()] = value[1:-1]
+        return reported
+
+
+class SshSessions:
+    """Long-lived, multiplexed ssh sessions to one host.
+
+    Commands run over OpenSSH control masters rather than each opening
+    their own connection, so they skip the TCP and key-exchange round trips.
+    The control sockets have well-known names, so the masters are shared
+    by all uploaders on a node, including those in forked processes.
+    Commands are spread over the masters in rotation; each master is a
+    separate TCP connection, so several of them can carry parallel streams.
+
+    Remote directories are created at most once per process.
+
+    Parameters
+    ----------
+    host: `str`
+        Destination host, optionally with a user name.
+    count: `int`, optional
+        Number of control masters to use.
+    """
+
+    # Idle time after which a control master exits.
+    persist = "10m"
+
+    def __init__(self, host: str, count: int = 1):
+        self.host = host
+        self.paths = [Path(tempfile.gettempdir()) / f"apxfr-ssh-{host}-{i}"
+                      for i in range(max(1, count))]
+        self._next = itertools.count()
+        self._directories = set()
+        self._lock = threading.Lock()
+
+    def open(self) -> None:
+        """Start any control masters that are not running."""
+        for path in self.paths:
+            # Serialize with other processes on the node starting the same
+            # master.
+            with open(f"{path}.lock", "w") as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                check = subprocess.run(
+                    ["ssh", "-O", "check", "-o", f"ControlPath={path}",
+                     self.host],
+                    stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                if check.returncode == 0:
+                    continue
+                logging.info(f"ssh: starting control master {path}")
+                subprocess.run(
+                    ["ssh", "-M", "-N", "-f",
+                     "-o", f"ControlPath={path}",
+                     "-o", f"ControlPersist={self.persist}",
+                     "-o", "ServerAliveInterval=10",
+                     self.host],
+                    stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                    check=True)
+
+    def command(self, remote: str) -> list[str]:
+        """Return an ssh command line that runs ``remote`` over the next
+        session.
+        """
+        path = self.paths[next(self._next) % len(self.paths)]
+        return ["ssh", "-o", f"ControlPath={path}",
+                "-o", "ControlMaster=no", self.host, remote]
+
+    def control_path(self) -> Path:
+        """Return the control socket of the next session."""
+        return self.paths[next(self._next) % len(self.paths)]
+
+    def run(self, remote: str, **kwargs) -> subprocess.CompletedProcess:
+        """Run a remote command over the next session.
+
+        Raises
+        ------
+        RuntimeError
+            Raised if the command fails.
+        """
+        r = subprocess.run(self.command(remote), **kwargs)
+        if r.returncode != 0:
+            raise RuntimeError(f"ssh: '{remote}' exited with {r.returncode}")
+        return r
+
+    def mkdir(self, directory: Path) -> str:
+        """Return a shell command prefix that creates a remote directory,
+        or an empty string if this process has already created it.
+
+        Call `created` once the command has succeeded.
+        """
+        with self._lock:
+            if directory in self._directories:
+                return ""
+        return f"mkdir -p {directory} && "
+
+    def created(self, directory: Path) -> None:
+        """Record that a remote directory exists."""
+        with self._lock:
+            self._directories.add(directory)
+
+
+# bbcp names for the checksum algorithms.
+BBCP_CHECKSUMS = {"md5": "md5", "crc32c": "c32c"}
 
 
 class BbcpUploader(Uploader):
-    """Uploader using bbcp to a remote filesystem."""
+    """Uploader using bbcp to a remote filesystem.
+
+    bbcp is started on the remote side over a persistent ssh session, which
+    is also used to create remote directories.
+    """
 
-    def __init__(self, dest: str):
+    def __init__(self, dest: str, options: TransferOptions | None = None):
+        super().__init__(options)
         self.host, path = dest.split("/", 1)
         logging.info(f"bbcp: saving host {self.host} and path {path}")
         self.path = Path(path)
+        self.sessions = SshSessions(self.host)
 
-    @log_timing
-    def transfer(self, temp_dir: Path, source: Path):
+    def ping(self) -> None:
+        self.sessions.open()
+
+    @log_timing(phase="upload")
+    def transfer(self, temp_dir: Path, source: Path,
+                 data: memoryview | None = None,
+                 checksum: Checksum | None = None):
         logging.info(f"bbcp: dir {self.path / source.parent}; file {source}")
+        if data is not None:
+            raise RuntimeError("bbcp requires file staging")
         # -A is supposed to create the remote directory, but it appears to be
         # buggy.
-        subprocess.run(["bbcp", "-A", self.path / source,
-                        f"{self.host}:{self.path / source}"])
+        directory = self.path / source.parent
+        if mkdir := self.sessions.mkdir(directory):
+            self.sessions.run(mkdir + "true")
+            self.sessions.created(directory)
+        options = [
+            "-T", (f"ssh -x -a -oControlPath={self.sessions.control_path()}"
+                   f" -oControlMaster=no %I %U%H bbcp"),
+        ]
+        if self.options.parts > 0:
+            options += ["-s", str(self.options.parts)]
+        # bbcp computes its own checksum as it reads the file and has the
+        # remote side verify it.
+        if self.options.checksum is not None:
+            options += ["-E", BBCP_CHECKSUMS[self.options.checksum]]
+        r = subprocess.run(["bbcp", *options, temp_dir / source,
+                            f"{self.host}:{self.path / source}"])
+        if r.returncode != 0:
+            raise RuntimeError(f"bbcp exited with {r.returncode}")
+
+    def new_checksum(self) -> Checksum | None:
+        return None
 
 
 class ScpUploader(Uploader):
-    """Uploader using scp to a remote filesystem."""
+    """Uploader writing files through ssh to a remote filesystem.
 
-    def __init__(self, dest: str):
+    Each file is streamed over one of a few persistent, multiplexed ssh
+    sessions; with parallel parts, the parts are spread over the sessions
+    and written in place at their offsets.  Files are written under a
+    temporary name and renamed once complete, so that they appear
+    atomically, as objects do.
+    """
+
+    def __init__(self, dest: str, options: TransferOptions | None = None):
+        super().__init__(options)
         self.host, path = dest.split("/", 1)
         logging.info(f"scp: saving host {self.host} and path {path}")
         self.path = Path(path)
+        self.sessions = SshSessions(
+            self.host, self.options.sessions or max(1, self.options.parts))
+
+    def ping(self) -> None:
+        self.sessions.open()
 
-    @log_timing
-    def transfer(self, temp_dir: Path, source: Path):
+    @log_timing(phase="upload")
+    def transfer(self, temp_dir: Path, source: Path,
+                 data: memoryview | None = None,
+                 checksum: Checksum | None = None):
         logging.info(f"scp: dir {self.path / source.parent}; file {source}")
-        with (temp_dir / source).open("rb") as s:
-            # We may have to create the remote directory; try to do it all in
-            # one ssh connection for efficiency.
-            subprocess.run(["ssh", self.host,
-                            f"mkdir -p {self.path / source.parent};"
-                            f"cat > {self.path / source}"],
-                           stdin=s)
+        if self.options.parts > 0:
+            self.transfer_parts(temp_dir, source, data, checksum)
+            return
+        command = self.command(source, checksum is not None)
+        output = subprocess.PIPE if checksum is not None else None
+        if data is None:
+            with (temp_dir / source).open("rb") as s:
+                r = subprocess.run(command, stdin=s, stdout=output)
+        else:
+            r = subprocess.run(command, input=data, stdout=output)
+        self.finish(source, r.returncode)
+        if checksum is not None:
+            self.verify_output(source, checksum, r.stdout)
+
+    @log_timing(phase="upload")
+    def transfer_stream(self, source: Path, chunks: Iterable[bytes],
+                        checksum: Checksum | None = None):
+        logging.info(f"scp: streaming to {self.path / source}")
+        output = subprocess.PIPE if checksum is not None else None
+        with subprocess.Popen(self.command(source, checksum is not None),
+                              stdin=subprocess.PIPE, stdout=output) as proc:
+            for chunk in chunks:
+                proc.stdin.write(chunk)
+            proc.stdin.close()
+            if checksum is not None:
+                output = proc.stdout.read()
+        self.finish(source, proc.returncode)
+        if checksum is not None:
+            self.verify_output(source, checksum, output)
+
+    def transfer_parts(self, temp_dir: Path, source: Path,
+                       data: memoryview | None,
+                       checksum: Checksum | None = None):
+        """Write parts of a file concurrently over the ssh sessions."""
+        if data is None:
+            size = (temp_dir / source).stat().st_size
+        else:
+            size = len(data)
+        part_size = self.part_size(size)
+        target = self.path / source
+        partial = self.partial(target)
+        directory = target.parent
+        # Create the directory first, rather than in every part.
+        if mkdir := self.sessions.mkdir(directory):
+            self.sessions.run(mkdir + "true")
+            self.sessions.created(directory)
+
+        def upload_part(number: int, chunk, part_checksum):
+            # Every part sets the final size, as the parts may arrive in
+            # any order; dd then writes the part in place.
+            self.sessions.run(f"truncate -s {size} {partial} &&"
+                              f" dd of={partial} bs={part_size}"
+                              f" seek={number - 1} conv=notrunc 2>/dev/null",
+                              input=chunk)
+
+        try:
+            self.upload_parts(temp_dir, source, data, upload_part,
+                              checksum=checksum, part_checksums=False)
+            if checksum is not None:
+                # The parts cannot be hashed as they are written, so the
+                # remote side reads the file back, normally from its page
+                # cache.
+                r = self.sessions.run(f"md5sum {partial}",
+                                      stdout=subprocess.PIPE)
+                self.verify_output(source, checksum, r.stdout)
+            self.sessions.run(f"mv -f {partial} {target}")
+        except Exception:
+            with contextlib.suppress(RuntimeError):
+                self.sessions.run(f"rm -f {partial}")
+            raise
+
+    def finish(self, source: Path, returncode: int) -> None:
+        """Check the result of writing a file."""
+        if returncode != 0:
+            raise RuntimeError(f"scp: writing {source} exited with"
+                               f" {returncode}")
+        self.sessions.created(self.path / source.parent)
+
+    def new_checksum(self) -> Checksum | None:
+        # The remote side can only be relied on to have md5sum.
+        if self.options.checksum is None:
+            return None
+        return Checksum(["md5"])
+
+    def verify_output(self, source: Path, checksum: Checksum,
+                      output: bytes) -> None:
+        """Verify a checksum against the md5sum output of the remote side."""
+        digest = bytes.fromhex(output.split()[0].decode()) if output else b""
+        self.verify(source, checksum,
+                    {"md5": base64.b64encode(digest).decode()})
+
+    def command(self, source: Path, checksum: bool = False) -> list[str]:
+        """Return the ssh command that writes its input to ``source``.
+
+        With ``checksum``, the command also prints the MD5 of what it
+        received, computed as the data is written.
+        """
+        # We may have to create the remote directory; do it in the same
+        # command, but only the first time.
+        target = self.path / source
+        partial = self.partial(target)
+        write = f"cat > {partial}"
+        if checksum:
+            write = f"tee {partial} | md5sum"
+        return self.sessions.command(
+            self.sessions.mkdir(target.parent)
+            + f"{write} && mv -f {partial} {target}")
+
+    @staticmethod
+    def partial(target: Path) -> Path:
+        """Return a temporary name to write a file under until complete.
+
+        Each attempt gets its own name, so that retried or hedged attempts
+        do not write into each other's files.
+        """
+        return target.with_name(
+            f"{target.name}.{uuid.uuid4().hex[:8]}{PARTIAL_SUFFIX}")
+
+
+class ReplayableChunks:
+    """Iterable over a stream of chunks that can be read more than once.
+
+    Each iteration starts from the first chunk, so that a retried or hedged
+    attempt can resend a stream while, or after, another attempt reads it.
+    The underlying iterator is only consumed once.
+
+    Parameters
+    ----------
+    chunks: iterable of `bytes`
+        Consecutive pieces of a file.
+    """
+
+    def __init__(self, chunks: Iterable[bytes]):
+        self._source = iter(chunks)
+        self._chunks = []
+        self._done = False
+        self._lock = threading.Lock()
+
+    def __iter__(self) -> Iterator[bytes]:
+        pos = 0
+        while True:
+            with self._lock:
+                if pos == len(self._chunks):
+                    if self._done:
+                        return
+                    try:
+                        self._chunks.append(next(self._source))
+                    except StopIteration:
+                        self._done = True
+                        return
+                chunk = self._chunks[pos]
+            pos += 1
+            yield chunk
+
+
+class ResilientUploader(Uploader):
+    """Uploader that bounds tail latency of another uploader.
+
+    Each transfer is attempted with a timeout and retried after a jittered
+    exponential backoff.  With hedging, once an attempt has run longer than
+    a percentile of recently observed attempt latencies, a duplicate
+    attempt is started; whichever finishes first is used, and the other is
+    abandoned.  Attempts run in their own threads, as the underlying client
+    calls cannot be interrupted: an abandoned attempt is left to finish in
+    the background and its result is ignored, though it still uses a
+    connection until it ends.  It may also finish last, so it must keep
+    sending the same bytes: staged data it reads is held with
+    `StagingBuffer.hold` until it ends, and the buffer is refilled into
+    new memory meanwhile.
+
+    Parameters
+    ----------
+    uploader: `Uploader`
+        Uploader to make the attempts.
+    options: `TransferOptions`, optional
+        Timeout, retry and hedging options; defaults to the options of
+        ``uploader``.
+    """
+
+    # Number of recent attempt latencies used to set the hedging delay, and
+    # the number needed before hedging starts.
+    window = 100
+    min_samples = 10
+
+    def __init__(self, uploader: Uploader,
+                 options: TransferOptions | None = None):
+        super().__init__(options or uploader.options)
+        self.uploader = uploader
+        self.latencies = deque(maxlen=self.window)
+        self.lock = threading.Lock()
+        self.retries = 0
+        self.timeouts = 0
+        self.hedges_fired = 0
+        self.hedges_won = 0
+        self.hedge_saved = 0.0
+
+    def ping(self) -> None:
+        self.uploader.ping()
+
+    def new_checksum(self) -> Checksum | None:
+        return self.uploader.new_checksum()
+
+    def transfer(self, temp_dir: Path, source: Path,
+                 data: memoryview | None = None,
+                 checksum: Checksum | None = None):
+        self.attempt(source, functools.partial(
+            self.uploader.transfer, temp_dir, source, data, checksum), data)
+
+    def transfer_stream(self, source: Path, chunks: Iterable[bytes],
+                        checksum: Checksum | None = None):
+        chunks = ReplayableChunks(chunks)
+        self.attempt(source, lambda: self.uploader.transfer_stream(
+            source, iter(chunks), checksum))
+
+    def hedge_delay(self) -> float | None:
+        """Return how long an attempt may run before it is hedged, or `None`
+        if hedging is disabled or too few latencies have been observed.
+        """
+        if self.options.hedge is None:
+            return None
+        with self.lock:
+            if len(self.latencies) < self.min_samples:
+                return None
+            values = sorted(self.latencies)
+        # Nearest-rank percentile.
+        rank = max(1, math.ceil(self.options.hedge / 100 * len(values)))
+        return values[rank - 1]
+
+    def start(self, call, attempt: int, hedge: bool) -> Future:
+        """Run an attempt in a new thread.
+
+        The attempt keeps the caller's telemetry context, with the attempt
+        number and whether it is a hedge added.
+        """
+        future = Future()
+        future.set_running_or_notify_cancel()
+        context = dict(getattr(_event_fields, "fields", {}))
+        name = threading.current_thread().name
+
+        def run():
+            with event_context(**context, attempt=attempt, hedge=hedge):
+                start = time.monotonic()
+                try:
+                    call()
+                except BaseException as exc:
+                    future.set_exception(exc)
+                    return
+                latency = time.monotonic() - start
+                with self.lock:
+                    self.latencies.append(latency)
+                future.set_result(latency)
+
+        threading.Thread(
+            target=run,
+            name=f"{name}-hedge" if hedge else f"{name}-try{attempt}",
+            daemon=True
+        ).start()
+        return future
+
+    def attempt(self, source: Path, call,
+                data: memoryview | None = None) -> None:
+        """Make attempts at a transfer until one succeeds.
+
+        Parameters
+        ----------
+        source: `pathlib.Path`
+            Destination-relative name of the file.
+        call: callable
+            Called with no arguments to make one attempt.
+        data: `memoryview`, optional
+            Staged data the attempts read, held until abandoned attempts
+            end.
+
+        Raises
+        ------
+        RuntimeError
+            Raised if every attempt failed or timed out.
+        """
+        error = None
+        for attempt in range(self.options.retries + 1):
+            if attempt > 0:
+                # Full jitter, so that CCDs that failed together do not
+                # retry together.
+                delay = random.uniform(
+                    0, self.options.backoff * 2 ** (attempt - 1))
+                logging.info(f"Retrying {source} in {delay}: {error}")
+                with self.lock:
+                    self.retries += 1
+                start = time.monotonic()
+                time.sleep(delay)
+                events.emit("retry", start, time.monotonic(),
+                            attempt=attempt, error=str(error))
+            start = time.monotonic()
+            deadline = None
+            if self.options.timeout is not None:
+                deadline = start + self.options.timeout
+            hedge_at = None
+            delay = self.hedge_delay()
+            if delay is not None:
+                hedge_at = start + delay
+            primary = self.start(call, attempt, hedge=False)
+            hedge = None
+            pending = {primary}
+            while pending:
+                wake = min((t for t in (deadline, hedge_at) if t is not None),
+                           default=None)
+                done, pending = wait(
+                    pending, return_when=FIRST_COMPLETED,
+                    timeout=None if wake is None
+                    else max(0.0, wake - time.monotonic()))
+                for future in done:
+                    if future.exception() is None:
+                        if hedge is not None:
+                            self.resolve_hedge(source, primary, hedge, future)
+                        self.abandon(pending, data)
+                        return
+                    error = future.exception()
+                now = time.monotonic()
+                if hedge_at is not None and now >= hedge_at and pending:
+                    logging.info(f"Hedging {source} after {now - start}")
+                    with self.lock:
+                        self.hedges_fired += 1
+                    hedge = self.start(call, attempt, hedge=True)
+                    pending.add(hedge)
+                    hedge_at = None
+                if deadline is not None and now >= deadline and pending:
+                    error = TimeoutError(f"Attempt {attempt} timed out after"
+                                         f" {self.options.timeout} seconds")
+                    with self.lock:
+                        self.timeouts += 1
+                    self.abandon(pending, data)
+                    break
+        raise RuntimeError(f"Upload of {source} failed after"
+                           f" {self.options.retries + 1} attempts") from error
+
+    @staticmethod
+    def abandon(attempts: Iterable[Future],
+                data: memoryview | None) -> None:
+        """Leave attempts running, holding the data they read until they
+        end.
+        """
+        if data is None:
+            return
+        for future in attempts:
+            StagingBuffer.hold(data, future)
+
+    def resolve_hedge(self, source: Path, primary: Future, hedge: Future,
+                      winner: Future) -> None:
+        """Record the outcome of a hedged attempt.
+
+        If the hedge won, the time saved is known only once the abandoned
+        primary attempt finishes, so it is recorded then.
+        """
+        context = dict(getattr(_event_fields, "fields", {}))
+        end = time.monotonic()
+        if winner is primary:
+            events.emit("hedge", end, end, won=False, saved=0.0)
+            return
+        with self.lock:
+            self.hedges_won += 1
+
+        def record(future: Future):
+            saved = None
+            if future.exception() is None:
+                saved = time.monotonic() - end
+                with self.lock:
+                    self.hedge_saved += saved
+                logging.info(f"Hedge for {source} saved {saved}")
+            with event_context(**context):
+                events.emit("hedge", end, end, won=True, saved=saved)
+
+        primary.add_done_callback(record)
+
+    def report(self) -> None:
+        """Log the retry and hedging counters."""
+        with self.lock:
+            logging.info(f"Retries {self.retries}, timeouts {self.timeouts};"
+                         f" hedges fired {self.hedges_fired},"
+                         f" won {self.hedges_won},"
+                         f" saved {self.hedge_saved} seconds")
+
+
+class ExposureAggregator:
+    """Pack the CCD images of each exposure into one container object.
+
+    CCD threads sharing an uploader hand their images to `add`.  The last
+    CCD of an exposure to arrive uploads a container of all of them, with a
+    byte-range index (see `container.pack`), while the others wait for that
+    upload to finish.  Each exposure then costs one request instead of one
+    per CCD, at the price of waiting for the slowest CCD.  If some CCDs
+    have not arrived within ``timeout``, a waiting CCD uploads the images
+    there are, and the missing CCDs fail when they arrive.
+
+    Parameters
+    ----------
+    uploader: `Uploader`
+        Uploader shared by the CCD threads.
+    ccds: `int`
+        Number of CCDs contributing to each exposure.
+    name: `str`
+        Name of the node, used in container names.
+    timeout: `float`, optional
+        Seconds after the first CCD of an exposure arrives to wait for the
+        others; waits indefinitely if `None`.
+    """
+
+    def __init__(self, uploader: Uploader, ccds: int, name: str,
+                 timeout: float | None = None):
+        self.uploader = uploader
+        self.ccds = ccds
+        self.name = name
+        self.timeout = timeout
+        self.pending = {}
+        self.closed = set()
+        self.lock = threading.Lock()
+
+    def add(self, num: int, path: Path, member: Path,
+            data: bytes | memoryview) -> None:
+        """Add a CCD image to an exposure's container and wait for the
+        container to be uploaded.
+
+        Parameters
+        ----------
+        num: `int`
+            Number of the exposure.
+        path: `pathlib.Path`
+            Destination path of the container.
+        member: `pathlib.Path`
+            Destination path the image would have on its own; its name is
+            the name of the member.
+        data: bytes-like
+            The image, which must not change until this returns.
+
+        Raises
+        ------
+        RuntimeError
+            Raised if the container upload failed, or if the container was
+            already uploaded without this image.
+        """
+        with self.lock:
+            if num in self.closed:
+                raise RuntimeError(f"Container {path} was uploaded without"
+                                   f" {member.name}, which arrived too late")
+            entry = self.pending.setdefault(
+                num, dict(path=path, members=[], done=threading.Event(),
+                          error=None, deadline=None if self.timeout is None
+                          else time.monotonic() + self.timeout))
+            entry["members"].append((member.name, data))
+            last = len(entry["members"]) >= self.ccds and self.claim(num)
+        if not last:
+            timeout = None
+            if entry["deadline"] is not None:
+                timeout = max(0.0, entry["deadline"] - time.monotonic())
+            if not entry["done"].wait(timeout):
+                with self.lock:
+                    last = self.claim(num)
+                if last:
+                    logging.info(f"Gave up waiting for"
+                                 f" {self.ccds - len(entry['members'])}"
+                                 f" CCDs of exposure {num}")
+        if last:
+            self.finish(entry)
+        else:
+            # Another CCD is uploading the container.
+            entry["done"].wait()
+        if entry["error"] is not None:
+            raise RuntimeError(f"Upload of container {path} failed") \
+                from entry["error"]
+
+    def claim(self, num: int) -> bool:
+        """Take a pending exposure to upload, unless another CCD has taken
+        it; must be called with the lock held.
+        """
+        if num not in self.pending:
+            return False
+        del self.pending[num]
+        self.closed.add(num)
+        return True
+
+    def finish(self, entry: dict) -> None:
+        """Upload a claimed exposure's container and wake its waiters."""
+        try:
+            self.upload(entry["path"], entry["members"])
+        except Exception as exc:
+            entry["error"] = exc
+        finally:
+            entry["done"].set()
+
+    def leave(self) -> None:
+        """Stop expecting images from a CCD whose thread has ended.
+
+        Exposures that were waiting only for that CCD are uploaded now.
+        """
+        with self.lock:
+            self.ccds -= 1
+            ready = [num for num, entry in self.pending.items()
+                     if len(entry["members"]) >= self.ccds]
+            entries = [self.pending[num] for num in ready]
+            for num in ready:
+                self.claim(num)
+        for entry in entries:
+            self.finish(entry)
+
+    def upload(self, path: Path, members: list[tuple[str, bytes]]) -> None:
+        """Upload a container of the given members."""
+        from container import pack
+
+        data = memoryview(b"".join(pack(sorted(members))))
+        checksum = self.uploader.new_checksum()
+        with event_context(bytes=len(data), members=len(members)):
+            if checksum is not None:
+                checksum.update(data)
+            logging.info(f"Uploading {len(members)} CCDs in {path}")
+            self.uploader.transfer(Path(tempfile.gettempdir()), path, data,
+                                   checksum)
+            if checksum is not None:
+                checksum.report()
+
+
+def pipeline_exposures(
+    numexp: int,
+    depth: int,
+    waiter: Waiter,
+    prepare,
+    upload,
+    buffers: list[StagingBuffer] | None = None,
+) -> None:
+    """Stage exposures in a separate thread, overlapping with uploads.
+
+    A stager thread waits for each exposure and prepares it while earlier
+    exposures are still being uploaded by the calling thread.  A bounded
+    queue between the two applies backpressure: the stager blocks once
+    ``depth`` exposures are waiting to be uploaded.
+
+    Parameters
+    ----------
+    numexp: `int`
+        Number of exposures to simulate.
+    depth: `int`
+        Maximum number of staged exposures waiting for upload.
+    waiter: `Waiter`
+        Schedule of exposure trigger times.
+    prepare: callable
+        Called as ``prepare(num, buffer)`` to stage an exposure; returns the
+        arguments for ``upload``.
+    upload: callable
+        Called as ``upload(num, *prepared)`` to upload an exposure.
+    buffers: `list` [`StagingBuffer`], optional
+        Buffers for in-memory staging, recycled once each upload finishes.
+        There must be at least ``depth + 2`` to keep both threads busy.
+    """
+    ready = queue.Queue(maxsize=depth)
+    free = None
+    if buffers is not None:
+        free = queue.Queue()
+        for buffer in buffers:
+            free.put(buffer)
+
+    # Telemetry records from the stager belong to the same CCD.
+    context = getattr(_event_fields, "fields", {})
+
+    def produce():
+        try:
+            for i in range(numexp):
+                with event_context(**context, exposure=i):
+                    waiter.wait_exposure(i)
+                    start = time.time()
+                    buffer = free.get() if free is not None else None
+                    blocked = time.time() - start
+                    prepared = prepare(i, buffer)
+                    start = time.time()
+                    ready.put((i, buffer, prepared))
+                    blocked += time.time() - start
+                if blocked > 0.01:
+                    logging.info(f"Backpressure on exposure {i} = {blocked}")
+        except BaseException as exc:
+            ready.put(exc)
+            return
+        ready.put(None)
+
+    stager = threading.Thread(
+        target=produce,
+        name=f"{threading.current_thread().name}-stage",
+        daemon=True
+    )
+    stager.start()
+    while (entry := ready.get()) is not None:
+        if isinstance(entry, BaseException):
+            raise entry
+        i, buffer, prepared = entry
+        upload(i, *prepared)
+        if buffer is not None:
+            free.put(buffer)
+    stager.join()
+
+
+def setup_logging() -> None:
+    """Configure logging with the thread name as a prefix.
+
+    Threads that simulate a CCD are named after it, so the CCD name appears
+    in the log messages to distinguish between processes and threads.
+    """
+    logging.basicConfig(
+        format="{threadName} {asctime} {message}",
+        style="{",
+        level="INFO"
+    )
 
 
 def simulate(
@@ -321,6 +2464,14 @@ def simulate(
     numexp: int,
     inputfile: Path,
     compress: bool,
+    staging: str = "file",
+    options: TransferOptions | None = None,
+    uploader: Uploader | None = None,
+    pipeline: int = 0,
+    deadline: float | None = None,
+    compressor: str = "fpack",
+    aggregator: ExposureAggregator | None = None,
+    epoch: float | None = None,
 ) -> None:
     """Simulate a series of CCD image transfers.
 
@@ -329,7 +2480,7 @@ def simulate(
     ccd_name: `str`
         Name of the CCD to simulate transferring.
     starttime: `str`
-        Time in HH:MM to start transferring.
+        Time in HH:MM or HH:MM:SS to start transferring.
     destination: `str`
         Destination URI.
     interval: `int`
@@ -342,35 +2493,59 @@ def simulate(
         Path to input image file (same one used for all transfers).
     compress: `bool`
         Compress the input if True.
+    staging: `str`, optional
+        ``file`` to stage each image in ``tempdir`` with `copy`;
+        ``memory`` to stage it in a reusable in-memory buffer with `stage`.
+    options: `TransferOptions`, optional
+        Tuning options for the uploader.
+    uploader: `Uploader`, optional
+        Uploader shared with other CCDs; one is created from
+        ``destination`` and ``options`` if not given.
+    pipeline: `int`, optional
+        Number of exposures that may be staged ahead of the upload in
+        progress; 0 stages and uploads each exposure serially.
+    deadline: `float`, optional
+        Seconds after each exposure by which its upload should finish;
+        defaults to ``interval``.
+    compressor: `str`, optional
+        ``fpack`` to compress with an fpack subprocess, ``tiled`` to compress
+        in process with `compress_tiles`, or ``stream`` to stream the output
+        of `stream_tiles` to the uploader.
+    aggregator: `ExposureAggregator`, optional
+        Collects the images of all CCDs of an exposure into one container
+        object, instead of uploading each one separately.
+    epoch: `float`, optional
+        Precise time of the first exposure in this node's clock, as from
+        `time.time`, overriding ``starttime``.
     """
     # Make sure the CCD name is in the log messages to distinguish between
     # processes.
-    logging.basicConfig(
-        format=f"{ccd_name}" + " {asctime} {message}",
-        style="{",
-        level="INFO"
-    )
+    threading.current_thread().name = ccd_name
+    setup_logging()
 
-    # Check socket options.
-    print(f"Socket opts = {HTTPConnection.default_socket_options}")
+    waiter, seqnum_start = schedule(starttime, interval, epoch)
 
-    hour, minute = starttime.split(":")
-    # Pick a sequence number that will not overlap with other runs.
-    seqnum_start = int(hour + minute) * 10
-
-    uploader = Uploader.create(destination)
+    owned = uploader is None
+    if owned:
+        with event_context(ccd=ccd_name):
+            uploader = Uploader.create(destination, options)
 
-    waiter = Waiter(int(hour), int(minute), interval)
+    # Check socket options.
+    print(f"Socket opts = {uploader.options.socket_options()}")
 
     now = datetime.now()
     obs_day = now.strftime("%Y%m%d")
     obs_day_str = now.strftime("%Y-%m-%d")
 
-    with tempfile.TemporaryDirectory(dir=tempdir) as temp_dir:
+    tracker = DeadlineTracker(waiter,
+                              interval if deadline is None else deadline)
+
+    with event_context(ccd=ccd_name), \
+            tempfile.TemporaryDirectory(dir=tempdir) as temp_dir:
         logging.info(f"Using temp directory {temp_dir}")
         temp_path = Path(temp_dir)
-        for i in range(numexp):
-            waiter.wait_exposure(i)
+
+        def prepare(i: int, buffer: StagingBuffer | None):
             seqnum = seqnum_start + i
             source_path = inputfile
 
@@ -378,11 +2553,166 @@ def simulate(
                 f"{obs_day}{seqnum:05d}",
                 f"MC_O_{obs_day}_{seqnum:05d}_{ccd_name}.fits"
             )
-            logging.info(f"Copying from {source_path} to"
-                         f" {temp_path / dest_path}"
-                         f" with compress = {compress}")
-            dest_path = copy(source_path, temp_path, dest_path, compress)
-            uploader.transfer(temp_path, dest_path)
+            size = source_path.stat().st_size
+            # The checksum is of the file as transferred, so it is computed
+            # by whichever step produces the final bytes.  Aggregated images
+            # are covered by the checksum of their container instead.
+            checksum = None
+            if aggregator is None:
+                checksum = uploader.new_checksum()
+            with event_context(exposure=i, bytes=size):
+                if buffer is not None:
+                    if not compress:
+                        return dest_path, stage(source_path, buffer,
+                                                checksum), checksum
+                    data = stage(source_path, buffer)
+                    dest_path = dest_path.with_suffix(".fits.fz")
+                    if compressor == "stream":
+                        # Computed as the pieces are sent.
+                        return dest_path, stream_tiles(data), checksum
+                    return dest_path, compress_tiles(data, checksum), checksum
+                logging.info(f"Copying from {source_path} to"
+                             f" {temp_path / dest_path}"
+                             f" with compress = {compress}")
+                dest_path = copy(source_path, temp_path, dest_path,
+                                 checksum=None if compress else checksum)
+                if compress and compressor == "fpack":
+                    dest_path = fpack(temp_path, dest_path)
+                    if checksum is not None:
+                        checksum_file(temp_path / dest_path, checksum)
+                elif compress:
+                    data = compress_tiles((temp_path / dest_path).read_bytes(),
+                                          checksum)
+                    dest_path = dest_path.with_suffix(".fits.fz")
+                    (temp_path / dest_path).write_bytes(data)
+                return dest_path, None, checksum
+
+        def upload(i: int, dest_path: Path,
+                   data: memoryview | Iterator[bytes] | None,
+                   checksum: Checksum | None = None):
+            streamed = not (data is None or isinstance(data, memoryview))
+            if data is None:
+                size = (temp_path / dest_path).stat().st_size
+            elif streamed:
+                # The size is not known until compression ends, so count the
+                # bytes into the telemetry context as they are sent.
+                def counted(chunks: Iterator[bytes]) -> Iterator[bytes]:
+                    for chunk in chunks:
+                        _event_fields.fields["bytes"] += len(chunk)
+                        if checksum is not None:
+                            checksum.update(chunk)
+                        yield chunk
+
+                size = 0
+                data = counted(data)
+            else:
+                size = len(data)
+            with event_context(exposure=i, bytes=size):
+                try:
+                    if aggregator is not None:
+                        if data is None:
+                            data = (temp_path / dest_path).read_bytes()
+                        elif streamed:
+                            data = b"".join(data)
+                        seqnum = seqnum_start + i
+                        container = dest_path.with_name(
+                            f"MC_O_{obs_day}_{seqnum:05d}_{aggregator.name}"
+                            ".apxc")
+                        aggregator.add(i, container, dest_path, data)
+                    elif streamed:
+                        uploader.transfer_stream(dest_path, data, checksum)
+                    else:
+                        uploader.transfer(temp_path, dest_path, data,
+                                          checksum)
+                except Exception:
+                    # Give up on this exposure, but carry on with the next.
+                    logging.exception(f"Upload of exposure {i} failed")
+                    now = time.monotonic()
+                    events.emit("failed", now, now)
+                    tracker.fail(i)
+                    return
+                tracker.record(i)
+                if checksum is not None:
+                    checksum.report()
+
+        try:
+            if pipeline > 0:
+                buffers = None
+                if staging == "memory":
+                    buffers = [StagingBuffer() for _ in range(pipeline + 2)]
+                pipeline_exposures(numexp, pipeline, waiter, prepare, upload,
+                                   buffers)
+            else:
+                buffer = StagingBuffer() if staging == "memory" else None
+                for i in range(numexp):
+                    with event_context(exposure=i):
+                        waiter.wait_exposure(i)
+                    upload(i, *prepare(i, buffer))
+        finally:
+            # Whether this CCD finished or failed, the other CCDs must not
+            # wait for it.
+            if aggregator is not None:
+                aggregator.leave()
+
+    tracker.report()
+    if owned:
+        uploader.report()
+
+
+def simulate_threads(
+    ccd_names: list[str],
+    destination: str,
+    options: TransferOptions | None = None,
+    aggregate: bool = False,
+    **kwargs
+) -> None:
+    """Simulate several CCDs in threads that share one uploader.
+
+    All CCDs therefore share one client and one bounded connection pool.
+    They can also share the uploads themselves, packing the images of each
+    exposure into one container named after the calling thread.
+
+    Parameters
+    ----------
+    ccd_names: `list` [`str`]
+        Names of the CCDs to simulate.
+    destination: `str`
+        Destination URI.
+    options: `TransferOptions`, optional
+        Tuning options for the shared uploader.
+    aggregate: `bool`, optional
+        Upload one container per exposure rather than one object per CCD.
+    **kwargs
+        Other arguments for `simulate`.
+    """
+    setup_logging()
+    uploader = Uploader.create(destination, options)
+    aggregator = None
+    if aggregate:
+        # A CCD that has not staged an exposure by its deadline has missed
+        # it anyway.
+        aggregator = ExposureAggregator(
+            uploader, len(ccd_names), threading.current_thread().name,
+            kwargs.get("deadline") or kwargs["interval"])
+    threads = []
+    for ccd_name in ccd_names:
+        thread = threading.Thread(
+            target=simulate,
+            args=(ccd_name,),
+            kwargs=dict(
+                kwargs,
+                destination=destination,
+                options=options,
+                uploader=uploader,
+                aggregator=aggregator
+            )
+        )
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+    logging.info("All threads finished")
+    uploader.report()
 
 
 def main():
@@ -398,6 +2728,21 @@ def main():
     # Build and use the argument parser.
     parser = build_parser()
     args = parser.parse_args()
+    if args.compress and args.staging == "memory" \
+            and args.compressor == "fpack":
+        parser.error("--compress with --staging memory requires"
+                     " --compressor tiled or stream")
+    if args.compressor == "stream" and args.staging != "memory":
+        parser.error("--compressor stream requires --staging memory")
+    if args.starttime is None and args.coordinator is None:
+        parser.error("--starttime is required without --coordinator")
+    if args.aggregate and args.engine != "thread":
+        parser.error("--aggregate requires --engine thread")
+    if args.checksum == "crc32c":
+        try:
+            import google_crc32c  # noqa: F401
+        except ImportError:
+            parser.error("--checksum crc32c requires google-crc32c")
 
     # Figure out a node number that we can use to create a unique CCD name.
     host_name = socket.gethostname()
@@ -415,6 +2760,22 @@ def main():
             else:
                 node_num = 0
 
+    # A coordinator replaces the node number and start time, and corrects
+    # the start time for the offset of this node's clock.
+    worker = None
+    ccd_numbers = range(args.ccds)
+    starttime, epoch = args.starttime, None
+    if args.coordinator is not None:
+        from coordinator import Worker
+        worker = Worker(args.coordinator)
+        assignment = worker.register(host_name, args.ccds)
+        node_num = assignment["node"]
+        ccd_numbers = range(assignment["first"],
+                            assignment["first"] + assignment["count"])
+        starttime, epoch = assignment["starttime"], assignment["epoch"]
+        print(f"Coordinated as node {node_num} starting at {starttime},"
+              f" clock offset {assignment['offset']}")
+
     # Private network for Google Cloud Storage requires pointing the
     # well-known API hostname to an internal IP address.  In a container, we
     # can append to /etc/hosts; on bare metal, this needs to be handled
@@ -425,37 +2786,70 @@ def main():
             print(f"199.36.153.{int(node_num) % 4 + 8} storage.googleapis.com",
                   file=f)
 
-    # Attempt to set HTTPConnection socket options to enable TCP keepalive.
+    # TCP keepalive is set on each uploader's connections by its options.
     if args.keepalive:
         print("Using TCP keepalive")
-        HTTPConnection.default_socket_options += [
-            (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1),
-            (socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, 1),
-            (socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, 1)
-        ]
 
-    # Fork a process for each CCD to be transferred.
-    jobs = []
-    for ccd in range(args.ccds):
-        pid = os.fork()
-        if pid == 0:
-            simulate(
-                f"{node_num}-{ccd}",
-                args.starttime,
-                args.destination,
-                args.interval,
-                args.tempdir,
-                args.numexp,
-                args.inputfile,
-                args.compress
-            )
-            logging.info("Child process exiting")
-            exit(0)
-        else:
-            jobs.append(pid)
-    # Wait for all child processes.
-    for job in jobs:
-        os.waitpid(job, 0)
+    # The coordinator collects the telemetry, so record it even if no file
+    # was requested, and note where this run's records begin.
+    events_path = args.events
+    if worker is not None and events_path is None:
+        fd, events_path = tempfile.mkstemp(suffix=".jsonl")
+        os.close(fd)
+        events_path = Path(events_path)
+    events_start = 0
+    if events_path is not None:
+        if events_path.exists():
+            events_start = events_path.stat().st_size
+        events.open(events_path)
+
+    ccd_names = [f"{node_num}-{ccd}" for ccd in ccd_numbers]
+    options = TransferOptions.from_args(args)
+    simulate_args = dict(
+        starttime=starttime,
+        epoch=epoch,
+        destination=args.destination,
+        interval=args.interval,
+        tempdir=args.tempdir,
+        numexp=args.numexp,
+        inputfile=args.inputfile,
+        compress=args.compress,
+        staging=args.staging,
+        options=options,
+        pipeline=args.pipeline,
+        deadline=args.deadline,
+        compressor=args.compressor
+    )
+    if args.engine == "thread":
+        # Run a thread for each CCD, all sharing one uploader and therefore
+        # one bounded connection pool.
+        threading.current_thread().name = f"{node_num}"
+        simulate_threads(ccd_names, aggregate=args.aggregate,
+                         **simulate_args)
+    else:
+        # Fork a process for each CCD to be transferred.
+        jobs = []
+        for ccd_name in ccd_names:
+            pid = os.fork()
+            if pid == 0:
+                simulate(ccd_name, **simulate_args)
+                logging.info("Child process exiting")
+                exit(0)
+            else:
+                jobs.append(pid)
+        # Wait for all child processes.
+        for job in jobs:
+            os.waitpid(job, 0)
+
+    if worker is not None:
+        events.close()
+        with events_path.open() as f:
+            f.seek(events_start)
+            worker.report(json.loads(line) for line in f if line.strip())
+        if args.events is None:
+            events_path.unlink()
+        print("Sent telemetry to coordinator")
+        return
 
     # Sleep so that container logs can be obtained more easily.
     print("Main process sleeping")
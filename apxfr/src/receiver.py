@@ -0,0 +1,289 @@
+#!/usr/bin/env python
+
+"""Track when images written by harness.py become available at the
+destination.
+
+The destination is polled for files or objects in the
+``YYYY-MM-DD/<day><seq>/`` layout written by the harness.  Each arrival is
+joined with the sender's exposure schedule, computed from the same start
+time and interval with `harness.schedule`, to give the end-to-end latency
+from exposure trigger to availability.  Exposure containers count as the
+arrival of all of their members.
+"""
+
+from __future__ import annotations
+import argparse
+from datetime import datetime
+import json
+import logging
+from pathlib import Path
+import re
+import statistics
+import sys
+import time
+
+import container
+from harness import PARTIAL_SUFFIX, Waiter, event_context, events, schedule
+
+
+NAME = re.compile(r"MC_O_(?P<day>\d{8})_(?P<seq>\d{5})_(?P<ccd>.+?)"
+                  r"\.(?P<ext>fits|fits\.fz|apxc)$")
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """Build an argument parser for command-line options."""
+
+    parser = argparse.ArgumentParser(
+        description="Record arrival times of images written by harness.py."
+    )
+    parser.add_argument('source',
+                        help=("destination directory, or"
+                              " boto://host/bucket/prefix"))
+    parser.add_argument('-s', '--starttime', required=True,
+                        help="start time of the run in HH:MM or HH:MM:SS")
+    parser.add_argument('-i', '--interval', type=int, default=17,
+                        help="interval between exposures in sec")
+    parser.add_argument('-n', '--numexp', metavar='EXPOSURES', type=int,
+                        default=10, help="number of exposures")
+    parser.add_argument('-c', '--ccds', type=int, default=1,
+                        help="CCDs expected per exposure, over all nodes")
+    parser.add_argument('-P', '--poll', metavar='SECONDS', type=float,
+                        default=0.1, help="interval between listings")
+    parser.add_argument('-w', '--wait', metavar='SECONDS', type=float,
+                        default=60.0,
+                        help=("give up this long after the last exposure"
+                              " if images are still missing"))
+    parser.add_argument('-U', '--insecure', action='store_true',
+                        help="list objects over http rather than https")
+    parser.add_argument('-e', '--events', type=Path,
+                        help="append arrival telemetry to this file")
+    parser.add_argument('-j', '--json', action='store_true',
+                        help="write the summary as JSON")
+    return parser
+
+
+class DirectoryLister:
+    """List images written to a filesystem destination.
+
+    The scp transport writes each file under a temporary name and renames
+    it once complete; temporary names are not listed.  bbcp writes files
+    in place, so a file is only taken to have arrived once its size is
+    unchanged between two listings.
+
+    Parameters
+    ----------
+    root: `pathlib.Path`
+        Directory corresponding to the harness destination.
+    """
+
+    settle = True
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+
+    def list(self) -> dict[str, int]:
+        """Return the size of each image, by path relative to the root."""
+        sizes = {}
+        for path in self.root.glob("????-??-??/*/MC_O_*"):
+            if path.name.endswith(PARTIAL_SUFFIX):
+                continue
+            try:
+                sizes[str(path.relative_to(self.root))] = path.stat().st_size
+            except FileNotFoundError:
+                continue
+        return sizes
+
+    def fetcher(self, key: str) -> container.Fetch:
+        """Return a `container.Fetch` for an image."""
+        return container.file_fetcher(self.root / key)
+
+
+class S3Lister:
+    """List images written to an S3-compatible object store.
+
+    Objects appear atomically once complete.
+
+    Parameters
+    ----------
+    dest: `str`
+        ``host/bucket/prefix``, as given to the harness ``boto://``
+        destination.
+    secure: `bool`, optional
+        Use https rather than http.
+    """
+
+    settle = False
+
+    def __init__(self, dest: str, secure: bool = True):
+        import boto3
+        host, self.bucket, self.prefix = dest.split("/", 2)
+        scheme = "https" if secure else "http"
+        self.client = boto3.client('s3', endpoint_url=f"{scheme}://{host}")
+
+    def list(self) -> dict[str, int]:
+        """Return the size of each image, by key relative to the prefix."""
+        sizes = {}
+        prefix = f"{self.prefix}/" if self.prefix else ""
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+            for item in page.get("Contents", []):
+                sizes[item["Key"][len(prefix):]] = item["Size"]
+        return sizes
+
+    def fetcher(self, key: str) -> container.Fetch:
+        """Return a `container.Fetch` for an image."""
+        prefix = f"{self.prefix}/" if self.prefix else ""
+        return container.s3_fetcher(self.client, self.bucket, prefix + key)
+
+
+class ArrivalTracker:
+    """Record the arrival of the images of a run.
+
+    Parameters
+    ----------
+    lister: `DirectoryLister` or `S3Lister`
+        Lists the images at the destination.
+    waiter: `Waiter`
+        Schedule of exposure trigger times.
+    seqnum_start: `int`
+        Sequence number of the first exposure.
+    numexp: `int`
+        Number of exposures in the run.
+    ccds: `int`
+        Number of CCDs expected per exposure.
+    """
+
+    def __init__(self, lister, waiter: Waiter, seqnum_start: int,
+                 numexp: int, ccds: int):
+        self.lister = lister
+        self.waiter = waiter
+        self.seqnum_start = seqnum_start
+        self.numexp = numexp
+        self.ccds = ccds
+        # Size and time first seen with that size, by key.
+        self.seen = {}
+        self.done = set()
+        # Latency and size by CCD, by exposure.
+        self.arrivals = {i: {} for i in range(numexp)}
+
+    def poll(self) -> None:
+        """List the destination once and record any new arrivals."""
+        now = datetime.now()
+        for key, size in self.lister.list().items():
+            if key in self.done:
+                continue
+            match = NAME.search(key)
+            if match is None:
+                continue
+            exposure = int(match["seq"]) - self.seqnum_start
+            if not 0 <= exposure < self.numexp:
+                continue
+            previous = self.seen.get(key)
+            if previous is None or previous[0] != size:
+                self.seen[key] = (size, now)
+                if self.lister.settle:
+                    continue
+            arrived = self.seen[key][1]
+            self.done.add(key)
+            if match["ext"] == "apxc":
+                index = container.read_index(self.lister.fetcher(key))
+                for name, (_, member_size) in index.items():
+                    member = NAME.search(name)
+                    if member is not None:
+                        self.record(exposure, member["ccd"], arrived,
+                                    member_size)
+            else:
+                self.record(exposure, match["ccd"], arrived, size)
+
+    def record(self, exposure: int, ccd: str, arrived: datetime,
+               size: int) -> None:
+        """Record the arrival of one CCD image."""
+        trigger = self.waiter.exposure_time(exposure)
+        latency = (arrived - trigger).total_seconds()
+        self.arrivals[exposure][ccd] = (latency, size)
+        logging.info(f"Arrived exposure {exposure} CCD {ccd} = {latency}")
+        end = time.monotonic() - (datetime.now() - arrived).total_seconds()
+        with event_context(exposure=exposure, ccd=ccd, bytes=size):
+            events.emit("arrival", end - latency, end)
+
+    @property
+    def complete(self) -> bool:
+        """True if all images of the run have arrived."""
+        return all(len(ccds) >= self.ccds for ccds in self.arrivals.values())
+
+    def summarize(self) -> list[dict]:
+        """Return end-to-end latency and completeness for each exposure."""
+        summary = []
+        for exposure, ccds in self.arrivals.items():
+            entry = dict(
+                exposure=exposure,
+                seq=self.seqnum_start + exposure,
+                received=len(ccds),
+                expected=self.ccds,
+                complete=len(ccds) >= self.ccds,
+            )
+            if ccds:
+                latencies = sorted(latency for latency, _ in ccds.values())
+                last = max(ccds, key=lambda ccd: ccds[ccd][0])
+                entry.update(
+                    first=latencies[0],
+                    median=statistics.median(latencies),
+                    last=latencies[-1],
+                    last_ccd=last,
+                )
+            summary.append(entry)
+        return summary
+
+
+def print_summary(summary: list[dict], out=sys.stdout) -> None:
+    """Print a summary from `ArrivalTracker.summarize` as a table."""
+
+    def seconds(value):
+        return "-" if value is None else f"{value:.3f}"
+
+    print(f"{'exposure':>8} {'seq':>6} {'CCDs':>9} {'first':>8} {'p50':>8}"
+          f" {'last':>8} last CCD", file=out)
+    for entry in summary:
+        print(f"{entry['exposure']:>8} {entry['seq']:>6}"
+              f" {entry['received']:>4}/{entry['expected']:<4}"
+              f" {seconds(entry.get('first')):>8}"
+              f" {seconds(entry.get('median')):>8}"
+              f" {seconds(entry.get('last')):>8}"
+              f" {entry.get('last_ccd', '-')}", file=out)
+    complete = sum(1 for entry in summary if entry["complete"])
+    print(f"Complete exposures: {complete} of {len(summary)}", file=out)
+
+
+def main():
+    """Main program."""
+    args = build_parser().parse_args()
+    logging.basicConfig(format="{asctime} {message}", style="{",
+                        level="INFO")
+    if args.source.startswith("boto://"):
+        lister = S3Lister(args.source[len("boto://"):], not args.insecure)
+    else:
+        lister = DirectoryLister(Path(args.source))
+    if args.events is not None:
+        events.open(args.events)
+
+    waiter, seqnum_start = schedule(args.starttime, args.interval)
+    tracker = ArrivalTracker(lister, waiter, seqnum_start, args.numexp,
+                             args.ccds)
+    give_up = waiter.exposure_time(args.numexp - 1).timestamp() + args.wait
+    while not tracker.complete and time.time() < give_up:
+        tracker.poll()
+        time.sleep(args.poll)
+    # Pick up anything that was still settling.
+    tracker.poll()
+    events.close()
+
+    summary = tracker.summarize()
+    if args.json:
+        json.dump(summary, sys.stdout, indent=2)
+        print()
+    else:
+        print_summary(summary)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+
+from __future__ import annotations
+import argparse
+from collections import defaultdict
+import json
+import math
+from pathlib import Path
+import sys
+from typing import Iterable, Iterator
+
+
+LATE_BUCKETS = (1, 2, 5, 10, 30, 60)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """Build an argument parser for command-line options."""
+
+    parser = argparse.ArgumentParser(
+        description="Summarize telemetry records written by harness.py."
+    )
+    parser.add_argument('events', metavar='FILE', type=Path, nargs='+',
+                        help=("telemetry file from harness.py --events, or a"
+                              " directory of *.jsonl files"))
+    parser.add_argument('-j', '--json', action='store_true',
+                        help="write the summary as JSON")
+    return parser
+
+
+def read_events(paths: Iterable[Path]) -> Iterator[dict]:
+    """Read telemetry records from files or directories of files.
+
+    Parameters
+    ----------
+    paths: iterable of `pathlib.Path`
+        Telemetry files, or directories containing ``*.jsonl`` files.
+
+    Yields
+    ------
+    record: `dict`
+        One telemetry record.
+    """
+    for path in paths:
+        files = sorted(path.glob("*.jsonl")) if path.is_dir() else [path]
+        for file in files:
+            with file.open() as f:
+                for line in f:
+                    if line.strip():
+                        yield json.loads(line)
+
+
+def percentile(values: list[float], pct: float) -> float:
+    """Return a nearest-rank percentile of sorted values."""
+    if not values:
+        return math.nan
+    rank = max(1, math.ceil(pct / 100 * len(values)))
+    return values[rank - 1]
+
+
+def summarize(records: Iterable[dict]) -> dict:
+    """Compute per-phase latency, throughput and late-exposure statistics.
+
+    Parameters
+    ----------
+    records: iterable of `dict`
+        Telemetry records, possibly from many nodes.
+
+    Returns
+    -------
+    summary: `dict`
+        ``phases`` maps each phase to its count, byte total, latency
+        percentiles and throughput; ``deadlines`` describes the exposures
+        that missed their deadline; ``hedges`` counts hedged uploads and
+        the time they saved; ``failed`` counts exposures whose upload was
+        given up.
+    """
+    durations = defaultdict(list)
+    nbytes = defaultdict(int)
+    first = defaultdict(lambda: math.inf)
+    last = defaultdict(lambda: -math.inf)
+    hosts = set()
+    late = []
+    late_by_exposure = defaultdict(list)
+    deadline_count = 0
+    hedges = dict(fired=0, won=0, saved=0.0)
+    failed = 0
+
+    for record in records:
+        phase = record["phase"]
+        hosts.add(record.get("host"))
+        if phase == "deadline":
+            deadline_count += 1
+            if record["late"] > 0:
+                late.append(record["late"])
+                late_by_exposure[record.get("exposure")].append(record)
+            continue
+        if phase == "hedge":
+            hedges["fired"] += 1
+            if record["won"]:
+                hedges["won"] += 1
+                hedges["saved"] += record["saved"] or 0.0
+            continue
+        if phase == "failed":
+            failed += 1
+            continue
+        durations[phase].append(record["duration"])
+        nbytes[phase] += record.get("bytes", 0)
+        first[phase] = min(first[phase], record["wall"])
+        last[phase] = max(last[phase], record["wall"] + record["duration"])
+
+    phases = {}
+    for phase, values in sorted(durations.items()):
+        values.sort()
+        span = last[phase] - first[phase]
+        busy = sum(values)
+        phases[phase] = dict(
+            count=len(values),
+            bytes=nbytes[phase],
+            p50=percentile(values, 50),
+            p95=percentile(values, 95),
+            p99=percentile(values, 99),
+            max=values[-1],
+            # Throughput of a single stream, and of all streams together
+            # over the wall-clock span of the phase.
+            stream_mbps=nbytes[phase] / busy / 1e6 if busy > 0 else None,
+            total_mbps=nbytes[phase] / span / 1e6 if span > 0 else None,
+        )
+
+    histogram = {}
+    lower = 0
+    for upper in LATE_BUCKETS + (math.inf,):
+        label = f"{lower}-{upper}s" if upper != math.inf else f">{lower}s"
+        histogram[label] = sum(1 for v in late if lower < v <= upper)
+        lower = upper
+    exposures = {
+        exposure: dict(
+            ccds=len(misses),
+            max_late=max(r["late"] for r in misses),
+        )
+        for exposure, misses in sorted(late_by_exposure.items(),
+                                       key=lambda item: str(item[0]))
+    }
+
+    return dict(
+        hosts=len(hosts),
+        phases=phases,
+        deadlines=dict(
+            count=deadline_count,
+            missed=len(late),
+            histogram=histogram,
+            exposures=exposures,
+        ),
+        hedges=hedges,
+        failed=failed,
+    )
+
+
+def print_summary(summary: dict, out=sys.stdout) -> None:
+    """Print a summary from `summarize` as text tables."""
+
+    def mbps(value):
+        return "-" if value is None else f"{value:.1f}"
+
+    print(f"Hosts: {summary['hosts']}", file=out)
+    print(f"{'phase':<10} {'count':>7} {'MB':>10} {'p50':>8} {'p95':>8}"
+          f" {'p99':>8} {'max':>8} {'MB/s':>8} {'tot MB/s':>9}", file=out)
+    for phase, stats in summary["phases"].items():
+        print(f"{phase:<10} {stats['count']:>7} {stats['bytes'] / 1e6:>10.1f}"
+              f" {stats['p50']:>8.3f} {stats['p95']:>8.3f}"
+              f" {stats['p99']:>8.3f} {stats['max']:>8.3f}"
+              f" {mbps(stats['stream_mbps']):>8}"
+              f" {mbps(stats['total_mbps']):>9}", file=out)
+
+    deadlines = summary["deadlines"]
+    print(f"Missed deadlines: {deadlines['missed']} of {deadlines['count']}",
+          file=out)
+    for label, count in deadlines["histogram"].items():
+        if count:
+            print(f"  {label:>8}: {count}", file=out)
+    for exposure, stats in deadlines["exposures"].items():
+        print(f"  exposure {exposure}: {stats['ccds']} CCDs late,"
+              f" max {stats['max_late']:.3f}s", file=out)
+    hedges = summary["hedges"]
+    if hedges["fired"]:
+        print(f"Hedges: {hedges['fired']} fired, {hedges['won']} won,"
+              f" {hedges['saved']:.3f}s saved", file=out)
+    if summary["failed"]:
+        print(f"Failed uploads: {summary['failed']}", file=out)
+
+
+def main():
+    """Main program."""
+    args = build_parser().parse_args()
+    summary = summarize(read_events(args.events))
+    if args.json:
+        json.dump(summary, sys.stdout, indent=2)
+        print()
+    else:
+        print_summary(summary)
+
+
+if __name__ == "__main__":
+    main()
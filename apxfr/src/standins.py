@@ -0,0 +1,601 @@
+#!/usr/bin/env python
+
+"""Local stand-ins for transfer destinations.
+
+These servers accept the same requests as the real destinations used by
+harness.py, but store objects under a local directory so that transfers can
+be measured reproducibly on localhost.  Latency and bandwidth limits can be
+injected to approximate a long-distance link.
+"""
+
+from __future__ import annotations
+import argparse
+import base64
+from email.utils import formatdate
+import hashlib
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import logging
+import os
+from pathlib import Path
+import random
+import shutil
+import stat
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import parse_qs, unquote, urlsplit
+import uuid
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape
+
+
+S3_NS = "http://s3.amazonaws.com/doc/2006-03-01/"
+
+
+class Throttle:
+    """Latency and bandwidth limits shared by all requests to a server.
+
+    Parameters
+    ----------
+    latency: `float`, optional
+        Delay in seconds added before handling each request.
+    bandwidth: `float`, optional
+        Maximum aggregate rate in bytes per second at which request bodies
+        are read; 0 for no limit.
+    stall: `float`, optional
+        Additional delay in seconds for requests that stall, to simulate
+        stragglers.
+    stall_rate: `float`, optional
+        Fraction of requests that stall.
+    """
+
+    def __init__(self, latency: float = 0.0, bandwidth: float = 0.0,
+                 stall: float = 0.0, stall_rate: float = 0.0):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.stall = stall
+        self.stall_rate = stall_rate
+        self._lock = threading.Lock()
+        self._next = 0.0
+
+    def delay(self) -> None:
+        """Wait for the configured latency, and possibly stall."""
+        delay = self.latency
+        if self.stall_rate > 0 and random.random() < self.stall_rate:
+            delay += self.stall
+        if delay > 0:
+            time.sleep(delay)
+
+    def consume(self, nbytes: int) -> None:
+        """Wait until ``nbytes`` more bytes fit within the bandwidth limit."""
+        if self.bandwidth <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._next = max(self._next, now) + nbytes / self.bandwidth
+            wait = self._next - now
+        if wait > 0:
+            time.sleep(wait)
+
+
+class StandInServer(ThreadingHTTPServer):
+    """Threaded HTTP server storing objects under a root directory.
+
+    Parameters
+    ----------
+    handler: `type`
+        Request handler class.
+    root: `pathlib.Path`
+        Directory in which to store objects.
+    throttle: `Throttle`, optional
+        Limits to apply to requests.
+    port: `int`, optional
+        Port to listen on; 0 picks a free port.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, handler: type, root: Path,
+                 throttle: Throttle | None = None, port: int = 0):
+        super().__init__(("127.0.0.1", port), handler)
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.throttle = throttle or Throttle()
+        self.requests = 0
+
+    @property
+    def address(self) -> str:
+        """Host and port on which the server is listening."""
+        host, port = self.server_address[:2]
+        return f"{host}:{port}"
+
+    def start(self) -> StandInServer:
+        """Serve requests in a daemon thread."""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """Common request handling for the stand-in servers."""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        logging.debug("%s " + format, self.server.address, *args)
+
+    def parse_request(self) -> bool:
+        self.trailers = {}
+        if not super().parse_request():
+            return False
+        self.server.requests += 1
+        self.server.throttle.delay()
+        return True
+
+    def read_body(self) -> bytes:
+        """Read the request body, applying the bandwidth limit.
+
+        Handles plain, HTTP-chunked and S3 ``aws-chunked`` bodies.
+        """
+        if "chunked" in self.headers.get("Transfer-Encoding", ""):
+            body = self._read_chunked(self.rfile)
+        else:
+            length = int(self.headers.get("Content-Length", 0))
+            parts = []
+            while length > 0:
+                chunk = self.rfile.read(min(length, 65536))
+                if not chunk:
+                    break
+                self.server.throttle.consume(len(chunk))
+                parts.append(chunk)
+                length -= len(chunk)
+            body = b"".join(parts)
+        if "aws-chunked" in self.headers.get("Content-Encoding", ""):
+            body = self._read_chunked(_BytesReader(body), throttle=False)
+        return body
+
+    def _read_chunked(self, stream, throttle: bool = True) -> bytes:
+        parts = []
+        while True:
+            line = stream.readline()
+            size = int(line.split(b";", 1)[0].strip() or b"0", 16)
+            if size == 0:
+                # Trailers, such as the checksums botocore sends with
+                # aws-chunked bodies, count as headers.
+                while (line := stream.readline().strip()):
+                    key, _, value = line.decode().partition(":")
+                    self.trailers[key.strip().lower()] = value.strip()
+                break
+            chunk = stream.read(size)
+            if throttle:
+                self.server.throttle.consume(len(chunk))
+            parts.append(chunk)
+            stream.readline()
+        return b"".join(parts)
+
+    def digests(self, body: bytes) -> dict[str, str]:
+        """Return base64 checksums of a body, by algorithm."""
+        digests = {"md5": base64.b64encode(hashlib.md5(body).digest())}
+        try:
+            import google_crc32c
+        except ImportError:
+            pass
+        else:
+            digests["crc32c"] = base64.b64encode(
+                google_crc32c.Checksum(body).digest())
+        return {algorithm: value.decode()
+                for algorithm, value in digests.items()}
+
+    def check_digests(self, body: bytes) -> bool:
+        """Check the checksums sent with a request, as the real services do.
+
+        Understands ``Content-MD5``, ``x-amz-checksum-crc32c`` and RFC 9530
+        ``Content-Digest`` headers; algorithms that cannot be computed here
+        are ignored.
+        """
+        sent = {}
+        if "Content-MD5" in self.headers:
+            sent["md5"] = self.headers["Content-MD5"]
+        if (crc32c := self.sent_checksum("crc32c")) is not None:
+            sent["crc32c"] = crc32c
+        for item in self.headers.get("Content-Digest", "").split(","):
+            algorithm, _, value = item.strip().partition("=")
+            if value.startswith(":") and value.endswith(":"):
+                sent[algorithm.lower()] = value[1:-1]
+        actual = self.digests(body)
+        return all(actual.get(algorithm, value) == value
+                   for algorithm, value in sent.items())
+
+    def sent_checksum(self, algorithm: str) -> str | None:
+        """Return an x-amz-checksum-* value sent as a header or trailer."""
+        name = f"x-amz-checksum-{algorithm}"
+        return self.headers.get(name, self.trailers.get(name))
+
+    def respond(self, status: int, body: bytes = b"",
+                headers: dict | None = None) -> None:
+        """Send a complete response."""
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if body and self.command != "HEAD":
+            self.wfile.write(body)
+
+    def store(self, path: Path, body: bytes) -> str:
+        """Atomically write an object and return its ETag."""
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=path.parent, delete=False,
+                                         prefix=".incoming-") as f:
+            f.write(body)
+        os.replace(f.name, path)
+        return f'"{hashlib.md5(body).hexdigest()}"'
+
+    def serve_file(self, path: Path) -> None:
+        """Respond with a stored object, honouring a byte-range request."""
+        if not path.is_file():
+            self.respond(HTTPStatus.NOT_FOUND)
+            return
+        data = path.read_bytes()
+        status = HTTPStatus.OK
+        headers = {
+            "ETag": f'"{hashlib.md5(data).hexdigest()}"',
+            "Last-Modified": formatdate(path.stat().st_mtime, usegmt=True),
+            "Accept-Ranges": "bytes",
+        }
+        byte_range = self.headers.get("Range", "")
+        if byte_range.startswith("bytes="):
+            first, _, last = byte_range[len("bytes="):].partition("-")
+            if first == "":
+                first = max(0, len(data) - int(last))
+                last = len(data) - 1
+            first = int(first)
+            last = min(int(last), len(data) - 1) if last else len(data) - 1
+            headers["Content-Range"] = f"bytes {first}-{last}/{len(data)}"
+            data = data[first:last + 1]
+            status = HTTPStatus.PARTIAL_CONTENT
+        self.respond(status, data, headers)
+
+
+class _BytesReader:
+    """Minimal stream interface over bytes for chunked decoding."""
+
+    def __init__(self, data: bytes):
+        self._data = data
+        self._pos = 0
+
+    def readline(self) -> bytes:
+        end = self._data.find(b"\n", self._pos)
+        end = len(self._data) if end < 0 else end + 1
+        line = self._data[self._pos:end]
+        self._pos = end
+        return line
+
+    def read(self, size: int) -> bytes:
+        chunk = self._data[self._pos:self._pos + size]
+        self._pos += len(chunk)
+        return chunk
+
+
+class PutHandler(StandInHandler):
+    """Plain web server accepting HTTP PUT, as used by HttpUploader."""
+
+    def _path(self) -> Path:
+        return self.server.root / unquote(urlsplit(self.path).path).lstrip("/")
+
+    def do_PUT(self):
+        body = self.read_body()
+        if not self.check_digests(body):
+            self.respond(HTTPStatus.BAD_REQUEST)
+            return
+        etag = self.store(self._path(), body)
+        digest = ", ".join(f"{algorithm}=:{value}:"
+                           for algorithm, value in self.digests(body).items())
+        self.respond(HTTPStatus.CREATED,
+                     headers={"ETag": etag, "Repr-Digest": digest})
+
+    def do_GET(self):
+        self.serve_file(self._path())
+
+    do_HEAD = do_GET
+
+
+class S3Handler(StandInHandler):
+    """Path-style subset of the S3 API, as used by boto3 and Minio.
+
+    Supports object PUT/GET/HEAD/DELETE, multipart uploads, ListObjectsV2
+    and bucket location queries.  Requests are not authenticated and
+    buckets are created on demand.  As in S3, a multipart upload created
+    with a checksum algorithm needs that checksum on every part and in
+    the completion request, and they must match.
+    """
+
+    uploads = {}
+    uploads_lock = threading.Lock()
+
+    def _parse(self):
+        url = urlsplit(self.path)
+        bucket, _, key = unquote(url.path).lstrip("/").partition("/")
+        query = parse_qs(url.query, keep_blank_values=True)
+        return bucket, key, query
+
+    def _xml(self, status: int, root: str, content: str) -> None:
+        body = (f'<?xml version="1.0" encoding="UTF-8"?>\n'
+                f'<{root} xmlns="{S3_NS}">{content}</{root}>').encode()
+        self.respond(status, body, {"Content-Type": "application/xml"})
+
+    def _error(self, status: int, code: str) -> None:
+        body = (f'<?xml version="1.0" encoding="UTF-8"?>\n'
+                f'<Error><Code>{code}</Code><Message>{code}</Message>'
+                f'<Resource>{escape(self.path)}</Resource></Error>').encode()
+        self.respond(status, body, {"Content-Type": "application/xml"})
+
+    def do_PUT(self):
+        bucket, key, query = self._parse()
+        body = self.read_body()
+        if not key:
+            (self.server.root / bucket).mkdir(parents=True, exist_ok=True)
+            self.respond(HTTPStatus.OK)
+            return
+        if not self.check_digests(body):
+            self._error(HTTPStatus.BAD_REQUEST, "BadDigest")
+            return
+        if "uploadId" in query:
+            upload_id = query["uploadId"][0]
+            number = int(query["partNumber"][0])
+            with self.uploads_lock:
+                upload = self.uploads.get(upload_id)
+                if upload is None:
+                    self._error(HTTPStatus.NOT_FOUND, "NoSuchUpload")
+                    return
+                algorithm = upload["algorithm"]
+                if algorithm is not None \
+                        and self.sent_checksum(algorithm) is None:
+                    self._error(HTTPStatus.BAD_REQUEST, "InvalidRequest")
+                    return
+                upload["parts"][number] = body
+            etag = f'"{hashlib.md5(body).hexdigest()}"'
+            self.respond(HTTPStatus.OK, headers={"ETag": etag})
+            return
+        etag = self.store(self.server.root / bucket / key, body)
+        self.respond(HTTPStatus.OK, headers={"ETag": etag})
+
+    def do_POST(self):
+        bucket, key, query = self._parse()
+        body = self.read_body()
+        if "uploads" in query:
+            upload_id = uuid.uuid4().hex
+            algorithm = self.headers.get("x-amz-checksum-algorithm")
+            with self.uploads_lock:
+                self.uploads[upload_id] = dict(
+                    parts={}, algorithm=algorithm and algorithm.lower())
+            self._xml(HTTPStatus.OK, "InitiateMultipartUploadResult",
+                      f"<Bucket>{escape(bucket)}</Bucket>"
+                      f"<Key>{escape(key)}</Key>"
+                      f"<UploadId>{upload_id}</UploadId>")
+            return
+        if "uploadId" in query:
+            upload_id = query["uploadId"][0]
+            with self.uploads_lock:
+                upload = self.uploads.pop(upload_id, None)
+            if upload is None:
+                self._error(HTTPStatus.NOT_FOUND, "NoSuchUpload")
+                return
+            parts = upload["parts"]
+            listed = {}
+            for element in ElementTree.fromstring(body).iter():
+                if element.tag.rpartition("}")[2] != "Part":
+                    continue
+                fields = {child.tag.rpartition("}")[2]: child.text
+                          for child in element}
+                listed[int(fields["PartNumber"])] = fields
+            numbers = sorted(listed)
+            if any(n not in parts for n in numbers):
+                self._error(HTTPStatus.BAD_REQUEST, "InvalidPart")
+                return
+            algorithm = upload["algorithm"]
+            if algorithm is not None:
+                field = "Checksum" + algorithm.upper()
+                for n in numbers:
+                    digest = self.digests(parts[n]).get(algorithm)
+                    if listed[n].get(field) is None or (
+                            digest is not None
+                            and listed[n][field] != digest):
+                        self._error(HTTPStatus.BAD_REQUEST, "InvalidPart")
+                        return
+            data = b"".join(parts[n] for n in numbers)
+            self.store(self.server.root / bucket / key, data)
+            digest = hashlib.md5(b"".join(
+                hashlib.md5(parts[n]).digest() for n in numbers))
+            self._xml(HTTPStatus.OK, "CompleteMultipartUploadResult",
+                      f"<Bucket>{escape(bucket)}</Bucket>"
+                      f"<Key>{escape(key)}</Key>"
+                      f"<ETag>\"{digest.hexdigest()}-{len(numbers)}\"</ETag>")
+            return
+        self._error(HTTPStatus.BAD_REQUEST, "InvalidRequest")
+
+    def do_DELETE(self):
+        bucket, key, query = self._parse()
+        if "uploadId" in query:
+            with self.uploads_lock:
+                self.uploads.pop(query["uploadId"][0], None)
+        elif key:
+            (self.server.root / bucket / key).unlink(missing_ok=True)
+        self.respond(HTTPStatus.NO_CONTENT)
+
+    def do_GET(self):
+        bucket, key, query = self._parse()
+        if key:
+            self.serve_file(self.server.root / bucket / key)
+        elif "location" in query:
+            self._xml(HTTPStatus.OK, "LocationConstraint", "")
+        elif self.command == "HEAD":
+            self.respond(HTTPStatus.OK)
+        else:
+            self._list(bucket, query.get("prefix", [""])[0])
+
+    do_HEAD = do_GET
+
+    def _list(self, bucket: str, prefix: str) -> None:
+        base = self.server.root / bucket
+        contents = []
+        for path in sorted(base.rglob("*")) if base.is_dir() else []:
+            key = path.relative_to(base).as_posix()
+            if (not path.is_file() or path.name.startswith(".incoming-")
+                    or not key.startswith(prefix)):
+                continue
+            info = path.stat()
+            modified = time.strftime("%Y-%m-%dT%H:%M:%S.000Z",
+                                     time.gmtime(info.st_mtime))
+            contents.append(f"<Contents><Key>{escape(key)}</Key>"
+                            f"<LastModified>{modified}</LastModified>"
+                            f"<Size>{info.st_size}</Size></Contents>")
+        self._xml(HTTPStatus.OK, "ListBucketResult",
+                  f"<Name>{escape(bucket)}</Name>"
+                  f"<Prefix>{escape(prefix)}</Prefix>"
+                  f"<KeyCount>{len(contents)}</KeyCount>"
+                  f"<IsTruncated>false</IsTruncated>" + "".join(contents))
+
+
+SSH_SHIM = '''#!{python}
+# Stand-in for ssh that runs the remote command locally under a root
+# directory, with injected latency and bandwidth limits on stdin.
+# Connections that do not go through a control master started by the
+# stand-in also pay the handshake delay.
+import os, random, subprocess, sys, time
+
+root = os.environ["STANDIN_SSH_ROOT"]
+latency = float(os.environ.get("STANDIN_SSH_LATENCY", 0))
+bandwidth = float(os.environ.get("STANDIN_SSH_BANDWIDTH", 0))
+if random.random() < float(os.environ.get("STANDIN_SSH_STALL_RATE", 0)):
+    latency += float(os.environ.get("STANDIN_SSH_STALL", 0))
+with_value = set("BbcDEeFIiJLlmOopQRSWw")
+args = sys.argv[1:]
+flags = set()
+options = {{}}
+i = 0
+while i < len(args) and args[i].startswith("-"):
+    flags.add(args[i][1])
+    if args[i] == "-o":
+        key, _, value = args[i + 1].partition("=")
+        options[key] = value
+    i += 2 if len(args[i]) == 2 and args[i][1] in with_value else 1
+command = " ".join(args[i + 1:])
+# Control masters are recorded as marker files named after their sockets.
+master = None
+if "ControlPath" in options:
+    master = os.path.join(os.environ["STANDIN_SSH_MASTERS"],
+                          os.path.basename(options["ControlPath"]))
+if "O" in flags:
+    sys.exit(0 if master and os.path.exists(master) else 255)
+if master is None or not os.path.exists(master):
+    time.sleep(float(os.environ.get("STANDIN_SSH_HANDSHAKE", 0)))
+if "M" in flags:
+    if master:
+        open(master, "w").close()
+    sys.exit(0)
+if not command:
+    sys.exit(0)
+time.sleep(latency)
+proc = subprocess.Popen(["sh", "-c", command], cwd=root,
+                        stdin=subprocess.PIPE)
+while chunk := sys.stdin.buffer.read(65536):
+    if bandwidth > 0:
+        time.sleep(len(chunk) / bandwidth)
+    proc.stdin.write(chunk)
+proc.stdin.close()
+sys.exit(proc.wait())
+'''
+
+
+class SshSink:
+    """Stand-in for an ssh destination, as used by ScpUploader.
+
+    Installs an ``ssh`` executable at the front of ``PATH`` that runs the
+    remote command locally with ``root`` as its working directory.
+
+    Parameters
+    ----------
+    root: `pathlib.Path`
+        Directory standing in for the remote home directory.
+    throttle: `Throttle`, optional
+        Limits to apply to each remote command.
+    handshake: `float`, optional
+        Delay in seconds added to connections not made through a control
+        master, standing in for the TCP and key-exchange round trips.
+    """
+
+    def __init__(self, root: Path, throttle: Throttle | None = None,
+                 handshake: float = 0.0):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.throttle = throttle or Throttle()
+        self.handshake = handshake
+        self.bin_dir = Path(tempfile.mkdtemp(prefix="standin-ssh-"))
+        (self.bin_dir / "masters").mkdir()
+        shim = self.bin_dir / "ssh"
+        shim.write_text(SSH_SHIM.format(python=sys.executable))
+        shim.chmod(shim.stat().st_mode | stat.S_IXUSR)
+
+    def start(self) -> SshSink:
+        """Put the shim on ``PATH`` for this process and its children."""
+        os.environ["PATH"] = f"{self.bin_dir}{os.pathsep}{os.environ['PATH']}"
+        os.environ["STANDIN_SSH_ROOT"] = str(self.root)
+        os.environ["STANDIN_SSH_MASTERS"] = str(self.bin_dir / "masters")
+        self.update()
+        return self
+
+    def update(self) -> None:
+        """Propagate the current throttle settings to the shim."""
+        os.environ["STANDIN_SSH_LATENCY"] = str(self.throttle.latency)
+        os.environ["STANDIN_SSH_BANDWIDTH"] = str(self.throttle.bandwidth)
+        os.environ["STANDIN_SSH_STALL"] = str(self.throttle.stall)
+        os.environ["STANDIN_SSH_STALL_RATE"] = str(self.throttle.stall_rate)
+        os.environ["STANDIN_SSH_HANDSHAKE"] = str(self.handshake)
+
+    def stop(self) -> None:
+        """Remove the shim and forget its control masters."""
+        path = os.environ["PATH"].split(os.pathsep)
+        if str(self.bin_dir) in path:
+            path.remove(str(self.bin_dir))
+            os.environ["PATH"] = os.pathsep.join(path)
+        shutil.rmtree(self.bin_dir, ignore_errors=True)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """Build an argument parser for command-line options."""
+
+    parser = argparse.ArgumentParser(
+        description="Run a local stand-in transfer destination."
+    )
+    parser.add_argument('kind', choices=("http", "s3"),
+                        help="protocol to serve")
+    parser.add_argument('-r', '--root', type=Path, required=True,
+                        help="directory in which to store objects")
+    parser.add_argument('-p', '--port', type=int, default=0,
+                        help="port to listen on")
+    parser.add_argument('-l', '--latency', type=float, default=0.0,
+                        help="latency in seconds added to each request")
+    parser.add_argument('-b', '--bandwidth', type=float, default=0.0,
+                        help="bandwidth limit in MB/s (0 for none)")
+    parser.add_argument('-s', '--stall', type=float, default=0.0,
+                        help="delay in seconds added to stalled requests")
+    parser.add_argument('--stall-rate', type=float, default=0.0,
+                        help="fraction of requests that stall")
+    return parser
+
+
+def main():
+    """Main program."""
+    args = build_parser().parse_args()
+    handler = PutHandler if args.kind == "http" else S3Handler
+    throttle = Throttle(args.latency, args.bandwidth * 1e6, args.stall,
+                        args.stall_rate)
+    server = StandInServer(handler, args.root, throttle, args.port)
+    print(f"Serving {args.kind} on {server.address}", flush=True)
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
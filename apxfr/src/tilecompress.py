@@ -0,0 +1,387 @@
+#!/usr/bin/env python
+
+"""In-process tiled FITS image compression.
+
+Produces files in the FITS tiled image compression convention, as written
+by fpack, without starting a subprocess or touching the disk.  Tiles are
+compressed in parallel by a thread pool (zlib and the Rice coder release the
+GIL) and each HDU is yielded as soon as all of its tiles are done, so that
+early HDUs can be sent while later ones are still being compressed.
+
+RICE_1 is used for 16- and 32-bit integer images when the Rice coder
+from astropy is available; GZIP_1 is used otherwise.
+"""
+
+from __future__ import annotations
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import math
+import os
+from pathlib import Path
+import struct
+import time
+from typing import Iterator
+import zlib
+
+
+BLOCK = 2880
+CARD = 80
+
+# Keywords describing the structure of an HDU, which are replaced when it
+# is rewritten as a compressed binary table.
+STRUCTURAL = {"SIMPLE", "XTENSION", "BITPIX", "EXTEND", "PCOUNT", "GCOUNT",
+              "END", "CHECKSUM", "DATASUM"}
+
+
+def _rice1():
+    """Return astropy's Rice codec class, or None if it is unavailable."""
+    try:
+        # Private module; present in astropy 6 and later.
+        from astropy.io.fits.hdu.compressed._codecs import Rice1
+        import numpy
+    except ImportError:
+        return None
+    return Rice1, numpy
+
+
+class Hdu:
+    """A header and data unit within a FITS file.
+
+    Parameters
+    ----------
+    cards: `list` [`str`]
+        Header cards, excluding END.
+    data: `memoryview`
+        Data section, excluding padding.
+    """
+
+    def __init__(self, cards: list[str], data: memoryview):
+        self.cards = cards
+        self.data = data
+        self.values = {}
+        for card in cards:
+            key = card[:8].strip()
+            if card[8:10] == "= " and key not in self.values:
+                self.values[key] = _parse_value(card[10:])
+
+    @property
+    def naxes(self) -> list[int]:
+        """Lengths of the image axes, fastest-varying first."""
+        return [self.values[f"NAXIS{i}"]
+                for i in range(1, self.values.get("NAXIS", 0) + 1)]
+
+    @property
+    def is_image(self) -> bool:
+        """True if the HDU holds a non-empty image."""
+        tension = self.values.get("XTENSION", "IMAGE")
+        return (tension == "IMAGE" and len(self.naxes) > 0
+                and self.data.nbytes > 0)
+
+    def header_bytes(self) -> bytes:
+        """Return the header, padded to a whole number of blocks."""
+        return _pad(("".join(c.ljust(CARD) for c in self.cards)
+                     + "END".ljust(CARD)).encode("ascii"), b" ")
+
+
+def _parse_value(text: str):
+    text = text.strip()
+    if text.startswith("'"):
+        end = 1
+        while True:
+            end = text.find("'", end)
+            if end < 0 or text[end:end + 2] != "''":
+                break
+            end += 2
+        return text[1:end].replace("''", "'").rstrip()
+    text = text.split("/", 1)[0].strip()
+    if text in ("T", "F"):
+        return text == "T"
+    try:
+        return int(text)
+    except ValueError:
+        try:
+            return float(text)
+        except ValueError:
+            return text
+
+
+def _card(key: str, value, comment: str = "") -> str:
+    if isinstance(value, bool):
+        text = f"{'T' if value else 'F':>20}"
+    elif isinstance(value, str):
+        text = f"'{value.replace(chr(39), chr(39) * 2):<8}'".ljust(20)
+    else:
+        text = f"{value:>20}"
+    card = f"{key:<8}= {text}"
+    if comment:
+        card += f" / {comment}"
+    return card[:CARD]
+
+
+def _pad(data: bytes, fill: bytes = b"\0") -> bytes:
+    return data + fill * (-len(data) % BLOCK)
+
+
+def read_hdus(data: memoryview) -> list[Hdu]:
+    """Split a FITS file into its HDUs.
+
+    Parameters
+    ----------
+    data: `memoryview`
+        Contents of a FITS file.
+
+    Returns
+    -------
+    hdus: `list` [`Hdu`]
+        The HDUs in file order.
+    """
+    data = memoryview(data).cast("B")
+    hdus = []
+    pos = 0
+    while pos + BLOCK <= len(data):
+        cards = []
+        while True:
+            block = bytes(data[pos:pos + BLOCK]).decode("ascii")
+            pos += BLOCK
+            for i in range(0, BLOCK, CARD):
+                card = block[i:i + CARD]
+                if card[:8].rstrip() == "END":
+                    break
+                cards.append(card.rstrip())
+            else:
+                continue
+            break
+        hdu = Hdu(cards, data[0:0])
+        values = hdu.values
+        naxes = hdu.naxes
+        size = 0
+        if naxes:
+            size = (abs(values["BITPIX"]) // 8 * values.get("GCOUNT", 1)
+                    * (values.get("PCOUNT", 0) + math.prod(naxes)))
+        hdu.data = data[pos:pos + size]
+        hdus.append(hdu)
+        pos += size + (-size % BLOCK)
+    return hdus
+
+
+class TileCompressor:
+    """Compress FITS images tile by tile in parallel.
+
+    Parameters
+    ----------
+    workers: `int`, optional
+        Number of compression threads; defaults to the number of CPUs.
+    tile_rows: `int`, optional
+        Number of image rows per tile.  fpack uses one row per tile.
+    batch: `int`, optional
+        Number of tiles compressed together by one thread task.
+    algorithm: `str`, optional
+        ``RICE_1``, ``GZIP_1`` or ``auto`` to choose RICE_1 for integer
+        images when possible.
+    level: `int`, optional
+        zlib compression level for GZIP_1.
+    """
+
+    def __init__(self, workers: int | None = None, tile_rows: int = 1,
+                 batch: int = 64, algorithm: str = "auto", level: int = 1):
+        self.pool = ThreadPoolExecutor(max_workers=workers or os.cpu_count(),
+                                       thread_name_prefix="tile")
+        self.tile_rows = tile_rows
+        self.batch = batch
+        self.algorithm = algorithm
+        self.level = level
+        self._rice = _rice1() if algorithm in ("auto", "RICE_1") else None
+        if algorithm == "RICE_1" and self._rice is None:
+            raise RuntimeError("RICE_1 requires astropy and numpy")
+
+    def close(self) -> None:
+        """Shut down the compression threads."""
+        self.pool.shutdown()
+
+    def choose(self, bitpix: int) -> str:
+        """Return the compression algorithm to use for a BITPIX."""
+        if self.algorithm == "GZIP_1":
+            return "GZIP_1"
+        if bitpix in (16, 32) and self._rice is not None:
+            return "RICE_1"
+        return "GZIP_1"
+
+    def iter_compress(self, data: memoryview) -> Iterator[bytes]:
+        """Compress a FITS file, yielding each output HDU when it is ready.
+
+        All tiles are queued for compression before this returns, so
+        compression continues in the background while earlier HDUs are
+        being consumed.
+
+        Parameters
+        ----------
+        data: `memoryview`
+            Contents of an uncompressed FITS file.
+
+        Returns
+        -------
+        chunks: iterator of `bytes`
+            Consecutive pieces of the compressed FITS file.
+        """
+        hdus = read_hdus(data)
+        pending = []
+        for i, hdu in enumerate(hdus):
+            if not hdu.is_image:
+                pending.append(hdu.header_bytes() + _pad(bytes(hdu.data)))
+                continue
+            if i == 0:
+                # The primary HDU cannot be a table, so the image moves to
+                # an extension behind an empty primary HDU.
+                primary = Hdu([_card("SIMPLE", True), _card("BITPIX", 8),
+                               _card("NAXIS", 0), _card("EXTEND", True)],
+                              memoryview(b""))
+                pending.append(primary.header_bytes())
+            pending.append(self._submit(hdu, primary=(i == 0)))
+        return self._drain(pending)
+
+    def compress(self, data: memoryview) -> bytes:
+        """Compress a FITS file.
+
+        Parameters
+        ----------
+        data: `memoryview`
+            Contents of an uncompressed FITS file.
+
+        Returns
+        -------
+        compressed: `bytes`
+            Contents of the compressed FITS file.
+        """
+        return b"".join(self.iter_compress(data))
+
+    def _drain(self, pending: list) -> Iterator[bytes]:
+        for item in pending:
+            yield item if isinstance(item, bytes) else item()
+
+    def _submit(self, hdu: Hdu, primary: bool):
+        bitpix = hdu.values["BITPIX"]
+        bytepix = abs(bitpix) // 8
+        naxes = hdu.naxes
+        width = naxes[0]
+        rows = math.prod(naxes[1:]) if len(naxes) > 1 else 1
+        height = naxes[1] if len(naxes) > 1 else 1
+        tile_rows = min(self.tile_rows, height)
+        algorithm = self.choose(bitpix)
+        row_bytes = width * bytepix
+
+        # Tiles never span planes of a cube.
+        bounds = []
+        for plane in range(rows // height):
+            for row in range(0, height, tile_rows):
+                first = (plane * height + row) * row_bytes
+                count = min(tile_rows, height - row)
+                bounds.append((first, first + count * row_bytes))
+        futures = [
+            self.pool.submit(self._compress_tiles, hdu.data,
+                             bounds[i:i + self.batch], algorithm, bitpix)
+            for i in range(0, len(bounds), self.batch)
+        ]
+
+        def finish() -> bytes:
+            tiles = [tile for f in futures for tile in f.result()]
+            return self._table(hdu, primary, algorithm, tile_rows, tiles)
+
+        return finish
+
+    def _compress_tiles(self, data: memoryview, bounds: list, algorithm: str,
+                        bitpix: int) -> list[bytes]:
+        bytepix = abs(bitpix) // 8
+        if algorithm == "RICE_1":
+            rice, numpy = self._rice
+            dtype = {2: ">i2", 4: ">i4"}[bytepix]
+            return [
+                rice(blocksize=32, bytepix=bytepix,
+                     tilesize=(last - first) // bytepix).encode(
+                    numpy.frombuffer(data[first:last], dtype=dtype))
+                for first, last in bounds
+            ]
+        tiles = []
+        for first, last in bounds:
+            z = zlib.compressobj(self.level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            tiles.append(z.compress(data[first:last]) + z.flush())
+        return tiles
+
+    def _table(self, hdu: Hdu, primary: bool, algorithm: str, tile_rows: int,
+               tiles: list[bytes]) -> bytes:
+        values = hdu.values
+        naxes = hdu.naxes
+        descriptors = bytearray()
+        offset = 0
+        for tile in tiles:
+            descriptors += struct.pack(">ii", len(tile), offset)
+            offset += len(tile)
+        cards = [
+            _card("XTENSION", "BINTABLE", "binary table extension"),
+            _card("BITPIX", 8),
+            _card("NAXIS", 2),
+            _card("NAXIS1", 8, "width of table in bytes"),
+            _card("NAXIS2", len(tiles), "number of tiles"),
+            _card("PCOUNT", offset, "size of heap"),
+            _card("GCOUNT", 1),
+            _card("TFIELDS", 1),
+            _card("TTYPE1", "COMPRESSED_DATA"),
+            _card("TFORM1", f"1PB({max(map(len, tiles), default=0)})"),
+            _card("ZIMAGE", True, "extension contains compressed image"),
+            _card("ZBITPIX", values["BITPIX"]),
+            _card("ZNAXIS", len(naxes)),
+        ]
+        cards += [_card(f"ZNAXIS{i}", n) for i, n in enumerate(naxes, 1)]
+        tile_shape = [naxes[0], tile_rows] + [1] * (len(naxes) - 2)
+        cards += [_card(f"ZTILE{i}", n)
+                  for i, n in enumerate(tile_shape[:len(naxes)], 1)]
+        cards.append(_card("ZCMPTYPE", algorithm))
+        if algorithm == "RICE_1":
+            cards += [_card("ZNAME1", "BLOCKSIZE"), _card("ZVAL1", 32),
+                      _card("ZNAME2", "BYTEPIX"),
+                      _card("ZVAL2", abs(values["BITPIX"]) // 8)]
+        if primary:
+            cards.append(_card("ZSIMPLE", True))
+        else:
+            cards += [_card("ZTENSION", "IMAGE"),
+                      _card("ZPCOUNT", values.get("PCOUNT", 0)),
+                      _card("ZGCOUNT", values.get("GCOUNT", 1))]
+        for card in hdu.cards:
+            key = card[:8].strip()
+            if key in STRUCTURAL or key.startswith("NAXIS"):
+                continue
+            cards.append(card)
+        header = Hdu(cards, memoryview(b"")).header_bytes()
+        return header + _pad(bytes(descriptors) + b"".join(tiles))
+
+
+def main():
+    """Compress FITS files and report ratio and timing."""
+    parser = argparse.ArgumentParser(
+        description="Compress FITS files with in-process tile compression."
+    )
+    parser.add_argument('files', type=Path, nargs='+',
+                        help="FITS files; output is written to FILE.fz")
+    parser.add_argument('-w', '--workers', type=int,
+                        help="number of compression threads")
+    parser.add_argument('-a', '--algorithm', default="auto",
+                        choices=("auto", "RICE_1", "GZIP_1"),
+                        help="compression algorithm")
+    args = parser.parse_args()
+    logging.basicConfig(level="INFO", format="{message}", style="{")
+
+    compressor = TileCompressor(workers=args.workers, algorithm=args.algorithm)
+    for path in args.files:
+        data = path.read_bytes()
+        start = time.monotonic()
+        compressed = compressor.compress(memoryview(data))
+        delta = time.monotonic() - start
+        Path(f"{path}.fz").write_bytes(compressed)
+        logging.info(f"{path}: {len(data)} -> {len(compressed)} bytes"
+                     f" (ratio {len(data) / len(compressed):.2f})"
+                     f" in {delta} seconds")
+    compressor.close()
+
+
+if __name__ == "__main__":
+    main()
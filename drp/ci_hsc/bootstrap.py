@@ -0,0 +1,314 @@
+#!/usr/bin/env python
+
+import argparse
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import hashlib
+import json
+import os
+import re
+import shlex
+import subprocess
+import sys
+import threading
+import time
+
+# HSC raw files are named HSCA<frame><detector % 100>, and the frame IDs of
+# a visit are its even exposure ID and, for detectors 100-111, the next odd
+# one; the files of one visit are ingested together, so that its records are
+# inserted once.
+EXPOSURE = re.compile(r"HSCA(\d{6})\d{2}")
+
+RAW_SUFFIXES = (".fits", ".fits.gz", ".fits.fz")
+
+
+def findRaws(directory):
+    """Return the raw files under directory, sorted"""
+    raws = []
+    for root, dirs, filenames in os.walk(directory):
+        for filename in filenames:
+            if filename.endswith(RAW_SUFFIXES):
+                raws.append(os.path.join(root, filename))
+    return sorted(raws)
+
+
+def shardRaws(raws, batch):
+    """Split raw files into shards of about batch files
+
+    Files of the same visit, or failing that the same directory, stay in
+    one shard, so that no two shards insert the same exposure.
+    """
+    groups = {}
+    for path in raws:
+        m = EXPOSURE.search(os.path.basename(path))
+        key = "%06d" % (int(m.group(1)) & ~1) if m else os.path.dirname(path)
+        groups.setdefault(key, []).append(path)
+    shards = []
+    current = []
+    for key in sorted(groups):
+        if current and len(current) + len(groups[key]) > batch:
+            shards.append(current)
+            current = []
+        current.extend(groups[key])
+    if current:
+        shards.append(current)
+    return shards
+
+
+def shardId(paths):
+    """Return a name for a shard that is stable across runs"""
+    return hashlib.sha1("\n".join(paths).encode()).hexdigest()[:12]
+
+
+def planSteps(args):
+    """Return the bootstrap steps, with their dependencies and commands
+
+    Each step is a dict with a name, the names of the steps it must follow
+    and a list of (unit, command) pairs that may run concurrently; units
+    are what is recorded as done for resuming.  Ingest also has the number
+    of files in each unit.
+    """
+    butler = shlex.split(args.butlerCmd)
+    repo = args.repo
+
+    raws = findRaws(args.raws)
+    shards = shardRaws(raws, args.batch)
+    ingest = [("ingest-raws/%s" % shardId(shard),
+               butler + ["ingest-raws", repo] + shard
+               + shlex.split(args.ingestArgs))
+              for shard in shards]
+    steps = [
+        dict(name="register-instrument", after=[],
+             commands=[("register-instrument",
+                        butler + ["register-instrument", repo,
+                                  args.instrument])]),
+        dict(name="write-curated-calibrations",
+             after=["register-instrument"],
+             commands=[("write-curated-calibrations",
+                        butler + ["write-curated-calibrations", repo,
+                                  args.instrumentName])]),
+        dict(name="register-skymap", after=[],
+             commands=[("register-skymap",
+                        butler + ["register-skymap", repo,
+                                  "-C", args.skymapConfig])]),
+        dict(name="ingest-raws", after=["register-instrument"],
+             commands=ingest,
+             files=dict((unit, len(shard))
+                        for (unit, _), shard in zip(ingest, shards))),
+        dict(name="define-visits", after=["ingest-raws"],
+             commands=[("define-visits",
+                        butler + ["define-visits", repo, args.instrumentName,
+                                  "--collections", args.rawCollection])]),
+        # The external datasets (refcats, bright-object masks) refer to the
+        # instrument and skymap dimensions.
+        dict(name="import", after=["register-instrument", "register-skymap"],
+             commands=[("import",
+                        butler + ["import", repo, args.importDir,
+                                  "--export-file", args.exportFile])]),
+    ]
+    return steps
+
+
+class State:
+    """Record of the finished units of a bootstrap, kept in a JSON file
+
+    The record is keyed by repository URI only, so it must be discarded
+    with --restart when the repository is recreated at the same URI.
+    """
+
+    def __init__(self, path, repo):
+        self.path = path
+        self.lock = threading.Lock()
+        self.done = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                saved = json.load(f)
+            if saved.get("repo") == repo:
+                self.done = saved["done"]
+        self.repo = repo
+
+    def isDone(self, unit):
+        return unit in self.done
+
+    def record(self, unit, start, elapsed):
+        with self.lock:
+            self.done[unit] = dict(start=start, elapsed=elapsed)
+            with open(self.path + ".tmp", "w") as f:
+                json.dump(dict(repo=self.repo, done=self.done), f, indent=1)
+            os.replace(self.path + ".tmp", self.path)
+
+
+def runUnit(unit, command, logDir, dryRun=False):
+    """Run one command, logging its output; return its start and duration"""
+    start = time.time()
+    if dryRun:
+        print(" ".join(shlex.quote(c) for c in command))
+        return start, 0.0
+    logPath = os.path.join(logDir, unit.replace("/", ".") + ".log")
+    with open(logPath, "w") as log:
+        result = subprocess.run(command, stdout=log, stderr=subprocess.STDOUT)
+    if result.returncode != 0:
+        raise RuntimeError("%s failed with status %d; see %s"
+                           % (unit, result.returncode, logPath))
+    return start, time.time() - start
+
+
+def runStep(step, state, pool, logDir, dryRun=False):
+    """Run the units of a step that are not done yet, concurrently
+
+    Returns the units run and the number skipped as already done.
+    """
+    todo = [(unit, command) for unit, command in step["commands"]
+            if not state.isDone(unit)]
+    if len(todo) == 1:
+        # Run it here rather than queue it behind the shards of another
+        # step.
+        unit, command = todo[0]
+        futures = [None]
+    else:
+        futures = [pool.submit(runUnit, unit, command, logDir, dryRun)
+                   for unit, command in todo]
+    errors = []
+    for (unit, command), future in zip(todo, futures):
+        try:
+            if future is None:
+                start, elapsed = runUnit(unit, command, logDir, dryRun)
+            else:
+                start, elapsed = future.result()
+        except Exception as e:
+            errors.append(str(e))
+            continue
+        if not dryRun:
+            state.record(unit, start, elapsed)
+    if errors:
+        raise RuntimeError("; ".join(errors))
+    return [unit for unit, _ in todo], len(step["commands"]) - len(todo)
+
+
+def bootstrap(steps, state, jobs, ingestJobs, logDir, dryRun=False):
+    """Run the steps in dependency order, independent ones concurrently
+
+    Returns a dict of timings by step name; raises RuntimeError once the
+    running steps have finished if any failed.
+    """
+    timings = {}
+    started = set()
+    finished = set()
+    failures = []
+    byName = dict((step["name"], step) for step in steps)
+    origin = time.time()
+    # Steps, and the units of a step, run in separate pools so that a
+    # step waiting for its units never holds up their execution.
+    with ThreadPoolExecutor(max_workers=jobs) as stepPool, \
+            ThreadPoolExecutor(max_workers=ingestJobs) as unitPool:
+        running = {}
+        while True:
+            if not failures:
+                for step in steps:
+                    if step["name"] not in started and \
+                            all(a in finished for a in step["after"]):
+                        started.add(step["name"])
+                        start = time.time()
+                        future = stepPool.submit(runStep, step, state,
+                                                 unitPool, logDir, dryRun)
+                        running[future] = (step["name"], start)
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name, start = running.pop(future)
+                try:
+                    ran, skipped = future.result()
+                except Exception as e:
+                    failures.append("%s: %s" % (name, e))
+                    print("Step %s failed: %s" % (name, e), file=sys.stderr)
+                    continue
+                finished.add(name)
+                files = byName[name].get("files")
+                timings[name] = dict(
+                    start=start - origin, elapsed=time.time() - start,
+                    ran=len(ran), skipped=skipped,
+                    files=sum(files[u] for u in ran) if files else None)
+                print("Step %s finished in %.1f s (%d run, %d already done)"
+                      % (name, timings[name]["elapsed"], len(ran), skipped),
+                      flush=True)
+    if failures:
+        raise RuntimeError("%d steps failed" % len(failures))
+    return timings
+
+
+def printTimings(timings, elapsed):
+    """Print the per-step timings of a bootstrap"""
+    print("%-28s %8s %8s %6s %8s" % ("step", "start", "secs", "units",
+                                      "files/s"))
+    for name, t in sorted(timings.items(), key=lambda item: item[1]["start"]):
+        rate = ("%8.1f" % (t["files"] / t["elapsed"])
+                if t["files"] and t["ran"] and t["elapsed"] else "%8s" % "-")
+        print("%-28s %8.1f %8.1f %6d %s" % (name, t["start"], t["elapsed"],
+                                            t["ran"] + t["skipped"], rate))
+    serial = sum(t["elapsed"] for t in timings.values())
+    print("Bootstrap took %.1f s; the steps took %.1f s in total"
+          % (elapsed, serial))
+
+
+if __name__ == "__main__":
+    ciHsc = os.environ.get("CI_HSC_GEN3_DIR", ".")
+    testdata = os.environ.get("TESTDATA_CI_HSC_DIR", ".")
+    parser = argparse.ArgumentParser(
+        description="Set up a Butler repository with independent steps run"
+        " concurrently and raw ingest sharded")
+    parser.add_argument("repo", help="repository URI, e.g. s3://BUCKET")
+    parser.add_argument("--butler-cmd", dest="butlerCmd", default="butler",
+                        help="command to run butler subcommands with")
+    parser.add_argument("-j", "--jobs", type=int, default=4,
+                        help="number of steps to run at once")
+    parser.add_argument("--ingest-jobs", dest="ingestJobs", type=int,
+                        default=8, help="number of ingest shards to run at"
+                        " once; keep this low with a SQLite registry")
+    parser.add_argument("--batch", type=int, default=200,
+                        help="raw files per ingest shard")
+    parser.add_argument("--ingest-args", dest="ingestArgs", default="",
+                        help="extra arguments for ingest-raws, e.g."
+                        " '--transfer direct'")
+    parser.add_argument("--raws", default=os.path.join(testdata, "raw"),
+                        help="directory of raw files")
+    parser.add_argument("--instrument",
+                        default="lsst.obs.subaru.HyperSuprimeCam",
+                        help="instrument class")
+    parser.add_argument("--instrument-name", dest="instrumentName",
+                        default="HSC", help="instrument name")
+    parser.add_argument("--raw-collection", dest="rawCollection",
+                        default="HSC/raw/all",
+                        help="collection of the ingested raws")
+    parser.add_argument("--skymap-config", dest="skymapConfig",
+                        default=os.path.join(ciHsc, "configs", "skymap.py"),
+                        help="skymap configuration")
+    parser.add_argument("--import-dir", dest="importDir", default=testdata,
+                        help="directory of the datasets to import")
+    parser.add_argument("--export-file", dest="exportFile",
+                        default=os.path.join(ciHsc, "resources",
+                                             "external.yaml"),
+                        help="export file of the datasets to import")
+    parser.add_argument("--state", default="bootstrap-state.json",
+                        help="record of finished steps, for resuming")
+    parser.add_argument("--logs", default="bootstrap-logs",
+                        help="directory for the output of each command")
+    parser.add_argument("--restart", action="store_true",
+                        help="ignore the record of finished steps, e.g."
+                        " after recreating the repository")
+    parser.add_argument("--dry-run", dest="dryRun", action="store_true",
+                        help="print the commands instead of running them")
+    args = parser.parse_args()
+
+    if args.restart and os.path.exists(args.state):
+        os.unlink(args.state)
+    state = State(args.state, args.repo)
+    os.makedirs(args.logs, exist_ok=True)
+    steps = planSteps(args)
+    start = time.time()
+    try:
+        timings = bootstrap(steps, state, args.jobs, args.ingestJobs,
+                            args.logs, args.dryRun)
+    except RuntimeError as e:
+        print("Bootstrap stopped: %s; rerun to resume" % e, file=sys.stderr)
+        sys.exit(1)
+    printTimings(timings, time.time() - start)
@@ -14,6 +14,8 @@ psql postgresql://$USERNAME@$DB -c "CREATE EXTENSION btree_gist;"
 
 export DIR=`dirname "${BASH_SOURCE[0]}"`
 python $DIR/create_repo.py $BUCKET $USERNAME $DB
-source $DIR/setup_repo.sh $BUCKET
+# create_repo.py has just made a new, empty repo, so steps recorded by an
+# earlier run are not done in it; rerun bootstrap.py alone to resume.
+python $DIR/bootstrap.py s3://$BUCKET --restart --state $DIR/bootstrap-state.json --logs $DIR/bootstrap-logs
 source $DIR/make_workflow.sh  s3://$BUCKET s3://$BUCKET/_workflows $DIR/../pegasus/
 python $DIR/upload.py $BUCKET-wf $DIR
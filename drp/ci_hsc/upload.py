@@ -1,20 +1,185 @@
 #!/usr/bin/env python
 
-import boto3, os, sys
+import argparse
+import base64
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import hashlib
+import json
+import os
+import sys
+import time
 
-endpoint = os.environ.get("S3_ENDPOINT_URL", 'https://storage.googleapis.com')
-s3client = boto3.client("s3", endpoint_url=endpoint)
+import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
 
-bucketName = sys.argv[1]
-thisDir = sys.argv[2]
+# Files larger than this are uploaded in parts by upload_file; smaller ones
+# with a single PUT
+MULTIPART_SIZE = 64 * 1024 * 1024
 
-s3client.create_bucket(Bucket=bucketName)
 
-for folder in (thisDir+"/../pegasus/",):
-    for root, dirs, files in os.walk(folder):
-        for filename in files:
+def listFiles(folder):
+    """Return (key, path) pairs for the workflow files under folder"""
+    files = []
+    for root, dirs, filenames in os.walk(folder):
+        for filename in filenames:
             fullpath = os.path.join(root, filename)
             # Put all qgraph files to the "input" subfolder
             key = "input/" + filename if fullpath.endswith("qgraph") else filename
-            print(f"Upload {key} from {fullpath}")
-            s3client.upload_file(Bucket=bucketName, Key=key, Filename=fullpath)
+            files.append((key, fullpath))
+    return files
+
+
+def loadManifest(path, endpoint, bucket):
+    """Return the files already uploaded to a bucket, by key"""
+    try:
+        with open(path) as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return {}
+    if manifest.get("endpoint") != endpoint or manifest.get("bucket") != bucket:
+        return {}
+    return manifest["files"]
+
+
+def saveManifest(path, endpoint, bucket, files):
+    """Write the manifest of uploaded files, replacing the old one whole"""
+    with open(path + ".tmp", "w") as f:
+        json.dump(dict(endpoint=endpoint, bucket=bucket, files=files), f)
+    os.replace(path + ".tmp", path)
+
+
+def fileMd5(path):
+    """Return the MD5 digest of a file"""
+    md5 = hashlib.md5()
+    with open(path, "rb") as f:
+        while chunk := f.read(1024 * 1024):
+            md5.update(chunk)
+    return md5.digest()
+
+
+def unchanged(path, entry):
+    """Return the manifest entry for a file, or None if it has changed
+
+    Files whose size and modification time match the manifest are not
+    read; others are compared by MD5, so that a file that was rewritten
+    with the same contents is not uploaded again.
+    """
+    info = os.stat(path)
+    if entry is None or entry["size"] != info.st_size:
+        return None
+    if entry["mtime"] == info.st_mtime_ns:
+        return entry
+    if fileMd5(path).hex() != entry["md5"]:
+        return None
+    return dict(entry, mtime=info.st_mtime_ns)
+
+
+def uploadOne(s3client, bucket, key, path):
+    """Upload one file and return its manifest entry"""
+    info = os.stat(path)
+    if info.st_size > MULTIPART_SIZE:
+        md5 = fileMd5(path)
+        s3client.upload_file(Bucket=bucket, Key=key, Filename=path)
+    else:
+        with open(path, "rb") as f:
+            body = f.read()
+        md5 = hashlib.md5(body).digest()
+        # The store checks the body against the digest.
+        s3client.put_object(Bucket=bucket, Key=key, Body=body,
+                            ContentMD5=base64.b64encode(md5).decode())
+    return dict(size=info.st_size, mtime=info.st_mtime_ns, md5=md5.hex())
+
+
+def createBucket(s3client, bucket):
+    """Create the bucket, unless this account already has it"""
+    try:
+        s3client.create_bucket(Bucket=bucket)
+    except ClientError as e:
+        code = e.response["Error"]["Code"]
+        if code not in ("BucketAlreadyOwnedByYou", "BucketAlreadyExists",
+                        "Conflict"):
+            raise
+        # BucketAlreadyExists is also what a bucket of another account
+        # gives; the uploads will fail if it is not ours.
+        print(f"Bucket {bucket} already exists")
+
+
+def upload(s3client, bucket, files, manifest, workers, verbose=False):
+    """Upload the files that are not in the manifest, concurrently
+
+    Returns the number of files uploaded, the bytes uploaded, the number
+    skipped and the number that failed; manifest is updated in place.
+    """
+    todo = []
+    skipped = 0
+    for key, path in files:
+        entry = unchanged(path, manifest.get(key))
+        if entry is None:
+            todo.append((key, path))
+        else:
+            manifest[key] = entry
+            skipped += 1
+    uploaded = nbytes = failed = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = dict((pool.submit(uploadOne, s3client, bucket, key, path),
+                        (key, path)) for key, path in todo)
+        for future in as_completed(futures):
+            key, path = futures[future]
+            try:
+                manifest[key] = future.result()
+            except Exception as e:
+                print(f"Failed to upload {key} from {path}: {e}",
+                      file=sys.stderr)
+                failed += 1
+                continue
+            uploaded += 1
+            nbytes += manifest[key]["size"]
+            if verbose:
+                print(f"Upload {key} from {path}")
+    return uploaded, nbytes, skipped, failed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Upload the workflow files to a bucket")
+    parser.add_argument("bucketName", help="bucket to upload to")
+    parser.add_argument("thisDir", help="directory of this script")
+    parser.add_argument("-w", "--workers", type=int, default=32,
+                        help="number of concurrent uploads")
+    parser.add_argument("--manifest",
+                        help="record of uploaded files, to skip unchanged"
+                        " ones on reruns; default .upload-BUCKET.json in"
+                        " thisDir")
+    parser.add_argument("--force", action="store_true",
+                        help="upload every file, ignoring the manifest")
+    parser.add_argument("-v", "--verbose", action="store_true",
+                        help="print each file uploaded")
+    args = parser.parse_args()
+
+    endpoint = os.environ.get("S3_ENDPOINT_URL", 'https://storage.googleapis.com')
+    # One client, and so one connection pool, shared by all the workers
+    s3client = boto3.client("s3", endpoint_url=endpoint, config=Config(
+        max_pool_connections=args.workers, retries=dict(max_attempts=5)))
+    manifestPath = args.manifest or os.path.join(
+        args.thisDir, ".upload-%s.json" % args.bucketName)
+    manifest = {} if args.force else loadManifest(manifestPath, endpoint,
+                                                  args.bucketName)
+
+    createBucket(s3client, args.bucketName)
+    files = listFiles(args.thisDir + "/../pegasus/")
+    start = time.time()
+    try:
+        uploaded, nbytes, skipped, failed = upload(
+            s3client, args.bucketName, files, manifest, args.workers,
+            args.verbose)
+    finally:
+        # Keep what was uploaded even if interrupted
+        saveManifest(manifestPath, endpoint, args.bucketName, manifest)
+    elapsed = max(time.time() - start, 1e-3)
+    print("Uploaded %d files, %.1f MB in %.1f s: %.1f files/s, %.2f MB/s;"
+          " %d unchanged, %d failed"
+          % (uploaded, nbytes / 1e6, elapsed, uploaded / elapsed,
+             nbytes / 1e6 / elapsed, skipped, failed))
+    if failed:
+        sys.exit(1)
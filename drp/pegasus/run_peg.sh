@@ -11,6 +11,7 @@ pegasus-plan \
         --dax wfx.dax \
         --dir submit \
         --cleanup none \
+        --cluster label \
         --sites gcp \
         --input-dir input \
         --output-dir output 2>&1 \
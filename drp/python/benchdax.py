@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+
+import argparse
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import pegasusize
+
+# Tasks of a synthetic pipeline, with the number of quanta of each per
+# unit of the graph and how many quanta of the previous task each one
+# depends on (roughly single-frame processing, warps and coadds).
+STAGES = [("IsrTask", 100, 0), ("CharacterizeImageTask", 100, 1),
+          ("CalibrateTask", 100, 1), ("MakeWarpTask", 40, 3),
+          ("CompareWarpAssembleCoaddTask", 5, 8),
+          ("DeblendCoaddSourcesSingleTask", 5, 1),
+          ("MeasureMergedCoaddSourcesTask", 5, 1)]
+
+
+def writeListing(f, nQuanta, seed=0):
+    """Write a synthetic "pipetask qgraph --show workflow" listing"""
+    rng = random.Random(seed)
+    iq = 0
+    while iq < nQuanta:
+        previous = []
+        for taskname, n, nParents in STAGES:
+            current = []
+            for _ in range(n):
+                f.write("Quantum %d: %s\n" % (iq, taskname))
+                for parent in rng.sample(previous, min(nParents,
+                                                       len(previous))):
+                    f.write("Parent Quantum %d - Child Quantum %d\n"
+                            % (parent, iq))
+                current.append(iq)
+                iq += 1
+            previous = current
+
+
+def runOne(listing, progress):
+    """Time DAX generation for one listing and print the results"""
+    with open(listing) as f, open(os.devnull, "w") as out:
+        start = time.time()
+        dax = pegasusize.generateDax(f, out, "bench",
+                                     initPickle="bench.qgraph",
+                                     progress=progress)
+        elapsed = time.time() - start
+    # ru_maxrss is in kB on Linux.
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print("%9d %9d %8.2f %10.0f %8.1f"
+          % (dax.jobs, dax.dependencies, elapsed, dax.jobs / elapsed, rss))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark DAX generation on synthetic workflows")
+    parser.add_argument("-n", "--quanta", default="10000,100000,300000",
+                        help="comma-separated numbers of quanta")
+    parser.add_argument("--progress", type=int, default=0, metavar="N",
+                        help="report progress every N quanta on stderr")
+    parser.add_argument("--one", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.one:
+        runOne(args.one, args.progress)
+        sys.exit(0)
+
+    print("%9s %9s %8s %10s %8s" % ("jobs", "deps", "secs", "jobs/s",
+                                    "RSS MB"))
+    with tempfile.TemporaryDirectory() as work:
+        for n in [int(x) for x in args.quanta.split(",")]:
+            listing = os.path.join(work, "wf_%d" % n)
+            with open(listing, "w") as f:
+                writeListing(f, n)
+            # Each size runs in a fresh process so that its peak memory use
+            # is measured separately.
+            subprocess.run([sys.executable, __file__, "--one", listing,
+                            "--progress", str(args.progress)], check=True)
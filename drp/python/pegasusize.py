@@ -1,75 +1,456 @@
 #!/usr/bin/env python
 
 import argparse
-import os
+import heapq
+import json
 import re
-import Pegasus.DAX3 as peg
+import sys
+import tempfile
+import time
+import zlib
+from xml.sax.saxutils import escape, quoteattr
 
-def generateDax(f, name="dax", noInitJob=False, initPickle=None):
-    """Generate a Pegasus DAX abstract workflow"""
-    dax = peg.ADAG(name)
+DAX_HEADER = """<?xml version="1.0" encoding="UTF-8"?>
+<!-- generated by pegasusize.py -->
+<adag xmlns="http://pegasus.isi.edu/schema/DAX" \
+xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" \
+xsi:schemaLocation="http://pegasus.isi.edu/schema/DAX \
+http://pegasus.isi.edu/schema/dax-3.6.xsd" version="3.6" name=%s>
+"""
+
+INIT_ID = "init"
+
+TASK_NAME = re.compile(r"\s*(\w+)")
+
+# Requests for tasks without a resource profile, in MB
+demandingTasks = set(['MakeWarpTask', 'CompareWarpAssembleCoaddTask',
+                      'DeblendCoaddSourcesSingleTask',
+                      'MeasureMergedCoaddSourcesTask'])
+DEFAULT_MEMORY = 2 * 1024
+DEMANDING_MEMORY = 28 * 1024
+
+# Quanta needing more memory than this, in MB, are not clustered
+LARGE_MEMORY = 8 * 1024
+
+# Dependencies sorted at once by DaxWriter.close(); more are split into
+# buckets of about this many first
+SORT_EDGES = 1000000
+
+
+def loadProfiles(path):
+    """Return the resource models by task name from a profiles.py file"""
+    with open(path) as f:
+        return json.load(f)["tasks"]
+
+
+def memoryRequest(taskname, profiles=None):
+    """Return the memory request for a task in MB"""
+    if profiles and taskname in profiles:
+        return profiles[taskname]["memory"]
+    if taskname in demandingTasks:
+        return DEMANDING_MEMORY
+    return DEFAULT_MEMORY
+
+
+def memoryClass(taskname, profiles=None):
+    """Return the memory request for a task as a Condor quantity"""
+    memory = memoryRequest(taskname, profiles)
+    if memory % 1024 == 0:
+        return "%dGB" % (memory // 1024)
+    return "%dMB" % memory
+
+
+def cpuRequest(taskname, profiles=None):
+    """Return the number of CPUs to request for a task"""
+    if profiles and taskname in profiles:
+        return profiles[taskname]["cpus"]
+    return 1
+
+
+def readListing(f):
+    """Parse a "pipetask qgraph --show workflow" listing
+
+    Yields ("quantum", iq, taskname) and ("depends", parent, child) tuples.
+    """
+    for line in f:
+        if line.startswith("Quantum "):
+            number, _, rest = line[len("Quantum "):].partition(":")
+            yield "quantum", int(number), TASK_NAME.match(rest).group(1)
+        elif line.startswith("Parent Quantum "):
+            # Parent Quantum <parent> - Child Quantum <child>
+            words = line.split()
+            yield "depends", int(words[2]), int(words[6])
+
+
+def readWorkflow(f):
+    """Read a workflow listing into memory
+
+    Returns dicts of task names and of lists of parents, by quantum.
+    """
+    tasks = {}
+    parents = {}
+    for kind, a, b in readListing(f):
+        if kind == "quantum":
+            tasks[a] = b
+        else:
+            parents.setdefault(b, []).append(a)
+    return tasks, parents
+
+
+def topologicalOrder(nodes, parents):
+    """Return nodes ordered so that parents come before their children"""
+    children = {}
+    waiting = {}
+    for child, ps in parents.items():
+        waiting[child] = len(ps)
+        for parent in ps:
+            children.setdefault(parent, []).append(child)
+    order = [node for node in nodes if not waiting.get(node)]
+    for node in order:
+        for child in children.get(node, ()):
+            waiting[child] -= 1
+            if waiting[child] == 0:
+                order.append(child)
+    if len(order) != len(nodes):
+        raise RuntimeError("Workflow has a cycle")
+    return order
+
+
+def depths(order, parents):
+    """Return the length of the longest path to each node from a root"""
+    depth = {}
+    for node in order:
+        depth[node] = max((depth[p] + 1 for p in parents.get(node, ())),
+                          default=0)
+    return depth
+
+
+def transitiveReduction(parents, depth):
+    """Return the set of redundant (parent, child) edges
+
+    An edge is redundant if the child can also be reached from the parent
+    through another of its parents.  Only ancestors no shallower than the
+    shallowest parent can be on such a path, which keeps the search short
+    in the wide, shallow graphs of pipelines.
+    """
+    redundant = set()
+    for child, ps in parents.items():
+        if len(ps) < 2:
+            continue
+        floor = min(depth[p] for p in ps)
+        seen = set()
+        stack = [g for p in ps for g in parents.get(p, ())
+                 if depth[g] >= floor]
+        while stack:
+            node = stack.pop()
+            if node not in seen:
+                seen.add(node)
+                stack.extend(g for g in parents.get(node, ())
+                             if depth[g] >= floor)
+        for parent in seen.intersection(ps):
+            redundant.add((parent, child))
+    return redundant
+
+
+def bottomLevels(tasks, parents, order, cost):
+    """Return the longest path from each quantum to the end of the workflow
+
+    Each path includes the cost(taskname) of the quantum itself, so the
+    largest value is the length of the critical path.
+    """
+    children = {}
+    for child, ps in parents.items():
+        for parent in ps:
+            children.setdefault(parent, []).append(child)
+    level = {}
+    for iq in reversed(order):
+        level[iq] = cost(tasks[iq]) + max(
+            (level[c] for c in children.get(iq, ())), default=0)
+    return level
+
+
+def simulateSchedule(tasks, parents, cost, slots, priority=None):
+    """Return the makespan of a workflow run on a number of slots
+
+    Ready quanta are started in order of decreasing priority, or in the
+    order in which they became ready if there are no priorities.
+    """
+    children = {}
+    waiting = {}
+    for child, ps in parents.items():
+        waiting[child] = len(ps)
+        for parent in ps:
+            children.setdefault(parent, []).append(child)
+    sequence = 0
+    ready = []
+    for iq in tasks:
+        if not waiting.get(iq):
+            heapq.heappush(ready, (-priority[iq] if priority else sequence,
+                                   iq))
+            sequence += 1
+    running = []
+    now = 0.0
+    while ready or running:
+        while ready and len(running) < slots:
+            _, iq = heapq.heappop(ready)
+            heapq.heappush(running, (now + cost(tasks[iq]), iq))
+        now, iq = heapq.heappop(running)
+        for child in children.get(iq, ()):
+            waiting[child] -= 1
+            if waiting[child] == 0:
+                heapq.heappush(ready, (-priority[child] if priority
+                                       else sequence, child))
+                sequence += 1
+    return now
+
+
+def clusterQuanta(tasks, parents, maxChain=4, maxCluster=16,
+                  profiles=None):
+    """Assign Pegasus cluster labels to short quanta
+
+    Chains of quanta, where each has a single child whose only parent it
+    is, are merged first; chains of the same tasks starting at the same
+    depth in the graph are then grouped, up to maxCluster quanta per
+    cluster.  Quanta needing more than LARGE_MEMORY are not clustered, and
+    a cluster never mixes memory requests, which come from profiles if
+    given.  Entry into a cluster is always at its shallowest
+    quanta, so the clustered workflow stays acyclic.
+
+    Returns a dict of labels by quantum, for quanta in clusters of more
+    than one.
+    """
+    children = {}
+    for child, ps in parents.items():
+        for parent in ps:
+            children.setdefault(parent, []).append(child)
+    order = topologicalOrder(list(tasks), parents)
+    depth = depths(order, parents)
+
+    large = lambda taskname: memoryRequest(taskname, profiles) > LARGE_MEMORY
+    chains = []
+    chained = set()
+    for iq in order:
+        if iq in chained or large(tasks[iq]):
+            continue
+        chain = [iq]
+        while len(chain) < min(maxChain, maxCluster):
+            following = children.get(chain[-1], ())
+            if len(following) != 1 or len(parents[following[0]]) != 1:
+                break
+            child = following[0]
+            if (large(tasks[child])
+                    or memoryRequest(tasks[child], profiles)
+                    != memoryRequest(tasks[iq], profiles)):
+                break
+            chain.append(child)
+        chained.update(chain)
+        chains.append(chain)
+
+    groups = {}
+    for chain in chains:
+        key = (tuple(tasks[iq] for iq in chain), depth[chain[0]])
+        groups.setdefault(key, []).append(chain)
+    labels = {}
+    for (tasknames, _), members in groups.items():
+        perCluster = max(1, maxCluster // len(tasknames))
+        for i in range(0, len(members), perCluster):
+            batch = members[i:i + perCluster]
+            if len(batch) * len(tasknames) < 2:
+                continue
+            label = "cluster%d" % batch[0][0]
+            for chain in batch:
+                for iq in chain:
+                    labels[iq] = label
+    return labels
+
+
+def estimateMakespan(tasks, parents, labels, overhead, quantumTime):
+    """Estimate the number of jobs and the makespan of a workflow
+
+    Each job costs overhead plus quantumTime(taskname) for each of its
+    quanta, run one after another; slots are assumed to be unlimited.
+    Returns the number of jobs, the makespan and the total slot time.
+    """
+    duration = {}
+    for iq, taskname in tasks.items():
+        job = labels.get(iq, iq)
+        duration[job] = (duration.get(job, overhead)
+                         + quantumTime(taskname))
+    jobParents = {}
+    for child, ps in parents.items():
+        for parent in ps:
+            if labels.get(parent, parent) != labels.get(child, child):
+                jobParents.setdefault(labels.get(child, child),
+                                      set()).add(labels.get(parent, parent))
+    finish = {}
+    for job in topologicalOrder(list(duration), jobParents):
+        start = max((finish[p] for p in jobParents.get(job, ())),
+                    default=0)
+        finish[job] = start + duration[job]
+    return len(duration), max(finish.values(), default=0), \
+        sum(duration.values())
+
+
+def jobId(iq):
+    """Return the DAX job id of a quantum"""
+    # Pegasus job ids are strings, so there is no limit on the number of
+    # quanta and no clash with the init job.
+    return "q%d" % iq
+
+
+class DaxWriter:
+    """Write a Pegasus DAX incrementally.
+
+    Jobs are written to the output as they are added.  The schema requires
+    dependencies to follow all the jobs, so they are spooled to a temporary
+    file and copied to the output by close(); memory use does not grow with
+    the size of the workflow.  This writes the same XML as Pegasus.DAX3,
+    with one <child> element per job and no repeated dependencies, except
+    that files are not listed separately, since they have no physical
+    names to record.
+    """
+
+    def __init__(self, out, name="dax"):
+        self.out = out
+        self.edges = tempfile.TemporaryFile("w+")
+        self.jobs = 0
+        self.dependencies = 0
+        out.write(DAX_HEADER % quoteattr(name))
+
+    def addJob(self, id, arguments, inputs=(), stderr=None, profiles=()):
+        """Write a pipetask job
+
+        Arguments are strings, or ("file", name) tuples for file
+        references; profiles are (namespace, key, value) tuples.
+        """
+        args = " ".join(escape(a) if isinstance(a, str)
+                        else "<file name=%s/>" % quoteattr(a[1])
+                        for a in arguments)
+        lines = ['\t<job id=%s name="pipetask">' % quoteattr(id),
+                 "\t\t<argument>%s</argument>" % args]
+        for namespace, key, value in profiles:
+            lines.append("\t\t<profile namespace=%s key=%s>%s</profile>"
+                         % (quoteattr(namespace), quoteattr(key),
+                            escape(str(value))))
+        if stderr is not None:
+            lines.append('\t\t<stderr name=%s link="output"/>'
+                         % quoteattr(stderr))
+        for filename in inputs:
+            lines.append('\t\t<uses name=%s link="input"/>'
+                         % quoteattr(filename))
+        if stderr is not None:
+            lines.append('\t\t<uses name=%s link="output"/>'
+                         % quoteattr(stderr))
+        lines.append("\t</job>\n")
+        self.out.write("\n".join(lines))
+        self.jobs += 1
+
+    def depends(self, parent, child):
+        """Record that a job depends on another"""
+        self.edges.write("%s %s\n" % (parent, child))
+        self.dependencies += 1
+
+    def close(self):
+        """Write the dependencies and finish the DAX
+
+        Dependencies are grouped by child, a <child> element for each, and
+        repeats dropped.  If there are more than SORT_EDGES, they are first
+        split into buckets by child, so that only one bucket is sorted in
+        memory at a time.
+        """
+        self.edges.seek(0)
+        if self.dependencies <= SORT_EDGES:
+            buckets = [self.edges]
+        else:
+            buckets = [tempfile.TemporaryFile("w+") for _ in
+                       range(-(-self.dependencies // SORT_EDGES))]
+            for line in self.edges:
+                child = line.split()[1]
+                buckets[zlib.crc32(child.encode()) % len(buckets)].write(line)
+            for bucket in buckets:
+                bucket.seek(0)
+        for bucket in buckets:
+            edges = sorted(set(tuple(line.split()[::-1]) for line in bucket))
+            current = None
+            for child, parent in edges:
+                if child != current:
+                    if current is not None:
+                        self.out.write("\t</child>\n")
+                    self.out.write("\t<child ref=%s>\n" % quoteattr(child))
+                    current = child
+                self.out.write("\t\t<parent ref=%s/>\n" % quoteattr(parent))
+            if current is not None:
+                self.out.write("\t</child>\n")
+            bucket.close()
+        self.out.write("</adag>\n")
+        self.edges.close()
+
+
+def generateDax(f, out, name="dax", noInitJob=False, initPickle=None,
+                progress=0, labels=None, priorities=None, redundant=None,
+                roots=None, profiles=None):
+    """Generate a Pegasus DAX abstract workflow
+
+    Reads the "pipetask qgraph --show workflow" listing from f and writes
+    the DAX to out as it goes.  With progress, reports the rate every
+    progress quanta on stderr.  With labels, quanta are given Pegasus
+    cluster labels from it, and with priorities, Condor and DAGMan
+    priorities, by quantum number.  Dependencies in redundant are left out,
+    and with roots, only those quanta depend directly on the init job.
+    CPU and memory requests come from profiles, by task name, where it has
+    them.  Returns the DaxWriter, for its counts.
+    """
+    dax = DaxWriter(out, name)
 
     if not noInitJob:
         # Add the init job
-        init = peg.Job(name="pipetask", id=999999) # need a unique number
-        pickle = peg.File(initPickle)
-        dax.addFile(pickle)
-        init.uses(pickle, link=peg.Link.INPUT)
-        init.addArguments("run", "-b BUTLER -i INCOL --output-run OUTCOL",
-                          "--init-only --register-dataset-types --qgraph", pickle)
-        logfile = peg.File("log.init.out")
-        dax.addFile(logfile)
-        init.setStderr(logfile)
-        init.uses(logfile, link=peg.Link.OUTPUT)
-        dax.addJob(init)
+        dax.addJob(INIT_ID,
+                   ["run", "-b BUTLER -i INCOL --output-run OUTCOL",
+                    "--init-only --register-dataset-types --qgraph",
+                    ("file", initPickle)],
+                   inputs=[initPickle], stderr="log.init.out")
 
-    for line in f:
+    start = time.time()
+    for kind, a, b in readListing(f):
         # To add a job
-        if line.startswith("Quantum"):
-            match = re.search(r"(\d+): (\w+)", line)
-            iq = int(match.group(1))
-            taskname = match.group(2)
-            print("Adding job", iq, taskname, " #", line.rstrip('\n'))
-            # Pegasus Job cannot have id=0, hack it...FIXME
-            # Assuming there are <99999 jobs in total
-            job = peg.Job(name="pipetask", id=iq+100000)
-
-            demandingTasks = set(['MakeWarpTask', 'CompareWarpAssembleCoaddTask',
-                                  'DeblendCoaddSourcesSingleTask',
-                                  'MeasureMergedCoaddSourcesTask'])
-            job.addProfile(peg.Profile(peg.Namespace.CONDOR, "request_cpus", "1"))
-            if taskname in demandingTasks:
-                job.addProfile(peg.Profile(peg.Namespace.CONDOR, "request_memory", "28GB"))
-            else:
-                job.addProfile(peg.Profile(peg.Namespace.CONDOR, "request_memory", "2GB"))
+        if kind == "quantum":
+            iq, taskname = a, b
+            jobProfiles = [
+                ("condor", "request_cpus", cpuRequest(taskname, profiles)),
+                ("condor", "request_memory",
+                 memoryClass(taskname, profiles))]
+            if labels and iq in labels:
+                jobProfiles.append(("pegasus", "label", labels[iq]))
+            if priorities:
+                # Higher priorities are started first, by DAGMan among
+                # ready jobs and by Condor among queued ones.
+                jobProfiles.append(("condor", "priority", priorities[iq]))
+                jobProfiles.append(("dagman", "priority", priorities[iq]))
 
             filename = "quantum-%06d.qgraph" % iq
-            pickle = peg.File(filename)
-            dax.addFile(pickle)
-            job.uses(pickle, link=peg.Link.INPUT)
-            job.addArguments("run", "-b BUTLER -i INCOL --output-run OUTCOL",
-                             "--extend-run --skip-init-writes",
-                             "--clobber-partial-outputs --skip-existing --qgraph", pickle)
-
-            logfile = peg.File("log.%s.%06d.out" % (taskname, iq) )
-            dax.addFile(logfile)
-            job.setStderr(logfile)
-            job.uses(logfile, link=peg.Link.OUTPUT)
-   
-            dax.addJob(job)
-            if not noInitJob:
-                # Every job depends on the init job
-                dax.depends(parent=init, child=job)
+            dax.addJob(jobId(iq),
+                       ["run", "-b BUTLER -i INCOL --output-run OUTCOL",
+                        "--extend-run --skip-init-writes",
+                        "--clobber-partial-outputs --skip-existing --qgraph",
+                        ("file", filename)],
+                       inputs=[filename],
+                       stderr="log.%s.%06d.out" % (taskname, iq),
+                       profiles=jobProfiles)
+            if not noInitJob and (roots is None or iq in roots):
+                # Every job depends on the init job, through its
+                # ancestors if it has any
+                dax.depends(INIT_ID, jobId(iq))
+            if progress and dax.jobs % progress == 0:
+                print("%d jobs, %d dependencies, %.0f jobs/s"
+                      % (dax.jobs, dax.dependencies,
+                         dax.jobs / (time.time() - start)),
+                      file=sys.stderr)
 
         # To add a job dependency
-        if line.startswith("Parent Quantum"):
-            match = re.search(r"Parent Quantum (\d+) - Child Quantum (\d+)", line)
-            # FIXME
-            parent = int(match.group(1))+100000
-            child = int(match.group(2))+100000
-            dax.depends(parent=parent, child=child)
-            print("Adding dependency", parent, child)
+        elif not redundant or (a, b) not in redundant:
+            dax.depends(jobId(a), jobId(b))
 
+    dax.close()
     return dax
 
 
@@ -83,10 +464,105 @@ if __name__ == "__main__":
                         help="a flag to ignore the init job")
     parser.add_argument("--initPickle", type=str, default="test.qgraph",
                         help="file name of the wf pickle that will be used in the init job ")
+    parser.add_argument("--progress", type=int, default=0, metavar="N",
+                        help="report progress every N quanta on stderr")
+    parser.add_argument("--cluster", action='store_true',
+                        help="label short quanta for Pegasus label clustering")
+    parser.add_argument("--maxChain", type=int, default=4,
+                        help="maximum length of a clustered chain of quanta")
+    parser.add_argument("--maxCluster", type=int, default=16,
+                        help="maximum number of quanta in a cluster")
+    parser.add_argument("--optimize", action='store_true',
+                        help="drop redundant dependencies and set"
+                        " critical-path priorities")
+    parser.add_argument("--overhead", type=float, default=30.0,
+                        help="per-job overhead in seconds, for the estimate")
+    parser.add_argument("--quantumTime", type=float, default=60.0,
+                        help="seconds per quantum, for the estimate")
+    parser.add_argument("--slots", type=int, default=100,
+                        help="number of job slots, for the estimate")
+    parser.add_argument("--taskTime", action="append", default=[],
+                        metavar="TASK=SECONDS",
+                        help="seconds per quantum of a task, for the estimate")
+    parser.add_argument("--profiles",
+                        help="resource profiles from profiles.py, for the"
+                        " CPU and memory requests and the estimates")
 
     args = parser.parse_args()
 
-    with open(args.inputData, "r") as f:
-        dax = generateDax(f, "ciHsc", args.noInit, args.initPickle)
-    with open(args.outputFile, "w") as f:
-        dax.writeXML(f)
+    profiles = loadProfiles(args.profiles) if args.profiles else {}
+    # Tasks whose profiled quanta reported no wall time keep the default.
+    taskTimes = dict((t, p["runtime"]) for t, p in profiles.items()
+                     if p.get("runtime") is not None)
+    taskTimes.update((t.split("=")[0], float(t.split("=")[1]))
+                     for t in args.taskTime)
+    quantumTime = lambda taskname: taskTimes.get(taskname, args.quantumTime)
+    cost = lambda taskname: args.overhead + quantumTime(taskname)
+
+    labels = None
+    priorities = None
+    redundant = None
+    roots = None
+    if args.cluster or args.optimize:
+        # These need the whole graph; it is read compactly before the DAX
+        # is streamed.
+        with open(args.inputData, "r") as f:
+            tasks, parents = readWorkflow(f)
+
+    if args.optimize:
+        order = topologicalOrder(list(tasks), parents)
+        redundant = transitiveReduction(parents, depths(order, parents))
+        roots = set(iq for iq in tasks if not parents.get(iq))
+        edges = sum(len(ps) for ps in parents.values())
+        print("Transitive reduction: %d -> %d dependencies between quanta,"
+              " %d -> %d on the init job"
+              % (edges, edges - len(redundant), len(tasks), len(roots)))
+        for child in set(child for _, child in redundant):
+            parents[child] = [p for p in parents[child]
+                              if (p, child) not in redundant]
+
+        level = bottomLevels(tasks, parents, order, cost)
+        priorities = dict((iq, int(round(value)))
+                          for iq, value in level.items())
+        # Follow the critical path down from its start.
+        children = {}
+        for child, ps in parents.items():
+            for parent in ps:
+                children.setdefault(parent, []).append(child)
+        iq = max(level, key=level.get)
+        path = [tasks[iq]]
+        while children.get(iq):
+            iq = max(children[iq], key=level.get)
+            path.append(tasks[iq])
+        print("Critical path %.0f s: %s"
+              % (max(level.values()), " -> ".join(path)))
+        fifo = simulateSchedule(tasks, parents, cost, args.slots)
+        prioritized = simulateSchedule(tasks, parents, cost, args.slots,
+                                       priorities)
+        print("Predicted makespan on %d slots: %.0f s in arrival order,"
+              " %.0f s by critical-path priority"
+              % (args.slots, fifo, prioritized))
+
+    if args.cluster:
+        labels = clusterQuanta(tasks, parents, args.maxChain,
+                               args.maxCluster, profiles)
+        before = estimateMakespan(tasks, parents, {}, args.overhead,
+                                  quantumTime)
+        after = estimateMakespan(tasks, parents, labels, args.overhead,
+                                 quantumTime)
+        # With limited slots, the makespan is at least the critical path
+        # and at least the slot time spread over all the slots.
+        print("Clustering %d quanta: %d -> %d jobs, slot time %.0f -> %.0f s,"
+              " critical path %.0f -> %.0f s, estimated makespan on %d slots"
+              " %.0f -> %.0f s"
+              % (len(tasks), before[0], after[0], before[2], after[2],
+                 before[1], after[1], args.slots,
+                 max(before[1], before[2] / args.slots),
+                 max(after[1], after[2] / args.slots)))
+
+    with open(args.inputData, "r") as f, open(args.outputFile, "w") as out:
+        dax = generateDax(f, out, "ciHsc", args.noInit, args.initPickle,
+                          args.progress, labels, priorities, redundant, roots,
+                          profiles)
+    print("Wrote %d jobs and %d dependencies to %s"
+          % (dax.jobs, dax.dependencies, args.outputFile))
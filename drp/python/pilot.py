@@ -0,0 +1,414 @@
+#!/usr/bin/env python
+
+import argparse
+from collections import deque
+import json
+import logging
+from multiprocessing import Process
+from multiprocessing.managers import BaseManager
+import os
+import statistics
+import subprocess
+import threading
+import time
+
+import pegasusize
+
+
+class QuantumQueue:
+    """Dependency-aware queue of the quanta of a workflow
+
+    Quanta become ready once all their parents have succeeded; the
+    descendants of a failed quantum are skipped.  Pilot workers take ready
+    quanta with get(), report them with done() and call heartbeat() while
+    they run.  The quanta of a worker not heard from within lease seconds
+    are taken back and queued again, up to retries times, then failed.
+    """
+
+    def __init__(self, tasks, parents, lease=60.0, retries=1):
+        self.tasks = tasks
+        self.children = {}
+        for child, ps in parents.items():
+            for parent in ps:
+                self.children.setdefault(parent, []).append(child)
+        self.waiting = dict((iq, len(parents.get(iq, ()))) for iq in tasks)
+        now = time.time()
+        self.ready = deque(iq for iq, n in self.waiting.items() if n == 0)
+        self.readyTime = dict((iq, now) for iq in self.ready)
+        self.running = {}
+        self.failed = []
+        self.skipped = set()
+        self.lost = {}
+        self.records = []
+        self.lease = lease
+        self.retries = retries
+        self.seen = {}
+        self.condition = threading.Condition()
+
+    def get(self, worker):
+        """Return the next ready quantum and its task name
+
+        Waits until a quantum is ready; returns None once none are left
+        that can run.
+        """
+        with self.condition:
+            self.seen[worker] = time.time()
+            while True:
+                self.reap()
+                if self.ready:
+                    break
+                if not self.running:
+                    return None
+                self.condition.wait(self.lease / 2)
+            iq = self.ready.popleft()
+            self.running[iq] = (worker, time.time())
+            return iq, self.tasks[iq]
+
+    def heartbeat(self, worker):
+        """Record that a worker is still alive"""
+        with self.condition:
+            self.seen[worker] = time.time()
+
+    def done(self, iq, ok, runtime, worker):
+        """Record that a quantum has finished
+
+        runtime is the time the worker spent running it; the rest of the
+        time since it was handed out is queue overhead.  Reports for
+        quanta that were taken back from the worker are ignored.
+        """
+        with self.condition:
+            self.seen[worker] = time.time()
+            if self.running.get(iq, (None,))[0] != worker:
+                logging.warning("Ignoring quantum %d from worker %s, which"
+                                " had lost it", iq, worker)
+                return
+            self.finish(iq, ok, runtime)
+
+    def finish(self, iq, ok, runtime):
+        """Record a quantum's outcome and release or skip its children;
+        the condition must be held
+        """
+        worker, dispatched = self.running.pop(iq)
+        now = time.time()
+        self.records.append(dict(
+            quantum=iq, task=self.tasks[iq], worker=worker, ok=ok,
+            wait=dispatched - self.readyTime.pop(iq), runtime=runtime,
+            overhead=now - dispatched - runtime))
+        if ok:
+            for child in self.children.get(iq, ()):
+                self.waiting[child] -= 1
+                if self.waiting[child] == 0:
+                    self.ready.append(child)
+                    self.readyTime[child] = now
+        else:
+            self.failed.append(iq)
+            self.skipped.update(self.descendants(iq))
+        self.condition.notify_all()
+
+    def reap(self):
+        """Take back the quanta of workers not heard from within the lease;
+        the condition must be held
+        """
+        now = time.time()
+        for iq, (worker, dispatched) in list(self.running.items()):
+            if now - self.seen.get(worker, dispatched) <= self.lease:
+                continue
+            self.lost[iq] = self.lost.get(iq, 0) + 1
+            if self.lost[iq] > self.retries:
+                logging.warning("Worker %s lost quantum %d; failing it",
+                                worker, iq)
+                # Its runtime is unknown; count the time it was out as
+                # runtime rather than queue overhead.
+                self.finish(iq, False, now - dispatched)
+                continue
+            logging.warning("Worker %s lost quantum %d; queueing it again",
+                            worker, iq)
+            del self.running[iq]
+            self.ready.append(iq)
+            self.readyTime[iq] = now
+            self.condition.notify_all()
+
+    def descendants(self, iq):
+        """Return the quanta that can no longer run because iq failed"""
+        seen = set()
+        stack = list(self.children.get(iq, ()))
+        while stack:
+            child = stack.pop()
+            if child not in seen:
+                seen.add(child)
+                stack.extend(self.children.get(child, ()))
+        return seen
+
+    def status(self):
+        """Return counts of quanta by state"""
+        with self.condition:
+            return dict(total=len(self.tasks), done=len(self.records),
+                        ready=len(self.ready), running=len(self.running),
+                        failed=len(self.failed), skipped=len(self.skipped),
+                        lost=sum(self.lost.values()))
+
+    def finished(self):
+        """Return True once every quantum has finished, failed or been
+        skipped
+        """
+        with self.condition:
+            self.reap()
+            return len(self.records) + len(self.skipped) >= len(self.tasks)
+
+    def getRecords(self):
+        """Return the timing record of each finished quantum"""
+        with self.condition:
+            return list(self.records)
+
+
+class QueueManager(BaseManager):
+    pass
+
+
+# Workers get a proxy for the queue; serve() registers the queue itself.
+QueueManager.register("queue")
+
+
+class Runner:
+    """Executes quanta in a pilot worker
+
+    setup() is called once when the worker starts and run() for each
+    quantum, raising an exception if it fails.
+    """
+
+    def setup(self):
+        pass
+
+    def run(self, iq, taskname):
+        raise NotImplementedError()
+
+
+class SleepRunner(Runner):
+    """Stand-in that sleeps instead of running quanta
+
+    startup stands for loading the stack and connecting to the Butler,
+    paid once per worker, or once per quantum if cold.
+    """
+
+    def __init__(self, seconds, startup=0.0, cold=False):
+        self.seconds = seconds
+        self.startup = startup
+        self.cold = cold
+
+    def setup(self):
+        if not self.cold:
+            time.sleep(self.startup)
+
+    def run(self, iq, taskname):
+        if self.cold:
+            time.sleep(self.startup)
+        time.sleep(self.seconds)
+
+
+class PipetaskRunner(Runner):
+    """Runs each quantum in a new pipetask process, as Pegasus jobs do"""
+
+    def __init__(self, butler, inputs, outputRun, qgraphDir):
+        self.butler = butler
+        self.inputs = inputs
+        self.outputRun = outputRun
+        self.qgraphDir = qgraphDir
+
+    def run(self, iq, taskname):
+        subprocess.run(["pipetask", "run", "-b", self.butler,
+                        "-i", self.inputs, "--output-run", self.outputRun,
+                        "--extend-run", "--skip-init-writes",
+                        "--clobber-partial-outputs", "--skip-existing",
+                        "--qgraph", os.path.join(self.qgraphDir,
+                                                 "quantum-%06d.qgraph" % iq)],
+                       check=True)
+
+
+class ButlerRunner(PipetaskRunner):
+    """Runs quanta in the worker process with a Butler kept open
+
+    The stack is imported, and the registry and datastore connected, once
+    per worker; task classes stay imported after their first quantum.
+    """
+
+    def setup(self):
+        from lsst.daf.butler import Butler
+        from lsst.ctrl.mpexec import SingleQuantumExecutor, TaskFactory
+        from lsst.pipe.base import QuantumGraph
+
+        self.QuantumGraph = QuantumGraph
+        self.butlerInstance = Butler(self.butler, run=self.outputRun,
+                                     collections=self.inputs.split(","))
+        # As pipetask run --skip-existing --clobber-partial-outputs.
+        self.executor = SingleQuantumExecutor(TaskFactory(),
+                                              skipExisting=True,
+                                              clobberPartialOutputs=True)
+
+    def run(self, iq, taskname):
+        path = os.path.join(self.qgraphDir, "quantum-%06d.qgraph" % iq)
+        qgraph = self.QuantumGraph.loadUri(
+            path, self.butlerInstance.registry.dimensions)
+        for node in qgraph:
+            self.executor.execute(node.taskDef, node.quantum,
+                                  self.butlerInstance)
+
+
+def work(address, authkey, runner, name, heartbeat=10.0):
+    """Pilot worker: run quanta from the queue until none are left
+
+    A thread tells the queue every heartbeat seconds that the worker is
+    alive, so that its quanta are taken back if it dies.
+    """
+    manager = QueueManager(address=address, authkey=authkey)
+    manager.connect()
+    queue = manager.queue()
+    stop = threading.Event()
+
+    def beat():
+        # Proxies are not shared between threads.
+        beatQueue = manager.queue()
+        while not stop.wait(heartbeat):
+            beatQueue.heartbeat(name)
+
+    threading.Thread(target=beat, daemon=True).start()
+    start = time.time()
+    runner.setup()
+    logging.info("Worker %s set up in %.3f s", name, time.time() - start)
+    while (item := queue.get(name)) is not None:
+        iq, taskname = item
+        start = time.time()
+        try:
+            runner.run(iq, taskname)
+            ok = True
+        except Exception:
+            logging.exception("Quantum %d (%s) failed", iq, taskname)
+            ok = False
+        queue.done(iq, ok, time.time() - start, name)
+    stop.set()
+
+
+def startWorkers(address, authkey, runner, count, prefix, heartbeat=10.0):
+    """Start pilot worker processes"""
+    workers = []
+    for i in range(count):
+        worker = Process(target=work, name="%s-%d" % (prefix, i),
+                         args=(address, authkey, runner,
+                               "%s-%d" % (prefix, i), heartbeat))
+        worker.start()
+        workers.append(worker)
+    return workers
+
+
+def serve(queue, address, authkey):
+    """Serve a queue to pilot workers from a background thread"""
+    QueueManager.register("queue", callable=lambda: queue)
+    server = QueueManager(address=address, authkey=authkey).get_server()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def report(queue, elapsed, stats=None):
+    """Print a summary of a pilot run"""
+    records = queue.getRecords()
+    status = queue.status()
+    print("Ran %d of %d quanta (%d failed, %d skipped) in %.1f s"
+          % (status["done"], status["total"], status["failed"],
+             status["skipped"], elapsed))
+    if status["lost"]:
+        print("Took back %d quanta from lost workers" % status["lost"])
+    if records:
+        overheads = sorted(r["overhead"] for r in records)
+        print("Per quantum: runtime mean %.3f s; queue overhead mean %.1f ms,"
+              " p95 %.1f ms"
+              % (statistics.mean(r["runtime"] for r in records),
+                 1000 * statistics.mean(overheads),
+                 1000 * overheads[int(0.95 * (len(overheads) - 1))]))
+    if stats:
+        with open(stats, "w") as f:
+            for record in records:
+                print(json.dumps(record), file=f)
+
+
+def parseAddress(text):
+    host, port = text.rsplit(":", 1)
+    return host, int(port)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Run quanta in long-lived pilot workers")
+    parser.add_argument("mode", choices=("run", "serve", "work"),
+                        help="run: queue and workers in one process tree;"
+                        " serve: queue only; work: workers only")
+    parser.add_argument("-i", "--inputData", default="wf",
+                        help="workflow listing from pipetask qgraph --show workflow")
+    parser.add_argument("-a", "--address", type=parseAddress,
+                        default=("127.0.0.1", 0),
+                        help="host:port of the queue")
+    parser.add_argument("--authkey", default=os.environ.get("PILOT_AUTHKEY",
+                                                            "pilot"),
+                        help="shared secret for the queue")
+    parser.add_argument("-n", "--workers", type=int, default=os.cpu_count(),
+                        help="number of pilot workers on this node")
+    parser.add_argument("--runner", choices=("butler", "pipetask", "sleep"),
+                        default="butler", help="how to run each quantum")
+    parser.add_argument("-b", "--butler", default="BUTLER",
+                        help="Butler repository")
+    parser.add_argument("--input", default="INCOL",
+                        help="input collections")
+    parser.add_argument("--outputRun", default="OUTCOL",
+                        help="output run collection")
+    parser.add_argument("--qgraphDir", default="input",
+                        help="directory of quantum-NNNNNN.qgraph files")
+    parser.add_argument("--sleep", type=float, default=0.0,
+                        help="seconds per quantum for the sleep runner")
+    parser.add_argument("--startup", type=float, default=0.0,
+                        help="startup seconds for the sleep runner")
+    parser.add_argument("--cold", action="store_true",
+                        help="pay the sleep runner startup for every quantum")
+    parser.add_argument("--stats", help="write per-quantum timings to this file")
+    parser.add_argument("--heartbeat", type=float, default=10.0,
+                        help="seconds between worker heartbeats")
+    parser.add_argument("--lease", type=float, default=60.0,
+                        help="seconds without a heartbeat after which a"
+                        " worker's quanta are taken back")
+    parser.add_argument("--retries", type=int, default=1,
+                        help="times a quantum taken back from a lost worker"
+                        " is queued again before it fails")
+    args = parser.parse_args()
+    authkey = args.authkey.encode()
+    logging.basicConfig(format="%(asctime)s %(message)s", level="INFO")
+
+    if args.runner == "sleep":
+        runner = SleepRunner(args.sleep, args.startup, args.cold)
+    elif args.runner == "pipetask":
+        runner = PipetaskRunner(args.butler, args.input, args.outputRun,
+                                args.qgraphDir)
+    else:
+        runner = ButlerRunner(args.butler, args.input, args.outputRun,
+                              args.qgraphDir)
+
+    if args.mode == "work":
+        workers = startWorkers(args.address, authkey, runner, args.workers,
+                               os.uname().nodename, args.heartbeat)
+        for worker in workers:
+            worker.join()
+    else:
+        with open(args.inputData) as f:
+            tasks, parents = pegasusize.readWorkflow(f)
+        queue = QuantumQueue(tasks, parents, args.lease, args.retries)
+        server = serve(queue, args.address, authkey)
+        logging.info("Serving %d quanta on %s:%d", len(tasks),
+                     *server.address)
+        start = time.time()
+        if args.mode == "run":
+            workers = startWorkers(server.address, authkey, runner,
+                                   args.workers, "local", args.heartbeat)
+            for worker in workers:
+                worker.join()
+        else:
+            # Wait for remote workers to take and finish every quantum.
+            while not queue.finished():
+                time.sleep(1)
+        report(queue, time.time() - start, args.stats)
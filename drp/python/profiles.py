@@ -0,0 +1,351 @@
+#!/usr/bin/env python
+
+import argparse
+from datetime import datetime
+import json
+import logging
+import math
+import os
+import re
+import statistics
+
+import pegasusize
+
+# Job stderr files written by the DAX jobs: log.<Task>.<NNNNNN>.out
+LOG_NAME = re.compile(r"log\.(\w+)\.(\d+)\.out$")
+
+# pipetask (ctrl_mpexec) reports the wall time of each quantum
+EXECUTION = re.compile(r"on quantum (\{.*?\}) took ([\d.]+) seconds")
+
+# "/usr/bin/time -v", if pipetask was run under it
+MAX_RSS = re.compile(r"Maximum resident set size \(kbytes\): (\d+)")
+ELAPSED = re.compile(r"Elapsed \(wall clock\) time .*: ([\d:.]+)")
+CPU_TIME = re.compile(r"(?:User|System) time \(seconds\): ([\d.]+)")
+
+# Condor user log events: "005 (123.000.000) 2020-10-16 12:10:00 ..."
+EVENT = re.compile(r"(\d{3}) \((\d+)\.(\d+)\.\d+\) (\S+ \S+) ")
+# DAG node names: "pipetask_q<N>" for quantum N, or in DAXes written before
+# quanta had their own job ids, "pipetask_<N + LEGACY_OFFSET>", with
+# LEGACY_INIT for the init job
+DAG_NODE = re.compile(r"DAG Node: (?:\S*?q(\d+)|\S*_(\d+))$")
+LEGACY_OFFSET = 100000
+LEGACY_INIT = 999999
+MEMORY_USAGE = re.compile(r"(\d+)\s+-\s+MemoryUsage of job \(MB\)")
+RESIDENT_SET = re.compile(r"(\d+)\s+-\s+ResidentSetSize of job \(KB\)")
+REMOTE_USAGE = re.compile(r"Usr (\d+) ([\d:]+), Sys (\d+) ([\d:]+)\s+-\s+"
+                          r"Run Remote Usage")
+# Partitionable Resources : Usage Request Allocated
+RESOURCE_MEMORY = re.compile(r"Memory \(MB\)\s+:\s+([\d.]+)")
+
+# Memory requests are rounded up to a multiple of this, in MB
+GRANULARITY = 256
+
+
+def parseClock(text):
+    """Return the seconds in [[D ]HH:]MM:SS[.ss]"""
+    seconds = 0.0
+    for field in text.split(":"):
+        seconds = 60 * seconds + float(field)
+    return seconds
+
+
+def parseTimestamp(text):
+    """Return a Condor log event time in seconds"""
+    try:
+        # Condor 8.8 and later; fromisoformat is much faster than strptime
+        return datetime.fromisoformat(text).timestamp()
+    except ValueError:
+        pass
+    try:
+        return datetime.strptime(text, "%m/%d %H:%M:%S").timestamp()
+    except ValueError:
+        raise RuntimeError("Unrecognized Condor log time %s" % text)
+
+
+def readJobLog(path):
+    """Read the usage of one quantum from its pipetask stderr log
+
+    Returns a dict of whatever the log reports: the quantum data ID, wall
+    time in seconds and, if pipetask ran under /usr/bin/time -v, peak RSS
+    in MB and CPU time in seconds.
+    """
+    record = {}
+    cpu = []
+    with open(path, errors="replace") as f:
+        for line in f:
+            if (m := EXECUTION.search(line)):
+                record["dataId"] = m.group(1)
+                record["wall"] = float(m.group(2))
+            elif (m := MAX_RSS.search(line)):
+                record["memory"] = int(m.group(1)) / 1024
+            elif (m := ELAPSED.search(line)):
+                record["wall"] = parseClock(m.group(1))
+            elif (m := CPU_TIME.search(line)):
+                cpu.append(float(m.group(1)))
+    if cpu:
+        record["cpu"] = sum(cpu)
+    return record
+
+
+def readCondorLog(path):
+    """Read the usage of DAX jobs from a Condor user log
+
+    Jobs are matched to quanta by the DAG node name that Pegasus gives
+    them; clustered jobs, which ran several quanta, are left out.  Returns
+    a dict, by quantum, of peak memory in MB, wall time from the start of
+    execution to termination and CPU time in seconds, of the last
+    execution of each job.
+    """
+    jobs = {}
+    records = {}
+    nodes = 0
+    job = event = None
+    with open(path, errors="replace") as f:
+        for line in f:
+            if line.startswith("..."):
+                event = None
+                continue
+            if (m := EVENT.match(line)):
+                event = m.group(1)
+                job = jobs.setdefault((m.group(2), m.group(3)), {})
+                if event == "001":
+                    job["start"] = parseTimestamp(m.group(4))
+                    job["memory"] = 0
+                elif event == "005" and "start" in job:
+                    job["wall"] = parseTimestamp(m.group(4)) - job["start"]
+                continue
+            if event is None:
+                continue
+            if line.lstrip().startswith("DAG Node:"):
+                nodes += 1
+                if (iq := nodeQuantum(line.strip())) is not None:
+                    job["quantum"] = iq
+            elif (m := MEMORY_USAGE.search(line)):
+                job["memory"] = max(job.get("memory", 0), int(m.group(1)))
+            elif (m := RESIDENT_SET.search(line)):
+                job["memory"] = max(job.get("memory", 0),
+                                    int(m.group(1)) / 1024)
+            elif event == "005" and (m := REMOTE_USAGE.search(line)):
+                job["cpu"] = (86400 * int(m.group(1)) + parseClock(m.group(2))
+                              + 86400 * int(m.group(3))
+                              + parseClock(m.group(4)))
+            elif event == "005" and (m := RESOURCE_MEMORY.search(line)):
+                job["memory"] = max(job.get("memory", 0), float(m.group(1)))
+            if event == "005" and "quantum" in job and "wall" in job:
+                records[job["quantum"]] = dict(
+                    (k, job[k]) for k in ("memory", "wall", "cpu") if k in job)
+    if nodes and not any("quantum" in job for job in jobs.values()):
+        logging.warning("%s: none of its %d DAG nodes is named after a"
+                        " quantum; its jobs are left out", path, nodes)
+    return records
+
+
+def nodeQuantum(line):
+    """Return the quantum of a "DAG Node:" line, or None if it has none"""
+    m = DAG_NODE.search(line)
+    if m is None:
+        return None
+    if m.group(1) is not None:
+        return int(m.group(1))
+    number = int(m.group(2))
+    if number == LEGACY_INIT or number < LEGACY_OFFSET:
+        return None
+    return number - LEGACY_OFFSET
+
+
+def isCondorLog(path):
+    """Return True if a file looks like a Condor user log"""
+    with open(path, errors="replace") as f:
+        return EVENT.match(f.readline()) is not None
+
+
+def harvest(directory):
+    """Collect the usage of each quantum of one run
+
+    Walks the run directory, usually the one pegasus-plan was run in, for
+    log.<Task>.<NNNNNN>.out files and Condor user logs, and merges what
+    they report by quantum number.  Returns a list of dicts with the task
+    name, quantum number and whichever of memory, wall, cpu and dataId
+    were found.
+    """
+    logs = {}
+    condor = {}
+    for dirpath, _, filenames in os.walk(directory):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            if (m := LOG_NAME.match(filename)):
+                record = readJobLog(path)
+                record.update(task=m.group(1), quantum=int(m.group(2)))
+                logs[record["quantum"]] = record
+            elif filename.endswith(".log") and isCondorLog(path):
+                condor.update(readCondorLog(path))
+    records = []
+    for iq, record in logs.items():
+        usage = condor.get(iq, {})
+        # Condor sees the whole job, including pipetask startup, and samples
+        # its memory use; take the larger of what each source saw.
+        for key in ("memory", "wall", "cpu"):
+            values = [r[key] for r in (record, usage) if key in r]
+            if values:
+                record[key] = max(values)
+        records.append(record)
+    return records
+
+
+def quantile(values, q):
+    """Return the q quantile of values, by nearest rank"""
+    values = sorted(values)
+    return values[max(0, math.ceil(q * len(values)) - 1)]
+
+
+def buildModels(records, q=0.95, margin=0.2, minSamples=3):
+    """Build a resource model for each task from harvested records
+
+    A task's memory request is the q quantile of its peak memory, plus the
+    margin, rounded up to GRANULARITY MB; its CPU request is the q quantile
+    of its CPU time over wall time, rounded, and at least 1.  Tasks with
+    fewer than minSamples records with memory use are left out and get
+    the default requests.
+    """
+    byTask = {}
+    for record in records:
+        if "memory" in record:
+            byTask.setdefault(record["task"], []).append(record)
+    models = {}
+    for taskname, samples in sorted(byTask.items()):
+        if len(samples) < minSamples:
+            continue
+        peaks = [r["memory"] for r in samples]
+        memory = GRANULARITY * math.ceil(quantile(peaks, q) * (1 + margin)
+                                         / GRANULARITY)
+        usage = [r["cpu"] / r["wall"] for r in samples
+                 if "cpu" in r and r.get("wall")]
+        walls = [r["wall"] for r in samples if "wall" in r]
+        models[taskname] = dict(
+            samples=len(samples),
+            cpus=max(1, round(quantile(usage, q))) if usage else 1,
+            memory=memory,
+            runtime=round(statistics.mean(walls), 1) if walls else None,
+            maxRuntime=max(walls, default=None),
+            medianMemory=round(statistics.median(peaks)),
+            maxMemory=round(max(peaks)),
+            overRequest=round(sum(1 for p in peaks if p > memory)
+                              / len(peaks), 4))
+    return models
+
+
+def jobsPerNode(cpus, memory, nodeCpus, nodeMemory):
+    """Return how many jobs with these requests fit on one node"""
+    count = min(nodeCpus // cpus, nodeMemory // memory)
+    if count == 0:
+        raise RuntimeError("Requests of %d CPUs and %d MB do not fit on a"
+                           " node" % (cpus, memory))
+    return count
+
+
+def packingReport(models, counts, nodeCpus, nodeMemory):
+    """Print how densely quanta pack onto nodes with and without profiles
+
+    counts is the number of quanta of each task to weight by.  Node time
+    is the runtime of each quantum divided by the number of its jobs that
+    fit on a node, summed over the workflow.
+    """
+    print("%-36s %6s %14s %14s %9s %7s"
+          % ("task", "quanta", "default/node", "profiled/node", "p(evict)",
+             "mem use"))
+    nodeTime = [0.0, 0.0]
+    jobs = [0, 0]
+    for taskname, count in sorted(counts.items()):
+        default = jobsPerNode(1, pegasusize.memoryRequest(taskname),
+                              nodeCpus, nodeMemory)
+        model = models.get(taskname)
+        profiled = (default if model is None else
+                    jobsPerNode(model["cpus"], model["memory"],
+                                nodeCpus, nodeMemory))
+        runtime = model["runtime"] if model and model["runtime"] else 0
+        for i, perNode in enumerate((default, profiled)):
+            nodeTime[i] += count * runtime / perNode
+            jobs[i] += count * perNode
+        print("%-36s %6d %14d %14d %9s %7s"
+              % (taskname, count, default, profiled,
+                 "-" if model is None else "%.3f" % model["overRequest"],
+                 "-" if model is None
+                 else "%.0f%%" % (100 * model["medianMemory"]
+                                  / model["memory"])))
+    total = sum(counts.values())
+    print("Jobs per node, weighted by quanta: %.1f -> %.1f"
+          % (jobs[0] / total, jobs[1] / total))
+    if nodeTime[0]:
+        print("Node time: %.1f -> %.1f node-hours (%.0f%% less)"
+              % (nodeTime[0] / 3600, nodeTime[1] / 3600,
+                 100 * (1 - nodeTime[1] / nodeTime[0])))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Build per-task resource profiles from previous runs")
+    parser.add_argument("mode", choices=("build", "pack"),
+                        help="build: harvest runs into a profile file;"
+                        " pack: report node packing with a profile file")
+    parser.add_argument("runs", nargs="*",
+                        help="run directories holding the job logs and"
+                        " Condor logs, for build")
+    parser.add_argument("-p", "--profiles", default="profiles.json",
+                        help="profile file to write or read")
+    parser.add_argument("-i", "--inputData",
+                        help="workflow listing to weight the packing report"
+                        " by; the harvested quanta otherwise")
+    parser.add_argument("--quantile", type=float, default=0.95,
+                        help="quantile of peak memory to size requests by")
+    parser.add_argument("--margin", type=float, default=0.2,
+                        help="fraction added to the memory quantile")
+    parser.add_argument("--minSamples", type=int, default=3,
+                        help="fewest quanta a task needs to be profiled")
+    parser.add_argument("--nodeCpus", type=int, default=16,
+                        help="CPUs per node, for the packing report")
+    parser.add_argument("--nodeMemory", type=float, default=104,
+                        help="GB of memory per node, for the packing report")
+    args = parser.parse_args()
+
+    if args.mode == "build":
+        if not args.runs:
+            parser.error("build needs at least one run directory")
+        records = []
+        for run in args.runs:
+            found = harvest(run)
+            print("%s: %d quanta, %d with memory use"
+                  % (run, len(found), sum(1 for r in found if "memory" in r)))
+            records.extend(found)
+        models = buildModels(records, args.quantile, args.margin,
+                             args.minSamples)
+        with open(args.profiles, "w") as f:
+            json.dump(dict(quantile=args.quantile, margin=args.margin,
+                           tasks=models), f, indent=1, sort_keys=True)
+        print("Wrote profiles of %d tasks to %s" % (len(models),
+                                                   args.profiles))
+        counts = {}
+        for record in records:
+            counts[record["task"]] = counts.get(record["task"], 0) + 1
+        # Quanta that would have outgrown the new requests; if they share
+        # data IDs, a task may need more than one model.
+        over = sorted((r for r in records if r["task"] in models
+                       and r.get("memory", 0) > models[r["task"]]["memory"]),
+                      key=lambda r: r["memory"], reverse=True)
+        for record in over[:10]:
+            print("Quantum %d (%s %s) peaked at %.0f MB, over the %d MB"
+                  " request" % (record["quantum"], record["task"],
+                                record.get("dataId", "-"), record["memory"],
+                                models[record["task"]]["memory"]))
+    else:
+        models = pegasusize.loadProfiles(args.profiles)
+        counts = dict((t, m["samples"]) for t, m in models.items())
+
+    if args.inputData:
+        with open(args.inputData) as f:
+            tasks, _ = pegasusize.readWorkflow(f)
+        counts = {}
+        for taskname in tasks.values():
+            counts[taskname] = counts.get(taskname, 0) + 1
+    if counts:
+        packingReport(models, counts, args.nodeCpus,
+                      int(args.nodeMemory * 1024))
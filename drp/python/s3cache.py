@@ -0,0 +1,606 @@
+#!/usr/bin/env python
+
+"""Node-local read-through cache for the S3 Butler datastore
+
+Run one proxy per worker node and point the jobs at it with
+S3_ENDPOINT_URL=http://localhost:PORT.  All the pipetask processes on the
+node then share one cache, so shared inputs (calibrations, refcats,
+skymaps, init-outputs) are fetched from the bucket once per node:
+
+    s3cache.py serve --root /mnt/cache --size 50 &
+    s3cache.py prestage --cache http://localhost:8123 inputs.txt
+    ... run the jobs ...
+    s3cache.py stats --cache http://localhost:8123
+
+Whole-object GETs, and ranged GETs such as the parts of boto3 multipart
+downloads, are served from the cache, fetching the whole object first if
+it is not there; concurrent requests for an object being fetched wait for
+that one fetch.  Everything else is forwarded to the upstream endpoint,
+re-signed with this process's credentials, and writes invalidate the
+cached copy.  Butler datasets are not rewritten in place, so cached
+objects are not revalidated.
+"""
+
+import argparse
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import io
+import json
+import os
+import re
+import signal
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import unquote, urlsplit
+
+RANGE = re.compile(r"bytes=(\d*)-(\d*)$")
+
+# Request headers that are passed upstream; the rest, notably the client's
+# signature, are dropped and the request is signed again.
+FORWARDED = set(["content-type", "content-md5", "content-encoding",
+                 "content-disposition", "cache-control", "range",
+                 "if-match", "if-none-match", "if-modified-since",
+                 "if-unmodified-since"])
+
+# Response headers that are not passed back to the client
+HOP_BY_HOP = set(["connection", "keep-alive", "transfer-encoding",
+                  "content-length"])
+
+# Response headers of a cached object that are sent afresh instead
+RESENT = HOP_BY_HOP | set(["date", "server", "content-range",
+                           "accept-ranges"])
+
+
+def readChunks(stream):
+    """Read a chunked body, as of HTTP or S3 aws-chunked framing
+
+    Chunk extensions, such as aws-chunked chunk signatures, are ignored.
+    Returns the payload and a dict of the trailing headers.
+    """
+    parts = []
+    while True:
+        line = stream.readline()
+        if not line:
+            raise RuntimeError("Truncated chunked body")
+        size = int(line.split(b";", 1)[0].strip(), 16)
+        if size == 0:
+            break
+        parts.append(stream.read(size))
+        stream.readline()
+    trailers = {}
+    while (line := stream.readline().strip()):
+        key, _, value = line.decode().partition(":")
+        trailers[key.strip()] = value.strip()
+    return b"".join(parts), trailers
+
+
+class Cache:
+    """Size-bounded directory of whole objects, evicted least recently used
+
+    Each object is stored as a data file and a JSON file of its headers,
+    named by a hash of its bucket and key.  Recency survives restarts
+    through the access times of the data files.
+    """
+
+    def __init__(self, root, maxBytes):
+        self.root = root
+        self.maxBytes = maxBytes
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.inflight = {}
+        self.stats = dict(hits=0, misses=0, coalesced=0, bypassed=0,
+                          bytesServed=0, bytesFetched=0, evictions=0)
+        os.makedirs(root, exist_ok=True)
+        found = []
+        for name in os.listdir(root):
+            if name.endswith(".json"):
+                data = os.path.join(root, name[:-len(".json")])
+                try:
+                    info = os.stat(data)
+                except FileNotFoundError:
+                    os.unlink(os.path.join(root, name))
+                    continue
+                found.append((info.st_atime, name[:-len(".json")],
+                              info.st_size))
+            elif name.startswith(".tmp"):
+                os.unlink(os.path.join(root, name))
+        for _, name, size in sorted(found):
+            self.entries[name] = size
+        self.bytes = sum(self.entries.values())
+
+    def name(self, bucket, key):
+        return hashlib.sha256(("%s/%s" % (bucket, key)).encode()).hexdigest()
+
+    def lookup(self, bucket, key):
+        """Return an open file and the headers of a cached object, or None
+
+        The file stays readable even if the object is evicted meanwhile.
+        """
+        name = self.name(bucket, key)
+        with self.lock:
+            if name not in self.entries:
+                return None
+            self.entries.move_to_end(name)
+        path = os.path.join(self.root, name)
+        try:
+            data = open(path, "rb")
+        except FileNotFoundError:
+            return None
+        try:
+            with open(path + ".json") as f:
+                headers = json.load(f)
+            os.utime(path)
+        except FileNotFoundError:
+            data.close()
+            return None
+        return data, headers
+
+    def add(self, bucket, key, tmp, headers):
+        """Move a fetched object into the cache, evicting others to fit"""
+        name = self.name(bucket, key)
+        path = os.path.join(self.root, name)
+        size = os.path.getsize(tmp)
+        with open(path + ".json", "w") as f:
+            json.dump(headers, f)
+        os.replace(tmp, path)
+        with self.lock:
+            self.bytes += size - self.entries.pop(name, 0)
+            self.entries[name] = size
+            while self.bytes > self.maxBytes and len(self.entries) > 1:
+                old, oldSize = self.entries.popitem(last=False)
+                self.bytes -= oldSize
+                self.stats["evictions"] += 1
+                for suffix in ("", ".json"):
+                    try:
+                        os.unlink(os.path.join(self.root, old + suffix))
+                    except FileNotFoundError:
+                        pass
+
+    def remove(self, bucket, key):
+        """Drop an object that has been written or deleted upstream"""
+        name = self.name(bucket, key)
+        with self.lock:
+            size = self.entries.pop(name, None)
+            if size is None:
+                return
+            self.bytes -= size
+        for suffix in ("", ".json"):
+            try:
+                os.unlink(os.path.join(self.root, name + suffix))
+            except FileNotFoundError:
+                pass
+
+    def count(self, **counts):
+        with self.lock:
+            for key, value in counts.items():
+                self.stats[key] += value
+
+    def report(self, reset=False):
+        """Return the counters, with the hit rate and cache occupancy"""
+        with self.lock:
+            stats = dict(self.stats, objects=len(self.entries),
+                         bytes=self.bytes, maxBytes=self.maxBytes)
+            if reset:
+                for key in self.stats:
+                    self.stats[key] = 0
+        requests = stats["hits"] + stats["misses"] + stats["coalesced"]
+        stats["hitRate"] = ((stats["hits"] + stats["coalesced"]) / requests
+                            if requests else 0.0)
+        return stats
+
+
+class Upstream:
+    """Signs and sends requests to the real S3 endpoint"""
+
+    def __init__(self, endpoint, region, connections):
+        import boto3
+        import urllib3
+
+        self.endpoint = endpoint.rstrip("/")
+        self.region = region
+        self.credentials = boto3.Session().get_credentials()
+        self.pool = urllib3.PoolManager(maxsize=connections, block=True)
+
+    def request(self, method, path, headers, body=b""):
+        """Send a request and return the unread urllib3 response"""
+        from botocore.auth import S3SigV4Auth
+        from botocore.awsrequest import AWSRequest
+
+        request = AWSRequest(method=method, url=self.endpoint + path,
+                             data=body, headers=headers)
+        if self.credentials is not None:
+            S3SigV4Auth(self.credentials, "s3", self.region).add_auth(request)
+        return self.pool.request(method, self.endpoint + path, body=body,
+                                 headers=dict(request.headers.items()),
+                                 preload_content=False, redirect=False,
+                                 retries=False)
+
+
+class CacheHandler(BaseHTTPRequestHandler):
+    """Path-style S3 requests, served from the cache where possible"""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def parse(self):
+        url = urlsplit(self.path)
+        bucket, _, key = unquote(url.path).lstrip("/").partition("/")
+        return bucket, key, url.query
+
+    def readBody(self):
+        """Return the request body and the headers to send upstream with it
+
+        Chunked bodies are read whole.  aws-chunked bodies, which botocore
+        sends to add a checksum trailer, are decoded: their chunk
+        signatures would not match the new signature, so the payload is
+        sent plainly, with the trailing checksum as a header.
+        """
+        headers = self.forwardHeaders()
+        if "chunked" in self.headers.get("Transfer-Encoding", "").lower():
+            body, _ = readChunks(self.rfile)
+        else:
+            length = int(self.headers.get("Content-Length", 0))
+            body = self.rfile.read(length) if length else b""
+        encodings = [e.strip() for e in
+                     headers.pop("Content-Encoding", "").split(",")]
+        if "aws-chunked" in encodings:
+            body, trailers = readChunks(io.BytesIO(body))
+            decoded = self.headers.get("x-amz-decoded-content-length")
+            if decoded is not None and int(decoded) != len(body):
+                raise RuntimeError("aws-chunked body of %d bytes, expected"
+                                   " %s" % (len(body), decoded))
+            headers.update((k, v) for k, v in trailers.items()
+                           if k.lower().startswith("x-amz-checksum-"))
+            encodings.remove("aws-chunked")
+        encodings = [e for e in encodings if e]
+        if encodings:
+            headers["Content-Encoding"] = ", ".join(encodings)
+        return body, headers
+
+    def forwardHeaders(self):
+        return dict((k, v) for k, v in self.headers.items()
+                    if k.lower() in FORWARDED
+                    or k.lower().startswith("x-amz-meta-")
+                    or k.lower().startswith("x-amz-checksum-")
+                    or k.lower() in ("x-amz-acl", "x-amz-storage-class"))
+
+    def relay(self, response):
+        """Pass an upstream response back to the client, streaming its body
+
+        The body is passed on as stored, without undoing any
+        Content-Encoding, so that it matches the upstream length.
+        """
+        self.send_response(response.status)
+        for key, value in response.headers.items():
+            if key.lower() not in HOP_BY_HOP:
+                self.send_header(key, value)
+        length = response.headers.get("Content-Length")
+        if self.command == "HEAD" or response.status in (204, 304):
+            # No body follows; a HEAD's length is that of the object.
+            if length is not None and self.command == "HEAD":
+                self.send_header("Content-Length", length)
+            self.end_headers()
+        elif length is not None:
+            self.send_header("Content-Length", length)
+            self.end_headers()
+            for chunk in response.stream(1024 * 1024, decode_content=False):
+                self.wfile.write(chunk)
+        else:
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for chunk in response.stream(1024 * 1024, decode_content=False):
+                if chunk:
+                    self.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+            self.wfile.write(b"0\r\n\r\n")
+        response.release_conn()
+
+    def passThrough(self):
+        bucket, key, query = self.parse()
+        try:
+            body, headers = self.readBody()
+        except (RuntimeError, ValueError) as e:
+            self.send_error(400, str(e))
+            return
+        if key and self.command in ("PUT", "POST", "DELETE"):
+            self.server.cache.remove(bucket, key)
+        self.server.cache.count(bypassed=1)
+        self.relay(self.server.upstream.request(
+            self.command, self.path, headers, body))
+
+    def sendJson(self, value):
+        body = json.dumps(value).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        bucket, key, query = self.parse()
+        if bucket == "_stats":
+            # Bucket names cannot start with an underscore.
+            self.sendJson(self.server.cache.report("reset" in query))
+            return
+        if not key or query or self.headers.get("If-None-Match") \
+                or self.headers.get("If-Modified-Since"):
+            self.passThrough()
+            return
+        cached = self.fetch(bucket, key)
+        if cached is None:
+            self.passThrough()
+            return
+        self.serveCached(*cached)
+
+    def do_HEAD(self):
+        bucket, key, query = self.parse()
+        cached = (self.server.cache.lookup(bucket, key)
+                  if key and not query else None)
+        if cached is None:
+            self.passThrough()
+            return
+        self.serveCached(*cached)
+
+    do_PUT = passThrough
+    do_POST = passThrough
+    do_DELETE = passThrough
+
+    def fetch(self, bucket, key):
+        """Return the cached object, fetching it first if need be
+
+        Returns None if the object cannot be cached, so that the request is
+        passed through instead.
+        """
+        cache = self.server.cache
+        while True:
+            cached = cache.lookup(bucket, key)
+            if cached is not None:
+                cache.count(hits=1)
+                return cached
+            with cache.lock:
+                event = cache.inflight.get((bucket, key))
+                if event is None:
+                    event = cache.inflight[bucket, key] = threading.Event()
+                    break
+            # Another request is fetching it; use its copy.
+            event.wait()
+            cached = cache.lookup(bucket, key)
+            if cached is not None:
+                cache.count(coalesced=1)
+                return cached
+            return None
+        try:
+            return self.fetchUpstream(bucket, key)
+        finally:
+            with cache.lock:
+                del cache.inflight[bucket, key]
+            event.set()
+
+    def fetchUpstream(self, bucket, key):
+        cache = self.server.cache
+        response = self.server.upstream.request("GET", self.path, {})
+        size = int(response.headers.get("Content-Length", -1))
+        if response.status != 200 or size < 0 \
+                or size > self.server.maxObject:
+            # The connection can only go back to the pool once the body
+            # is read: error bodies are short, but a large object is not
+            # worth reading to discard, so drop its connection instead.
+            if response.status == 200:
+                response.close()
+            else:
+                response.drain_conn()
+            response.release_conn()
+            return None
+        fd, tmp = tempfile.mkstemp(prefix=".tmp", dir=cache.root)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in response.stream(1024 * 1024,
+                                             decode_content=False):
+                    f.write(chunk)
+            if os.path.getsize(tmp) != size:
+                raise RuntimeError("Short read of %s/%s" % (bucket, key))
+            headers = dict((k, v) for k, v in response.headers.items()
+                           if k.lower() not in HOP_BY_HOP)
+            cache.add(bucket, key, tmp, headers)
+        except Exception:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+        finally:
+            response.release_conn()
+        cache.count(misses=1, bytesFetched=size)
+        return cache.lookup(bucket, key)
+
+    def serveCached(self, data, headers):
+        with data:
+            self.sendCached(data, headers)
+
+    def sendCached(self, data, headers):
+        size = os.fstat(data.fileno()).st_size
+        start, end = 0, size - 1
+        status = 200
+        match = RANGE.match(self.headers.get("Range", ""))
+        if match and (match.group(1) or match.group(2)):
+            if not match.group(1):
+                start = max(0, size - int(match.group(2)))
+            else:
+                start = int(match.group(1))
+                if match.group(2):
+                    end = min(end, int(match.group(2)))
+            if start >= size:
+                self.send_response(416)
+                self.send_header("Content-Range", "bytes */%d" % size)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            status = 206
+        self.send_response(status)
+        for key, value in headers.items():
+            if key.lower() not in RESENT:
+                self.send_header(key, value)
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Length", str(end - start + 1))
+        if status == 206:
+            self.send_header("Content-Range",
+                             "bytes %d-%d/%d" % (start, end, size))
+        self.end_headers()
+        if self.command == "HEAD":
+            return
+        data.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = data.read(min(remaining, 1024 * 1024))
+            if not chunk:
+                break
+            self.wfile.write(chunk)
+            remaining -= len(chunk)
+        self.server.cache.count(bytesServed=end - start + 1)
+
+
+class CacheServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, cache, upstream, maxObject):
+        super().__init__(address, CacheHandler)
+        self.cache = cache
+        self.upstream = upstream
+        self.maxObject = maxObject
+
+
+def printStats(stats, out=sys.stdout):
+    """Print the counters from a cache"""
+    print("Requests: %d hits, %d coalesced with a fetch in progress,"
+          " %d misses, %d passed through; hit rate %.1f%%"
+          % (stats["hits"], stats["coalesced"], stats["misses"],
+             stats["bypassed"], 100 * stats["hitRate"]), file=out)
+    print("Bytes: %.1f MB served from the cache, %.1f MB fetched, %.1f MB"
+          " saved" % (stats["bytesServed"] / 1e6, stats["bytesFetched"] / 1e6,
+                      (stats["bytesServed"] - stats["bytesFetched"]) / 1e6),
+          file=out)
+    print("Cache: %d objects, %.1f of %.1f MB, %d evictions"
+          % (stats["objects"], stats["bytes"] / 1e6, stats["maxBytes"] / 1e6,
+             stats["evictions"]), file=out)
+
+
+def readInputs(client, lines):
+    """Expand an input list into (bucket, key) pairs
+
+    Lines are s3://bucket/key URIs; those ending in "/" stand for every
+    object under that prefix.
+    """
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        bucket, _, key = line[len("s3://"):].partition("/")
+        if not key.endswith("/"):
+            yield bucket, key
+            continue
+        paginator = client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=bucket, Prefix=key):
+            for item in page.get("Contents", []):
+                yield bucket, item["Key"]
+
+
+def prestage(cacheUrl, lines, workers):
+    """Read objects through the cache so that they are there for the jobs"""
+    import boto3
+    from botocore.config import Config
+
+    client = boto3.client("s3", endpoint_url=cacheUrl,
+                          config=Config(max_pool_connections=workers))
+
+    def read(item):
+        body = client.get_object(Bucket=item[0], Key=item[1])["Body"]
+        size = 0
+        while chunk := body.read(1024 * 1024):
+            size += len(chunk)
+        return size
+
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        sizes = list(pool.map(read, readInputs(client, lines)))
+    elapsed = time.time() - start
+    print("Prestaged %d objects, %.1f MB in %.1f s"
+          % (len(sizes), sum(sizes) / 1e6, elapsed))
+
+
+def getStats(cacheUrl, reset=False):
+    import urllib3
+
+    response = urllib3.PoolManager().request(
+        "GET", cacheUrl.rstrip("/") + "/_stats" + ("?reset" if reset else ""))
+    return json.loads(response.data)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Node-local read-through cache for S3 datastore reads")
+    parser.add_argument("mode", choices=("serve", "prestage", "stats"),
+                        help="serve: run the cache; prestage: read the"
+                        " objects in the input lists through it; stats:"
+                        " print its counters")
+    parser.add_argument("inputs", nargs="*",
+                        help="files listing s3://bucket/key URIs, or"
+                        " prefixes ending in /, for prestage")
+    parser.add_argument("-r", "--root", default="/tmp/s3cache",
+                        help="cache directory")
+    parser.add_argument("-s", "--size", type=float, default=20,
+                        help="cache size in GB")
+    parser.add_argument("--maxObject", type=float, default=2,
+                        help="largest object to cache, in GB")
+    parser.add_argument("-p", "--port", type=int, default=8123,
+                        help="port to listen on, on localhost")
+    parser.add_argument("-u", "--upstream",
+                        default=os.environ.get(
+                            "S3_ENDPOINT_URL",
+                            "https://storage.googleapis.com"),
+                        help="S3 endpoint to read through to")
+    parser.add_argument("--region",
+                        default=os.environ.get("AWS_DEFAULT_REGION", "auto"),
+                        help="region to sign upstream requests for")
+    parser.add_argument("-c", "--cache", default="http://localhost:8123",
+                        help="URL of the cache, for prestage and stats")
+    parser.add_argument("-w", "--workers", type=int, default=32,
+                        help="concurrent prestage reads, or upstream"
+                        " connections when serving")
+    parser.add_argument("--reset", action="store_true",
+                        help="zero the counters after printing them, to"
+                        " report each run separately")
+    parser.add_argument("--json", action="store_true",
+                        help="print the counters as JSON")
+    args = parser.parse_intermixed_args()
+
+    if args.mode == "serve":
+        cache = Cache(args.root, int(args.size * 1e9))
+        server = CacheServer(("127.0.0.1", args.port), cache,
+                             Upstream(args.upstream, args.region,
+                                      args.workers),
+                             int(args.maxObject * 1e9))
+        print("Caching %s in %s on port %d" % (args.upstream, args.root,
+                                                server.server_address[1]),
+              flush=True)
+        # Print the counters when the node shuts down
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        printStats(cache.report())
+    elif args.mode == "prestage":
+        lines = []
+        for path in args.inputs:
+            with open(path) as f:
+                lines.extend(f)
+        prestage(args.cache, lines, args.workers)
+    else:
+        stats = getStats(args.cache, args.reset)
+        if args.json:
+            print(json.dumps(stats))
+        else:
+            printStats(stats)
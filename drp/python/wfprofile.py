@@ -0,0 +1,370 @@
+#!/usr/bin/env python
+
+import argparse
+import os
+import re
+import xml.etree.ElementTree as ET
+
+import profiles
+
+DAG_NODE = re.compile(r"DAG Node: (\S+)")
+HOST = re.compile(r"executing on host: <([^:>?]+)")
+QUANTUM_NODE = re.compile(r"q(\d+)$")
+NODE_TYPE = re.compile(r"[a-z]+(?:_[a-z]+)*")
+
+# Parts of the time of a job, from its parents finishing to its post script
+# finishing: DAGMan submission delay, Condor queue wait, file transfer,
+# pipetask outside the task (startup, registry and Butler set-up), the task
+# itself and the Pegasus post script.
+COMPONENTS = ("dagman", "queue", "transfer", "startup", "run", "post")
+
+
+def readDax(path):
+    """Read the jobs and dependencies of a DAX
+
+    Returns dicts by DAX job id of (task name, quantum number), taken from
+    the job stderr names, of CPU requests and of lists of parents.
+    """
+    quanta = {}
+    cpus = {}
+    parents = {}
+    refs = []
+    current = {}
+    for _, element in ET.iterparse(path, events=("end",)):
+        tag = element.tag.rpartition("}")[2]
+        if tag == "profile" and element.get("key") == "request_cpus":
+            current["cpus"] = int(element.text)
+        elif tag == "stderr":
+            m = profiles.LOG_NAME.match(element.get("name"))
+            if m:
+                current["quantum"] = (m.group(1), int(m.group(2)))
+        elif tag == "job":
+            if "quantum" in current:
+                quanta[element.get("id")] = current["quantum"]
+            cpus[element.get("id")] = current.get("cpus", 1)
+            current = {}
+            element.clear()
+        elif tag == "parent":
+            refs.append(element.get("ref"))
+        elif tag == "child":
+            parents[element.get("ref")] = refs
+            refs = []
+            element.clear()
+    return quanta, cpus, parents
+
+
+def readDag(path, parents):
+    """Add the dependencies in a DAGMan .dag file to parents, by node"""
+    with open(path) as f:
+        for line in f:
+            if line.startswith("PARENT "):
+                ps, _, cs = line[len("PARENT "):].partition(" CHILD ")
+                for child in cs.split():
+                    parents.setdefault(child, []).extend(ps.split())
+
+
+def readCondorLog(path, jobs):
+    """Add the times of the DAG node jobs in a Condor user log to jobs
+
+    For each node: its first submission, the start of its slot, which is
+    the start of input transfer or of execution, the end of execution,
+    the time spent transferring files, the execution host and the number
+    of evictions and holds.  Times are of the last execution if there
+    were several.
+    """
+    byId = {}
+    job = event = None
+    with open(path, errors="replace") as f:
+        for line in f:
+            if line.startswith("..."):
+                event = None
+                continue
+            m = profiles.EVENT.match(line)
+            if m:
+                event = m.group(1)
+                when = profiles.parseTimestamp(m.group(4))
+                if event == "000":
+                    job = byId[m.group(2), m.group(3)] = dict(submit=when)
+                    continue
+                job = byId.get((m.group(2), m.group(3)))
+                if job is None:
+                    event = None
+                elif event == "001":
+                    host = HOST.search(line)
+                    job["host"] = host.group(1) if host else "-"
+                    job.setdefault("start", when)
+                elif event == "040":
+                    if "Started transferring" in line:
+                        job.setdefault("start", when)
+                        job["transferStart"] = when
+                    elif "transferStart" in job:
+                        job["transfer"] = (job.get("transfer", 0) + when
+                                           - job.pop("transferStart"))
+                elif event in ("004", "012"):
+                    job["interruptions"] = job.get("interruptions", 0) + 1
+                    job.pop("start", None)
+                    job.pop("transfer", None)
+                elif event == "005":
+                    job["end"] = when
+                continue
+            if event == "000" and (m := DAG_NODE.search(line)):
+                # DAGMan resubmits a retried node as a new Condor job.
+                if m.group(1) in jobs:
+                    job["submit"] = jobs[m.group(1)]["submit"]
+                jobs[m.group(1)] = job
+
+
+def readJobstate(path, jobs):
+    """Add the post script times in a Pegasus jobstate.log to jobs"""
+    with open(path) as f:
+        for line in f:
+            words = line.split()
+            if len(words) < 3 or words[1] not in jobs:
+                continue
+            if words[2] == "POST_SCRIPT_TERMINATED":
+                jobs[words[1]]["postEnd"] = float(words[0])
+
+
+def readRun(directories, dax=None):
+    """Read the logs of a Pegasus run
+
+    Walks the directories, usually the submit and output directories, for
+    Condor user logs, jobstate.log, the .dag file and the per-quantum
+    log.<Task>.<NNNNNN>.out files.  Jobs of quanta get their task names
+    from the DAX or their logs; other jobs are typed by the start of their
+    node names.  Dependencies come from the .dag file, or the DAX if there
+    is none.  Returns a dict of jobs by DAG node name and a dict of lists
+    of their parents.
+    """
+    jobs = {}
+    parents = {}
+    jobstates = []
+    quantumLogs = {}
+    for directory in directories:
+        for dirpath, _, filenames in os.walk(directory):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                if (m := profiles.LOG_NAME.match(filename)):
+                    quantumLogs[int(m.group(2))] = (m.group(1), path)
+                elif filename == "jobstate.log":
+                    jobstates.append(path)
+                elif filename.endswith(".dag"):
+                    readDag(path, parents)
+                elif filename.endswith(".log") and profiles.isCondorLog(path):
+                    readCondorLog(path, jobs)
+    for path in jobstates:
+        readJobstate(path, jobs)
+
+    quanta, cpus, daxParents = readDax(dax) if dax else ({}, {}, {})
+    # Pegasus names the DAG node of DAX job <id> <transformation>_<id>.
+    nodeOfId = {}
+    for name, job in jobs.items():
+        id = name.rpartition("_")[2]
+        nodeOfId[id] = name
+        if id in quanta:
+            job["task"], job["quantum"] = quanta[id]
+        elif (m := QUANTUM_NODE.search(name)) and \
+                int(m.group(1)) in quantumLogs:
+            job["quantum"] = int(m.group(1))
+            job["task"] = quantumLogs[job["quantum"]][0]
+        else:
+            m = NODE_TYPE.match(name)
+            job["task"] = m.group(0) if m else name
+        job["cpus"] = cpus.get(id, 1)
+        if job.get("quantum") in quantumLogs:
+            # Time pipetask spent in the task itself; the rest of its
+            # execution is startup, registry queries and Butler set-up.
+            took = profiles.readJobLog(quantumLogs[job["quantum"]][1])
+            if "wall" in took:
+                job["took"] = took["wall"]
+
+    if not parents:
+        for child, ps in daxParents.items():
+            parents[nodeOfId.get(child, child)] = [nodeOfId.get(p, p)
+                                                    for p in ps]
+    return jobs, parents
+
+
+def analyze(jobs, parents):
+    """Break down the time of each completed job into COMPONENTS
+
+    A job becomes ready when the last of its parents, including its post
+    script, has finished, or at the first submission of the run.  Adds
+    "ready", "done" and a "times" dict to each completed job and returns
+    the completed jobs.
+    """
+    complete = dict((name, job) for name, job in jobs.items()
+                    if "start" in job and "end" in job)
+    if not complete:
+        raise RuntimeError("No completed jobs found")
+    origin = min(job["submit"] for job in complete.values())
+    for job in complete.values():
+        job["done"] = job.get("postEnd", job["end"])
+    for name, job in complete.items():
+        job["ready"] = max((complete[p]["done"] for p in parents.get(name, ())
+                            if p in complete), default=origin)
+        execution = job["end"] - job["start"] - job.get("transfer", 0)
+        run = min(job.get("took", execution), execution)
+        job["times"] = dict(
+            dagman=max(0.0, job["submit"] - job["ready"]),
+            queue=job["start"] - max(job["submit"], job["ready"]),
+            transfer=job.get("transfer", 0),
+            startup=execution - run,
+            run=run,
+            post=job["done"] - job["end"])
+    return complete
+
+
+def criticalPath(complete, parents):
+    """Return the realized critical path, from the first job to the last
+
+    Working back from the last job to finish, each step goes to the parent
+    that finished last, which is the one the job was waiting for.
+    """
+    name = max(complete, key=lambda n: complete[n]["done"])
+    path = [name]
+    while True:
+        ps = [p for p in parents.get(name, ()) if p in complete]
+        if not ps:
+            break
+        name = max(ps, key=lambda p: complete[p]["done"])
+        path.append(name)
+    path.reverse()
+    return path
+
+
+def spread(bins, start, end, origin, width, weight):
+    """Add weight for each second of [start, end) to time bins"""
+    first = int((start - origin) / width)
+    last = min(int((end - origin) / width), len(bins) - 1)
+    for i in range(first, last + 1):
+        overlap = (min(end, origin + (i + 1) * width)
+                   - max(start, origin + i * width))
+        if overlap > 0:
+            bins[i] += weight * overlap
+
+
+def timeline(complete, count, nodeCpus=None):
+    """Return the utilization of the execution hosts over time
+
+    Each host counts from the start of its first job to the end of its
+    last, with nodeCpus cores, or as many as it ran jobs on at once.
+    Returns the bin width and, for each of count bins, the mean number of
+    running jobs, busy cores, hosts and available cores.
+    """
+    origin = min(job["submit"] for job in complete.values())
+    end = max(job["done"] for job in complete.values())
+    width = max(end - origin, 1) / count
+    running = [0.0] * count
+    busy = [0.0] * count
+    hosts = [0.0] * count
+    cores = [0.0] * count
+    byHost = {}
+    for job in complete.values():
+        spread(running, job["start"], job["end"], origin, width, 1)
+        spread(busy, job["start"], job["end"], origin, width, job["cpus"])
+        byHost.setdefault(job.get("host", "-"), []).append(job)
+    for host, hostJobs in byHost.items():
+        if nodeCpus:
+            capacity = nodeCpus
+        else:
+            changes = sorted([(j["start"], j["cpus"]) for j in hostJobs]
+                             + [(j["end"], -j["cpus"]) for j in hostJobs])
+            capacity = inUse = 0
+            for _, change in changes:
+                inUse += change
+                capacity = max(capacity, inUse)
+        up = min(j["start"] for j in hostJobs)
+        down = max(j["end"] for j in hostJobs)
+        spread(hosts, up, down, origin, width, 1)
+        spread(cores, up, down, origin, width, capacity)
+    return width, [(r / width, b / width, h / width, c / width)
+                   for r, b, h, c in zip(running, busy, hosts, cores)]
+
+
+def report(complete, parents, bins, nodeCpus=None, csv=None):
+    """Print where the time of a run went"""
+    origin = min(job["submit"] for job in complete.values())
+    makespan = max(job["done"] for job in complete.values()) - origin
+    interrupted = sum(1 for job in complete.values()
+                      if job.get("interruptions"))
+    print("%d jobs completed in %.0f s, %d of them after eviction or hold"
+          % (len(complete), makespan, interrupted))
+
+    print()
+    print("Mean seconds per job by task")
+    print("%-36s %6s" % ("task", "jobs")
+          + "".join(" %9s" % c for c in COMPONENTS))
+    byTask = {}
+    for job in complete.values():
+        byTask.setdefault(job["task"], []).append(job["times"])
+    totals = dict((c, 0.0) for c in COMPONENTS)
+    for taskname, times in sorted(
+            byTask.items(), key=lambda item: -sum(t["transfer"] + t["startup"]
+                                                  + t["run"]
+                                                  for t in item[1])):
+        print("%-36s %6d" % (taskname, len(times))
+              + "".join(" %9.1f" % (sum(t[c] for t in times) / len(times))
+                        for c in COMPONENTS))
+        for c in COMPONENTS:
+            totals[c] += sum(t[c] for t in times)
+    total = sum(totals.values())
+    print("%-36s %6s" % ("share of job time", "")
+          + "".join(" %8.1f%%" % (100 * totals[c] / total)
+                    for c in COMPONENTS))
+
+    print()
+    path = criticalPath(complete, parents)
+    pathTotals = dict((c, sum(complete[n]["times"][c] for n in path))
+                      for c in COMPONENTS)
+    print("Realized critical path: %d jobs, %.0f s" % (len(path), makespan))
+    print("%-36s %-20s" % ("task", "node")
+          + "".join(" %9s" % c for c in COMPONENTS))
+    for name in path:
+        job = complete[name]
+        print("%-36s %-20s" % (job["task"], name[-20:])
+              + "".join(" %9.1f" % job["times"][c] for c in COMPONENTS))
+    print("%-36s %-20s" % ("total", "")
+          + "".join(" %9.1f" % pathTotals[c] for c in COMPONENTS))
+
+    print()
+    width, rows = timeline(complete, bins, nodeCpus)
+    print("Utilization in %.0f s bins" % width)
+    print("%8s %8s %8s %6s %6s" % ("time", "jobs", "cores", "hosts", "util"))
+    for i, (running, busy, hosts, cores) in enumerate(rows):
+        utilization = busy / cores if cores else 0
+        print("%8.0f %8.1f %8.1f %6.1f %5.0f%% %s"
+              % (i * width, running, busy, hosts, 100 * utilization,
+                 "#" * int(round(40 * utilization))))
+    used = sum(row[1] for row in rows)
+    available = sum(row[3] for row in rows)
+    print("Core utilization over the run: %.0f%%"
+          % (100 * used / available if available else 0))
+    if csv:
+        with open(csv, "w") as f:
+            print("time,jobs,cores,hosts,available", file=f)
+            for i, row in enumerate(rows):
+                print("%.0f,%.2f,%.2f,%.2f,%.2f" % ((i * width,) + row),
+                      file=f)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Report where the time of a Pegasus run went")
+    parser.add_argument("directories", nargs="+",
+                        help="submit and output directories of the run")
+    parser.add_argument("-x", "--dax", help="the DAX that was planned")
+    parser.add_argument("--bins", type=int, default=40,
+                        help="number of bins in the utilization timeline")
+    parser.add_argument("--nodeCpus", type=int,
+                        help="cores per execution host; by default, the most"
+                        " a host was seen to use at once")
+    parser.add_argument("--csv", help="write the timeline to this file")
+    args = parser.parse_args()
+
+    jobs, parents = readRun(args.directories, args.dax)
+    if not parents:
+        print("No .dag file or DAX with dependencies; jobs are taken to be"
+              " ready from the start of the run")
+    complete = analyze(jobs, parents)
+    report(complete, parents, args.bins, args.nodeCpus, args.csv)